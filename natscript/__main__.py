@@ -2,13 +2,14 @@
 """
 The entry point to the Natscript interpreter.
 """
+import functools
 import os
 import sys
 
 import natscript.cli
 from natscript import interpret
-from natscript.internal import token_
-from natscript.tokens_ import compiler
+from natscript.internal import lexer, token_
+from natscript.tokens_ import compiler, transpiler, vm
 from natscript.util import path
 
 argparser = natscript.cli.construct_parser()
@@ -22,25 +23,32 @@ if not arguments.args:
 
 filepath = arguments.args[0]
 sys.argv = arguments.args
+interpret.LEXER_TYPE = lexer.LEXERS[arguments.lexer]
+interpret.BACKEND = interpret.BACKENDS[arguments.backend]
 
-if arguments.compile == "True":
-    compiler_ = (
-        compiler.PickleCompiler()
-        if arguments.compiled_format == "pickle"
-        else compiler.JsonCompiler()
-    )
+# compiled files and the library bundle are only valid for tokens from the default lexer
+if arguments.compile == "True" and arguments.lexer == argparser.get_default("lexer"):
+    compiler_ = compiler.COMPILERS[arguments.compiled_format]()
     token_.Token.TOKEN_COMPILER = compiler_
     try:
         tokens = compiler_.read_compiled_file(filepath)
     except compiler.CompilerError:
         tokens = interpret.construct_tokens(filepath)
-    compiler_.write_compiled_file(tokens, filepath)
+        compiler_.write_compiled_file(tokens, filepath)
+    if arguments.backend == "python":
+        # caches the transpiled source next to the compiled file
+        interpret.BACKEND = functools.partial(
+            transpiler.run_tokens, filename=os.path.abspath(filepath)
+        )
 else:
     tokens = interpret.construct_tokens(filepath)
 
 if arguments.debug:
     for token in tokens:
         interpret.print_token_trace(token)
+    if arguments.backend == "vm":
+        # prints the disassembled register code before running it
+        interpret.BACKEND = functools.partial(vm.run_tokens, debug=True)
 
 with path.ChangeDir(folder=os.path.dirname(filepath)):
     interpret.interpret(tokens, arguments.iterations)
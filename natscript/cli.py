@@ -32,10 +32,26 @@ def construct_parser() -> argparse.ArgumentParser:
     parser.add_argument(
         "--compiled-format",
         "-f",
-        choices=["pickle", "json"],
-        default="pickle",
+        choices=["binary", "pickle", "json"],
+        default="binary",
         help="Specifies the format of the bytecode-compiled file",
     )
+    parser.add_argument(
+        "--lexer",
+        "-l",
+        choices=["regex", "split"],
+        default="regex",
+        help="Specifies the lexer used to split the source code into tokens "
+        "(other lexers than the default disable the bytecode compiler)",
+    )
+    parser.add_argument(
+        "--backend",
+        "-b",
+        choices=["tree", "closure", "linear", "python", "vm"],
+        default="tree",
+        help="Specifies how the tokens are run (tree-walking, compiled to closures, "
+        "linearised to instructions, transpiled to Python or compiled to register code)",
+    )
     parser.add_argument(
         "--iterations",
         "-i",
@@ -109,21 +109,21 @@ class UndefinedVariableException(RunTimeException):
 
 
 class ReturnException(RunTimeException):
-    """Exception to be raised by a RETURN token and caught by a CALL token"""
+    """Exception raised for a RETURN token outside of a function"""
 
     def __init__(self, token: Token):
         super().__init__(f"Did not expect token {token} at this location!")  # type: ignore
 
 
 class SkipElementException(RunTimeException):
-    """Exception raised by SKIP element, caught by FOR token"""
+    """Exception raised for a SKIP token outside of a FOR loop"""
 
     def __init__(self, token: Token):
         super().__init__(f"Did not expect token {token} at this location!")  # type: ignore
 
 
 class BreakIterationException(RunTimeException):
-    """Exception raised by BREAK element, caught by WHILE and FOR loops"""
+    """Exception raised for a BREAK token outside of a WHILE or FOR loop"""
 
     def __init__(self, token: Token):
         super().__init__(f"Did not expect token {token} at this location!")  # type: ignore
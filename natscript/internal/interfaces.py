@@ -6,7 +6,7 @@ Created on Sat Nov  6 13:44:51 2021
 """
 from __future__ import annotations
 
-from typing import Any, Dict, Iterable, List, Optional, Protocol, Tuple, Type
+from typing import Any, Deque, Dict, Iterable, List, Optional, Protocol, Tuple, Type
 
 # type: ignore
 # pylint: disable=duplicate-code
@@ -17,11 +17,13 @@ class Token(Protocol):
 
     value: Optional[Any]
     line: int
+    column: int
     tokens: List[Token]
     run_order: int
     parent: Optional[Token]
-    expected_tokens: List[ExpectedToken]
+    expected_state: int
     filepath: Optional[str]
+    has_all_optionals: bool
     functional: bool
     must_be_subtoken: bool
 
@@ -40,8 +42,8 @@ class Token(Protocol):
     def add_token(self, token: Token) -> None:
         """Adds the specified token to its subtokens"""
 
-    def pop_tokens(self, tokens: List[Token]) -> Optional[Token]:
-        """Removes any number of tokens from the passed list"""
+    def pop_tokens(self, tokens: Deque[Token]) -> Optional[Token]:
+        """Removes any number of tokens from the front of the passed deque"""
 
     def update_token_factory(self, token_factory: TokenFactory) -> None:
         """Updates the token factory"""
@@ -61,10 +63,6 @@ class Token(Protocol):
     def satisfied(self) -> bool:  # type: ignore
         """True if all mandatory tokens are contained"""
 
-    @property
-    def has_all_optionals(self) -> bool:  # type: ignore
-        """True if all expected tokens are contained"""
-
 
 class ExpectedToken(Protocol):
     """Protocol for expected token"""
@@ -73,22 +71,13 @@ class ExpectedToken(Protocol):
     run_order: int
     optional: bool
 
-    def pop_token_from(self, expected_tokens: List[ExpectedToken]) -> ExpectedToken:  # type: ignore
-        """Pops a token from the list and returns it"""
-
-    def copy(self) -> ExpectedToken:  # type: ignore
-        """Returns a copy of the current token"""
-
-    @property
-    def needs_copy(self) -> bool:  # type: ignore
-        """True if this token needs to be copied (True if mutable)"""
-
 
 class Value(Protocol):  # pylint: disable=too-few-public-methods
     """Protocol for interpreter stack Value objects"""
 
     value: Any
     inputs: Optional[List[Variable]]
+    layout: Optional[Dict[str, int]]
 
     def get_value(self) -> Any:
         """Returns the actual value of the Value"""
@@ -126,6 +115,7 @@ class Variable(Protocol):  # pylint: disable=too-few-public-methods
     value: Any
     name: str
     inputs: Optional[List[Variable]]
+    layout: Optional[Dict[str, int]]
 
     def get_value(self) -> Any:
         """Returns the actual value of the Variable"""
@@ -136,6 +126,9 @@ class Variable(Protocol):  # pylint: disable=too-few-public-methods
     def set_qualifier(self, name: str) -> None:
         """Sets the value of the qualifier to True"""
 
+    def copy(self) -> Variable:  # type: ignore
+        """Returns a new Variable bound to the same value"""
+
 
 class TokenFactory(Protocol):
     """Protocol for TokenFactory"""
@@ -173,14 +166,20 @@ class TokenFactory(Protocol):
 class Interpreter(Protocol):
     """Protocol for token interpreter"""
 
+    signal: Optional[Token]
+    signal_stack: List[Token]
+
     def run(self, token: Token) -> None:
         """Runs the token"""
 
     def init(self, token: Token) -> None:
         """Runs the token"""
 
-    def add_stack(self) -> None:
-        """Adds a new stack"""
+    def raise_signal(self) -> None:
+        """Resets the signal and raises the exception of the signalling token, if any"""
+
+    def add_stack(self, layout: Optional[Dict[str, int]] = None) -> None:
+        """Adds a new stack, with a variable scope using the frame layout if specified"""
 
     def remove_stack(self) -> None:
         """Removes the last stack"""
@@ -197,12 +196,20 @@ class Interpreter(Protocol):
     def get_variable(self, name: str) -> Variable:  # type: ignore
         """Returns the value of the variable specified by name"""
 
+    def get_variables(self) -> Dict[str, Variable]:  # type: ignore
+        """Returns the variables defined in the current variable scope"""
+
     def set_variable(self, name: str, variable: Variable) -> None:
         """Saves the variable specified by name and the corresponding Variable object"""
 
     def remove_variable(self, name: str) -> None:
         """Removes the variable identified by name from the current variable scope"""
 
+    def get_slots(  # type: ignore
+        self, layout: Optional[Dict[str, int]]
+    ) -> Optional[List[Optional[Variable]]]:
+        """Returns the variable slots of the current scope if it uses the frame layout"""
+
 
 class TokenCompiler(Protocol):
     """Protocol for token compiler"""
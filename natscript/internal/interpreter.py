@@ -4,7 +4,7 @@ Created on Fri Nov 20 17:17:11 2020
 
 @author: Korean_Crimson
 """
-from typing import Dict, List
+from typing import Dict, List, Optional, Set
 
 from natscript.internal import exceptions
 from natscript.internal.interfaces import Value, Variable
@@ -13,15 +13,104 @@ from natscript.internal.interfaces import Value, Variable
 from natscript.internal.token_ import Token
 
 
+class Scope(dict):
+    """Variable scope of a function call, containing the variables defined in the call.
+    Names not defined locally are looked up in the global scope, so creating a scope
+    does not need to copy the global variables.
+    """
+
+    __slots__ = ("globals_", "_removed")
+
+    def __init__(self, globals_: Dict[str, Variable]):
+        super().__init__()
+        self.globals_ = globals_
+        self._removed: Optional[Set[str]] = None
+
+    def __missing__(self, name: str) -> Variable:
+        if self._removed is not None and name in self._removed:
+            raise KeyError(name)
+        return self.globals_[name]
+
+    def __contains__(self, name: object) -> bool:
+        if dict.__contains__(self, name):
+            return True
+        return name in self.globals_ and (
+            self._removed is None or name not in self._removed
+        )
+
+    def __delitem__(self, name: str) -> None:
+        """Removes the variable, also hiding a global variable of the same name"""
+        if name not in self:
+            raise KeyError(name)
+        if dict.__contains__(self, name):
+            dict.__delitem__(self, name)
+        if name in self.globals_:
+            if self._removed is None:
+                self._removed = set()
+            self._removed.add(name)
+
+
+class SlotScope(Scope):
+    """Scope of a function call with a frame layout, mapping the variable names resolved
+    at init time to slot indices. Variables with a slot are stored in the slots list
+    instead of the dict, so tokens resolved to the layout can access them by index.
+    An empty slot (None) falls back to the global scope like an undefined local name.
+    """
+
+    __slots__ = ("layout", "slots")
+
+    def __init__(self, globals_: Dict[str, Variable], layout: Dict[str, int]):
+        super().__init__(globals_)
+        self.layout = layout
+        self.slots: List[Optional[Variable]] = [None] * len(layout)
+
+    def __missing__(self, name: str) -> Variable:
+        index = self.layout.get(name)
+        variable = None if index is None else self.slots[index]
+        return super().__missing__(name) if variable is None else variable
+
+    def __contains__(self, name: object) -> bool:
+        index = self.layout.get(name)  # type: ignore
+        if index is not None and self.slots[index] is not None:
+            return True
+        return super().__contains__(name)
+
+    def __setitem__(self, name: str, variable: Variable) -> None:
+        index = self.layout.get(name)
+        if index is None:
+            dict.__setitem__(self, name, variable)
+        else:
+            self.slots[index] = variable
+
+    def __delitem__(self, name: str) -> None:
+        index = self.layout.get(name)
+        if index is None or self.slots[index] is None:
+            super().__delitem__(name)
+            return
+        self.slots[index] = None
+        if name in self.globals_:
+            super().__delitem__(name)
+
+
 class Interpreter:
-    """Interprets tokens and keeps track of the program state"""
+    """Interprets tokens and keeps track of the program state.
+
+    Tokens interrupting the clauses being run (e.g. RETURN, BREAK) set themselves
+    as the signal, which is handled and reset by the enclosing CALL or loop.
+    The tokens a signal is passed up through are added to the signal stack,
+    which is the token stack of the exception raised if the signal cannot be handled.
+    """
 
     def __init__(self):
+        self.signal: Optional[Token] = None
+        self.signal_stack: List[Token] = []
         self._stacks: List[List[Value]] = [[]]
         self._variables: List[Dict[str, Variable]] = [{}]
         self._current_stack_pop = self._stacks[-1].pop.__call__
         self._current_stack_append = self._stacks[-1].append.__call__
         self._current_variables: Dict[str, Variable] = self._variables[-1]
+        self._current_layout: Optional[Dict[str, int]] = None
+        self._current_slots: Optional[List[Optional[Variable]]] = None
 
     def run(self, token: Token) -> None:
         """Runs the current token"""
@@ -41,22 +130,51 @@ class Interpreter:
             exc.token_stack.append(token)  # type: ignore
             raise exc
 
-    def add_stack(self) -> None:
-        """Adds a stack to the stack of stacks"""
+    def raise_signal(self) -> None:
+        """Resets the signal and raises the exception of the signalling token, if any.
+        Used where a signal cannot be handled, e.g. a BREAK outside of a loop.
+        """
+        signal, self.signal = self.signal, None
+        if signal is not None:
+            signal.raise_exception(self.signal_stack)  # type: ignore
+
+    def add_stack(self, layout: Optional[Dict[str, int]] = None) -> None:
+        """Adds a stack to the stack of stacks.
+        The variable scope of the stack uses the frame layout, if specified.
+        """
         self._stacks.append([])
-        globals_dict = self._variables[0].copy()
-        self._variables.append(globals_dict)
-        self._current_stack_pop = self._stacks[-1].pop.__call__
-        self._current_stack_append = self._stacks[-1].append.__call__
-        self._current_variables = self._variables[-1]
+        if layout is None:
+            self._variables.append(Scope(self._variables[0]))
+        else:
+            self._variables.append(SlotScope(self._variables[0], layout))
+        self._update_current_stack()
 
     def remove_stack(self) -> None:
         """Removes the last stack from the stack of stacks"""
         self._stacks.pop()
         self._variables.pop()
+        self._update_current_stack()
+
+    def _update_current_stack(self) -> None:
         self._current_stack_pop = self._stacks[-1].pop.__call__
         self._current_stack_append = self._stacks[-1].append.__call__
         self._current_variables = self._variables[-1]
+        if isinstance(self._current_variables, SlotScope):
+            self._current_layout = self._current_variables.layout
+            self._current_slots = self._current_variables.slots
+        else:
+            self._current_layout = None
+            self._current_slots = None
+
+    def get_slots(
+        self, layout: Optional[Dict[str, int]]
+    ) -> Optional[List[Optional[Variable]]]:
+        """Returns the variable slots of the current scope if it uses the specified
+        frame layout, else None. Empty slots need to be looked up by name.
+        """
+        if layout is self._current_layout:
+            return self._current_slots
+        return None
 
     def stack_pop(self) -> Value:
         """Pops and returns the last value on the stack.
@@ -86,10 +204,14 @@ class Interpreter:
         except KeyError:
             raise exceptions.UndefinedVariableException(name) from None
 
+    def get_variables(self) -> Dict[str, Variable]:
+        """Returns the variables defined in the current variable scope"""
+        return dict(self._current_variables)
+
     def set_variable(self, name: str, variable: Variable) -> None:
         """Sets the value of the variable identified by name to the specified variable."""
         self._current_variables[name] = variable
 
     def remove_variable(self, name: str) -> None:
         """Removes the variable identified by name from the current variable scope"""
-        self._current_variables.pop(name)
+        del self._current_variables[name]
@@ -6,7 +6,7 @@ Created on Fri Nov 20 13:51:53 2020
 """
 import re
 import uuid
-from typing import Generator, List
+from typing import Dict, Generator, List, Type
 
 from natscript.internal.interfaces import Token, TokenFactory
 
@@ -42,3 +42,48 @@ class Lexer:
         # split unless surrounded by double quotes (i.e. a string)
         string_tokens = [uuid_strings.get(s, s) for s in string.split(" ") if s != ""]
         return string_tokens
+
+
+class RegexLexer(Lexer):
+    """Single-pass lexer, scans the string once using a compiled master regex
+    and creates tokens annotated with their line and column positions.
+
+    Produces the same token strings as the Lexer, except that any whitespace
+    (not only spaces) separates tokens. Line breaks are always tokens of their own.
+    """
+
+    PATTERN = re.compile(
+        r'(?P<string>".*?")'
+        r"|(?P<linebreak>\n)"
+        r"|(?P<separator>[\[\]\{\}\,\#])"
+        r'|(?P<word>[^\s\[\]\{\},#"]+|")'
+        r"|(?P<whitespace>[^\S\n]+)",
+        flags=re.DOTALL,
+    )
+
+    def lex(self, string: str) -> Generator[Token, str, None]:
+        """Turns the string into a Token generator"""
+        line = 1
+        line_start = 0
+        for match in self.PATTERN.finditer(string):
+            kind = match.lastgroup
+            if kind == "whitespace":
+                continue
+
+            substring = match.group()
+            start = match.start()
+            self.token_factory.line_number = line
+            token = self.token_factory.create_token(substring)
+            token.column = start - line_start + 1
+            token.update_token_factory(self.token_factory)
+            yield token
+
+            if kind == "linebreak":
+                line += 1
+                line_start = match.end()
+            elif kind == "string" and "\n" in substring:
+                line += substring.count("\n")
+                line_start = start + substring.rindex("\n") + 1
+
+
+LEXERS: Dict[str, Type[Lexer]] = {"regex": RegexLexer, "split": Lexer}
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""
+This module contains the module registry of the Natscript interpreter, which keeps
+imported modules loaded for the rest of the process, like sys.modules.
+
+Public interface:
+
+    Module
+    ModuleRegistry:
+        get
+        add
+        reload
+
+"""
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+from natscript.internal.interfaces import Variable
+
+
+@dataclass
+class Module:
+    """Natscript or Python module that has been imported, with the variables it defines"""
+
+    path: str
+    variables: Dict[str, Variable]
+
+
+class ModuleRegistry:
+    """Registry of imported modules by resolved file path.
+    Each module is only loaded and run by its first import, later imports look it up here.
+    """
+
+    def __init__(self):
+        self._modules: Dict[str, Module] = {}
+
+    def __len__(self):
+        return len(self._modules)
+
+    def __contains__(self, path: str) -> bool:
+        return path in self._modules
+
+    def get(self, path: str) -> Optional[Module]:
+        """Returns the module imported from the path, if any"""
+        return self._modules.get(path)
+
+    def add(self, module: Module) -> None:
+        """Adds the module, replacing any module previously imported from the same path"""
+        self._modules[module.path] = module
+
+    def reload(self, path: Optional[str] = None) -> None:
+        """Removes the module imported from the path (or all modules if no path is
+        specified), so that it is loaded and run again by its next import.
+        Python modules are still cached in sys.modules, only their variables are rebound.
+        """
+        if path is None:
+            self._modules.clear()
+        else:
+            self._modules.pop(path, None)
@@ -4,8 +4,9 @@ Created on Fri Nov 20 14:34:15 2020
 
 @author: Korean_Crimson
 """
+from collections import deque
 from dataclasses import dataclass
-from typing import Generator, List
+from typing import Generator, Iterable, List
 
 from natscript.internal import exceptions
 from natscript.internal.interfaces import Token
@@ -44,14 +45,15 @@ class Parser:
     def __init__(self):
         self.token_stack = TokenStack()
 
-    def parse(self, tokens: List[Token]) -> Generator[Token, Token, None]:
+    def parse(self, tokens: Iterable[Token]) -> Generator[Token, Token, None]:
         """Constructs nested token trees by parsing the passed tokens"""
+        tokens = deque(tokens)
         while tokens:
             popped_tokens = tokens[0].pop_tokens(tokens)  # type: ignore
             if popped_tokens:
                 continue
 
-            token = tokens.pop(0)
+            token = tokens.popleft()
             if not self.token_stack:
                 self.token_stack.append(token)
                 continue
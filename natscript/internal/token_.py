@@ -6,12 +6,13 @@ Created on Sat Nov  6 12:04:45 2021
 """
 from __future__ import annotations
 
+import functools
 import re
+from collections import abc
 from dataclasses import dataclass, field
-from functools import cached_property
-from typing import Any, Dict, Hashable, Iterable, List, Optional, Tuple, Type
+from typing import Any, Deque, Dict, Hashable, Iterable, List, Optional, Tuple, Type
 
-from natscript.internal import exceptions, tokenvalue
+from natscript.internal import exceptions, modules, tokenvalue
 from natscript.internal.interfaces import Interpreter, TokenCompiler
 
 
@@ -21,25 +22,36 @@ class TokenFactory:
 
     tokens: Dict[str, Type[Token]] = field(default_factory=dict)
     regex_tokens: Dict[str, Type[Token]] = field(default_factory=dict)
+    regex_type_cache_size: int = 4096
 
     def __post_init__(self):
-        self._regex_patterns = [(re.compile(k), k) for k in self.regex_tokens]
+        self._regex_pattern, self._regex_types = _combine_patterns(self.regex_tokens)
+        # bounded, as every distinct literal in the source code is a separate lexeme
+        self._get_regex_type = functools.lru_cache(maxsize=self.regex_type_cache_size)(
+            self._match_regex_type
+        )
         self.line_number = 1
-        self._value_cache: Dict[Hashable, tokenvalue.Value] = {}
+        self._value_cache = tokenvalue.ValueCache()
         self._none_value = tokenvalue.NoneValue()
 
     def create_token(self, token: str) -> Token:
-        """Returns a Token matching the specified token string"""
-        if token in self.tokens:
-            token_type = self.tokens[token]
+        """Returns a Token matching the specified token string.
+
+        Keywords take priority over regex tokens. Regex tokens are classified
+        with a single match of the combined regex, in the order of regex_tokens.
+        """
+        token_type = self.tokens.get(token)
+        if token_type is not None:
             return token_type(value=None, line=self.line_number)
 
-        for pattern, key in self._regex_patterns:
-            if pattern.search(token):
-                token_type = self.regex_tokens[key]
-                return token_type(value=token, line=self.line_number)
+        token_type = self._get_regex_type(token)
+        return token_type(value=token, line=self.line_number)
 
-        raise exceptions.LexError(token, self.line_number) from None
+    def _match_regex_type(self, token: str) -> Type[Token]:
+        match = self._regex_pattern.match(token)
+        if match is None:
+            raise exceptions.LexError(token, self.line_number) from None
+        return self._regex_types[match.lastgroup]
 
     @staticmethod
     def create_variable(name: str) -> tokenvalue.Variable:
@@ -54,9 +66,12 @@ class TokenFactory:
     def create_any_value(self, value: Any) -> tokenvalue.Value:
         """Returns a new Value of the correct Value type.
         This method should be used for values that could be None or iterable.
+        Iterators, such as generators, are wrapped in a lazy Stream.
         """
         if value is None:
             return self.create_none_value()
+        if isinstance(value, abc.Iterator):
+            return self.create_iterable_value(tokenvalue.Stream(value))
 
         try:
             return self.create_value(value)
@@ -64,10 +79,11 @@ class TokenFactory:
             return self.create_iterable_value(value)
 
     def create_value(self, value: Hashable) -> tokenvalue.Value:
-        """Returns a new Value object if value cannot be found in the value cache,
-        otherwise returns the existing Value from the cache.
+        """Returns the shared Value from the value cache for bools, small ints and short
+        strings, otherwise returns a new Value object. Shared values are immutable,
+        tokens modifying a Value in place need to call Value.unshare first.
         """
-        return self._value_cache.get(value, tokenvalue.Value(value))
+        return self._value_cache.get(value)
 
     @staticmethod
     def create_iterable_value(value: Iterable[Any]) -> tokenvalue.IterableValue:
@@ -79,6 +95,27 @@ class TokenFactory:
         return self._none_value
 
 
+def _combine_patterns(
+    regex_tokens: Dict[str, Type[Token]]
+) -> Tuple[re.Pattern, Dict[str, Type[Token]]]:
+    """Combines the regex token patterns into one regex of named groups, such that
+    a match at the start of a string selects the same token type as searching
+    for each pattern in order.
+    """
+    if not regex_tokens:
+        return re.compile("(?!)"), {}
+
+    groups = []
+    types: Dict[str, Type[Token]] = {}
+    for index, (pattern, token_type) in enumerate(regex_tokens.items()):
+        name = f"_{index}"
+        # unanchored patterns may match anywhere, as with re.search
+        prefix = "" if pattern.startswith("^") else "(?s:.*?)"
+        groups.append(f"(?P<{name}>{prefix}(?:{pattern}))")
+        types[name] = token_type
+    return re.compile("|".join(groups)), types
+
+
 @dataclass
 class ExpectedToken:
     """Class to hold data about expected subtokens for tokens. Relevant to token parsing."""
@@ -87,18 +124,9 @@ class ExpectedToken:
     run_order: int = 0
     optional: bool = False
 
-    def pop_token_from(self, expected_tokens: List[ExpectedToken]) -> ExpectedToken:
-        """Pops the first token from the list."""
-        return expected_tokens.pop(0)
-
-    def copy(self) -> ExpectedToken:
-        """Returns itself."""
-        return self
-
-    @property
-    def needs_copy(self) -> bool:
-        """Always False"""
-        return False
+    def __post_init__(self):
+        if not isinstance(self.types, tuple):
+            self.types = (self.types,)
 
 
 class ExpectedTokenCombination:
@@ -106,40 +134,10 @@ class ExpectedTokenCombination:
     Relevant to token parsing.
     """
 
-    def __init__(
-        self, *tokens: ExpectedToken, optional: bool = False, copied: bool = False
-    ):
-        self.tokens = list(tokens)
+    def __init__(self, *tokens: ExpectedToken, optional: bool = False):
+        self.tokens: Tuple[ExpectedToken, ...] = tokens
         self.optional = optional
-        self.copied = copied
-
-    def pop_token_from(self, expected_tokens: List[ExpectedToken]) -> ExpectedToken:
-        """Pops the first token from its own expected tokens list, if it can, otherwise
-        from the specified expected_tokens list.
-        """
-        tokens = self.tokens if self.tokens else expected_tokens
-        return tokens.pop(0)
-
-    def copy(self) -> ExpectedTokenCombination:
-        """Returns a new ExpectedTokenCombination instance."""
-        return self.__class__(*self.tokens, optional=self.optional, copied=True)
-
-    @property
-    def needs_copy(self) -> bool:
-        """True if token was not copied yet."""
-        return not self.copied
-
-    @property
-    def types(self) -> Tuple[Type[Token], ...]:
-        """The tuple of expected Token types which can be used for typechecking
-        using isinstance during token parsing.
-        """
-        types: List[Type[Token]] = []
-        for token in self.tokens:
-            types.extend(token.types)
-            if not token.optional:
-                break
-        return tuple(types)
+        self.types = _get_leading_types(tokens)
 
     @property
     def run_order(self) -> int:
@@ -149,29 +147,146 @@ class ExpectedTokenCombination:
         return self.tokens[0].run_order
 
 
-class Token:
+def _get_leading_types(tokens: Iterable[ExpectedToken]) -> Tuple[Type[Token], ...]:
+    """Returns the tuple of types of the expected tokens up to and including
+    the first mandatory one.
+    """
+    types: List[Type[Token]] = []
+    for token in tokens:
+        types.extend(token.types)
+        if not token.optional:
+            break
+    return tuple(types)
+
+
+# (types, run_order, optional, next_state, next_optional)
+GrammarStep = Tuple[Tuple[Type["Token"], ...], int, bool, int, bool]
+
+
+class TokenGrammar:
+    """The parsing grammar of a Token class, compiled once from its EXPECTED_TOKENS
+    into immutable lookup tables indexed by parse state.
+
+    A parse state is the position in EXPECTED_TOKENS (and inside the current
+    ExpectedTokenCombination) up to which expected tokens have been consumed.
+    """
+
+    def __init__(self, expected_tokens: List[ExpectedToken]):
+        self.expected_tokens = expected_tokens
+        positions: List[Tuple[int, int]] = []
+        for i, expected_token in enumerate(expected_tokens):
+            inner_tokens = getattr(expected_token, "tokens", ())
+            positions.extend((i, j) for j in range(len(inner_tokens) + 1))
+        positions.append((len(expected_tokens), 0))
+        states = {position: state for state, position in enumerate(positions)}
+
+        self.final_state = len(positions) - 1
+        self.accepted_types = tuple(self._get_accepted_types(*x) for x in positions)
+        self.satisfied = tuple(
+            all(x.optional for x in expected_tokens[i:]) for i, _ in positions
+        )
+        self.steps: Tuple[GrammarStep, ...] = tuple(
+            self._get_step(i, j, states) for i, j in positions[:-1]
+        )
+
+    def _get_accepted_types(self, i: int, j: int) -> Tuple[Type[Token], ...]:
+        """Returns the types of all expected tokens remaining in the specified state"""
+        if i == len(self.expected_tokens):
+            return ()
+        expected_token = self.expected_tokens[i]
+        inner_tokens = getattr(expected_token, "tokens", None)
+        types = (
+            expected_token.types
+            if inner_tokens is None
+            else _get_leading_types(inner_tokens[j:])
+        )
+        remaining_types = (t for x in self.expected_tokens[i + 1 :] for t in x.types)
+        return types + tuple(remaining_types)
+
+    def _get_step(
+        self, i: int, j: int, states: Dict[Tuple[int, int], int]
+    ) -> GrammarStep:
+        """Returns the expected token consumed in the specified state and the state
+        transitioned to afterwards.
+        """
+        expected_token = self.expected_tokens[i]
+        inner_tokens = getattr(expected_token, "tokens", None)
+        if inner_tokens is not None and j < len(inner_tokens):
+            consumed = inner_tokens[j]
+            position = (i, j + 1)
+        elif inner_tokens is not None:
+            consumed = ExpectedToken((), 0, expected_token.optional)
+            position = (i + 1, 0)
+        else:
+            consumed = expected_token
+            position = (i + 1, 0)
+
+        next_index = position[0]
+        next_optional = (
+            next_index < len(self.expected_tokens)
+            and self.expected_tokens[next_index].optional
+        )
+        return (
+            consumed.types,
+            consumed.run_order,
+            consumed.optional,
+            states[position],
+            next_optional,
+        )
+
+
+class TokenMeta(type):
+    """Metaclass giving every Token class __slots__, so that tokens do not carry an
+    instance __dict__. Classes needing extra attributes declare them in __slots__.
+    """
+
+    def __new__(mcs, name, bases, namespace, **kwargs):
+        namespace.setdefault("__slots__", ())
+        return super().__new__(mcs, name, bases, namespace, **kwargs)
+
+
+class Token(metaclass=TokenMeta):
     """Token class, a composite (can contain any number of nested subtokens)
     that is runnable by the Interpreter.
     """
 
+    __slots__ = (
+        "value",
+        "line",
+        "column",
+        "tokens",
+        "run_order",
+        "parent",
+        "expected_state",
+        "sorted_tokens",
+        "runnable",
+        "filepath",
+        "has_all_optionals",
+    )
+
     EXPECTED_TOKENS: List[ExpectedToken] = []  # type: ignore
+    GRAMMAR: Optional[TokenGrammar] = None
     TOKEN_FACTORY: TokenFactory = TokenFactory()
     TOKEN_COMPILER: TokenCompiler = None
+    MODULE_REGISTRY: modules.ModuleRegistry = modules.ModuleRegistry()
     functional = True
     must_be_subtoken = False
 
     def __init__(self, value: Optional[Any] = None, line: int = 0):
         self.value: Optional[Any] = self._convert_value(value)
         self.line: int = line
+        self.column: int = 0
         self.tokens: List[Token] = []
         self.run_order: int = 0
         self.parent: Optional[Token] = None
-        self.expected_tokens = self.EXPECTED_TOKENS[:]
-        self.sorted_tokens = None
+        self.get_grammar()
+        self.expected_state: int = 0
+        self.sorted_tokens: Tuple[Token, ...] = ()
         self.runnable = (
             self.functional and self._run.__code__ is not Token._run.__code__
         )
         self.filepath: Optional[str] = None
+        self.has_all_optionals = False
 
     def __repr__(self):
         value = "" if self.value is None else f", {self.value}"
@@ -183,33 +298,56 @@ class Token:
         return value
 
     def init(self, interpreter: Interpreter):
-        """Initialises all subtokens, then itself"""
+        """Initialises all subtokens, then itself.
+        Parsing is complete at this point, so the subtokens are frozen into a tuple
+        and the parent reference is dropped.
+        """
+        self.tokens = tuple(self.tokens)  # type: ignore
         for token in self.tokens:
             if token.functional:
                 interpreter.init(token)  # type: ignore
-        self.sorted_tokens = sorted(
-            (x for x in self.tokens if x.functional),
-            key=lambda x: x.run_order,
+        self.sorted_tokens = tuple(
+            sorted(
+                (x for x in self.tokens if x.functional),
+                key=lambda x: x.run_order,
+            )
         )
+        # FIXME: only works for tokens with one or less ExpectedTokenCombination in it
+        self.has_all_optionals = len(self.tokens) >= len(self.EXPECTED_TOKENS)
+        self.parent = None
         self._init(interpreter)
 
     def _init(self, interpreter: Interpreter):
         """Initialises the token"""
 
     def run(self, interpreter: Interpreter):
-        """Runs all subtokens, then itself"""
-        for token in self.sorted_tokens:
-            interpreter.run(token)  # type: ignore
+        """Runs all subtokens, then itself.
+        Like Interpreter.run, adds the subtoken being run to the token stack of runtime
+        exceptions, but sets up the exception handler once for all subtokens.
+        """
+        try:
+            for token in self.sorted_tokens:
+                token.run(interpreter)
+        except exceptions.RunTimeException as exc:
+            exc.token_stack.append(token)  # pylint: disable=undefined-loop-variable
+            raise
         if self.runnable:
             self._run(interpreter)
 
     def _run(self, interpreter: Interpreter):
         """Runs the token"""
 
+    @classmethod
+    def get_grammar(cls) -> TokenGrammar:
+        """Returns the parsing grammar compiled from the class EXPECTED_TOKENS"""
+        grammar = cls.GRAMMAR
+        if grammar is None or grammar.expected_tokens is not cls.EXPECTED_TOKENS:
+            grammar = cls.GRAMMAR = TokenGrammar(cls.EXPECTED_TOKENS)
+        return grammar
+
     def check_optional_token(self, token: Token) -> bool:
         """Returns True if the passed token could syntactically be the next subtoken"""
-        all_types = tuple(t for token in self.expected_tokens for t in token.types)
-        return isinstance(token, all_types)
+        return isinstance(token, self.GRAMMAR.accepted_types[self.expected_state])
 
     def add_token(self, token: Token):
         """Adds the passed token as a subtoken.
@@ -221,8 +359,8 @@ class Token:
         self.tokens.append(token)
         token.parent = self
 
-    def pop_tokens(self, tokens: List[Token]) -> Optional[Token]:
-        """Optionally pops any number of tokens from the list"""
+    def pop_tokens(self, tokens: Deque[Token]) -> Optional[Token]:
+        """Optionally pops any number of tokens from the front of the deque"""
 
     def update_token_factory(self, token_factory: TokenFactory) -> None:
         """Optionally updates the token factory."""
@@ -232,23 +370,21 @@ class Token:
         raise exceptions.SyntaxException(self) from None  # type: ignore
 
     def _check_types(self, token: Token):
-        while self.expected_tokens:
-            if self.expected_tokens[0].needs_copy:
-                self.expected_tokens[0] = self.expected_tokens[0].copy()
-            expected_token = self.expected_tokens[0].pop_token_from(
-                self.expected_tokens
-            )
-            if isinstance(token, expected_token.types):
-                token.run_order = expected_token.run_order
+        steps = self.GRAMMAR.steps
+        final_state = self.GRAMMAR.final_state
+        state = self.expected_state
+        while state != final_state:
+            types, run_order, optional, state, next_optional = steps[state]
+            self.expected_state = state
+            if isinstance(token, types):
+                token.run_order = run_order
                 return
 
-            if not self.expected_tokens:
+            if state == final_state:
                 break
 
-            if not expected_token.optional and not self.expected_tokens[0].optional:
-                raise exceptions.ParseTypeError(
-                    token, expected_token.types  # type: ignore
-                ) from None
+            if not optional and not next_optional:
+                raise exceptions.ParseTypeError(token, types) from None  # type: ignore
         raise exceptions.ParseException(token) from None  # type: ignore
 
     @property
@@ -258,28 +394,19 @@ class Token:
 
     @property
     def full(self) -> bool:
-        """True if no expected_tokens are left"""
-        return not self.expected_tokens
+        """True if no expected tokens are left"""
+        return self.expected_state == self.GRAMMAR.final_state
 
     @property
     def satisfied(self) -> bool:
         """True if only optional expected tokens are left, if any."""
-        mandatory_tokens = [
-            token for token in self.expected_tokens if not token.optional
-        ]
-        return not mandatory_tokens
+        return self.GRAMMAR.satisfied[self.expected_state]
 
     @property
     def fully_satisfied(self) -> bool:
         """True if self.satisfied and all children are fully satisfied"""
         return self.satisfied and all(x.fully_satisfied for x in self.tokens)
 
-    @cached_property
-    def has_all_optionals(self) -> bool:
-        """True if length of tokens matches length of expected tokens"""
-        # FIXME: only works for tokens with one or less ExpectedTokenCombination in it
-        return len(self.tokens) >= len(self.EXPECTED_TOKENS)
-
 
 class ClauseToken(Token):
     """Base class for tokens with a defined start and end token containing any number
@@ -312,6 +439,6 @@ class ClauseToken(Token):
 class SkipToken(Token):
     """Base class for tokens that remove themselves from the token list during parsing."""
 
-    def pop_tokens(self, tokens: List[Token]) -> Optional[Token]:
-        """Pops the first token from the list"""
-        return tokens.pop(0)
+    def pop_tokens(self, tokens: Deque[Token]) -> Optional[Token]:
+        """Pops the first token from the deque"""
+        return tokens.popleft()
@@ -4,7 +4,9 @@ Created on Tue Dec 14 21:51:28 2021
 
 @author: richa
 """
-from typing import Any, Dict, List, Optional
+import itertools
+from collections import OrderedDict, abc
+from typing import Any, Dict, Hashable, Iterable, Iterator, List, Optional, Tuple, Type
 
 from natscript.internal import exceptions
 
@@ -14,6 +16,7 @@ class Value:
 
     __slots__ = ("value",)
     inputs = None
+    layout = None
 
     def __init__(self, value: Any = None):
         self.value = value
@@ -26,6 +29,12 @@ class Value:
         """Negates its value"""
         self.value = not self.value
 
+    def unshare(self) -> "Value":
+        """Returns a Value that may be mutated in place, which is the Value itself
+        unless it is shared.
+        """
+        return self
+
     def __repr__(self):
         if isinstance(self.value, bool):
             return str(self.value).lower()
@@ -38,16 +47,242 @@ class Value:
         return repr(self)
 
 
+class SharedValue(Value):
+    """Value interned by a ValueCache and shared by all users of the same value.
+    It must never be mutated in place, unshare returns a private copy instead.
+    """
+
+    __slots__ = ()
+
+    def unshare(self) -> Value:
+        return Value(self.value)
+
+
+class ValueCache:
+    """Bounded LRU cache interning SharedValues for bools, small ints and short strings.
+    Other values are wrapped in a new Value on every call.
+    """
+
+    MIN_INT = -256
+    MAX_INT = 1024
+    MAX_STRING_LENGTH = 64
+
+    def __init__(self, maxsize: int = 4096):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._values: OrderedDict[Tuple[Type, Hashable], SharedValue] = OrderedDict()
+
+    def __len__(self):
+        return len(self._values)
+
+    def get(self, value: Hashable) -> Value:
+        """Returns the SharedValue for the specified value if it can be interned,
+        else a new Value. Raises TypeError if value is not hashable.
+        """
+        type_ = type(value)
+        if type_ is int:
+            internable = self.MIN_INT <= value <= self.MAX_INT
+        elif type_ is str:
+            internable = len(value) <= self.MAX_STRING_LENGTH
+        else:
+            internable = type_ is bool
+            if not internable:
+                hash(value)
+        if not internable:
+            return Value(value)
+
+        key = (type_, value)  # keeps equal values of different types apart, e.g. 1 and True
+        shared_value = self._values.get(key)
+        if shared_value is not None:
+            self.hits += 1
+            self._values.move_to_end(key)
+            return shared_value
+
+        self.misses += 1
+        shared_value = self._values[key] = SharedValue(value)
+        if len(self._values) > self.maxsize:
+            self._values.popitem(last=False)
+        return shared_value
+
+
+class LazyRange(abc.MutableSequence):  # pylint: disable=too-many-ancestors
+    """Sequence of the integers in a range, which behaves like the list of its integers.
+    Until it is first mutated, it only holds the range, so that it takes constant memory
+    and its length, indices, slices and membership tests take constant time.
+    It then turns into that list in place, so that all references see the change.
+    """
+
+    __slots__ = ("_range", "_list")
+    __hash__ = None  # unhashable, like lists
+
+    def __init__(self, range_: range):
+        self._range = range_
+        self._list: Optional[List[Any]] = None
+
+    @property
+    def _items(self):
+        return self._range if self._list is None else self._list
+
+    def materialise(self) -> List[Any]:
+        """Turns the sequence into the list of its integers, which it then holds,
+        and returns that list.
+        """
+        if self._list is None:
+            self._list = list(self._range)
+        return self._list
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __getitem__(self, index):
+        item = self._items[index]
+        return LazyRange(item) if item.__class__ is range else item
+
+    def __iter__(self) -> Iterator[Any]:
+        return iter(self._items)
+
+    def __reversed__(self) -> Iterator[Any]:
+        return reversed(self._items)
+
+    def __contains__(self, value: Any) -> bool:
+        return value in self._items
+
+    def index(self, value: Any, *args) -> int:
+        return self._items.index(value, *args)
+
+    def count(self, value: Any) -> int:
+        return self._items.count(value)
+
+    def __setitem__(self, index, value: Any) -> None:
+        self.materialise()[index] = value
+
+    def __delitem__(self, index) -> None:
+        del self.materialise()[index]
+
+    def insert(self, index: int, value: Any) -> None:
+        self.materialise().insert(index, value)
+
+    def append(self, value: Any) -> None:
+        self.materialise().append(value)
+
+    def extend(self, values: Iterable[Any]) -> None:
+        self.materialise().extend(values)
+
+    def pop(self, index: int = -1) -> Any:
+        return self.materialise().pop(index)
+
+    def remove(self, value: Any) -> None:
+        self.materialise().remove(value)
+
+    def reverse(self) -> None:
+        self.materialise().reverse()
+
+    def sort(self, **kwargs) -> None:
+        """Sorts the sequence in place, see list.sort"""
+        self.materialise().sort(**kwargs)
+
+    def __eq__(self, other: Any) -> bool:
+        if isinstance(other, LazyRange):
+            if self._list is None and other._list is None:
+                return self._range == other._range
+            return list(self) == list(other)
+        if isinstance(other, list):
+            return len(self) == len(other) and list(self) == other
+        return NotImplemented
+
+    def __lt__(self, other: Any) -> bool:
+        return list(self) < _as_list(other)
+
+    def __le__(self, other: Any) -> bool:
+        return list(self) <= _as_list(other)
+
+    def __gt__(self, other: Any) -> bool:
+        return list(self) > _as_list(other)
+
+    def __ge__(self, other: Any) -> bool:
+        return list(self) >= _as_list(other)
+
+    def __add__(self, other: Any) -> List[Any]:
+        return list(self) + _as_list(other)
+
+    def __radd__(self, other: Any) -> List[Any]:
+        return _as_list(other) + list(self)
+
+    def __mul__(self, other: Any) -> List[Any]:
+        return list(self) * other
+
+    __rmul__ = __mul__
+
+    def __repr__(self):
+        return repr(list(self._items))
+
+
+def _as_list(value: Any) -> Any:
+    return list(value) if isinstance(value, LazyRange) else value
+
+
+class Stream:
+    """Lazy sequence of values produced by an iterator, such as the lines of a file.
+    It can only be iterated once and is never materialised, so that it takes constant memory.
+    Slicing it returns a new Stream over the sliced values.
+    """
+
+    __slots__ = ("_iterator",)
+
+    def __init__(self, iterable: Iterable[Any]):
+        self._iterator = iter(iterable)
+
+    def __iter__(self) -> Iterator[Any]:
+        return self._iterator
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            raise TypeError("Streams can only be sliced")
+        if any(x is not None and x < 0 for x in (index.start, index.stop)):
+            raise IndexError("Streams cannot be sliced from the end")
+        return Stream(itertools.islice(self._iterator, index.start, index.stop, index.step))
+
+    def __repr__(self):
+        return "stream"
+
+
+LAZY_TYPES = (LazyRange, Stream)
+
+
 class IterableValue(Value):
-    """Value wrapper for lists"""
+    """Value wrapper for lists.
+    The actual values of the list are cached, so that get_value only needs to copy them.
+    The cache is cleared when a new list is assigned to value, a list mutated in place
+    needs to be invalidated.
+    """
+
+    __slots__ = ("_source", "_unwrapped")
+
+    def __init__(self, value: Any = None):
+        super().__init__(value)
+        self._source: Any = None
+        self._unwrapped: Any = None
 
     def get_value(self) -> List[Any]:
-        """Returns a list of actual values contained in the list.
+        """Returns a new list of actual values contained in the list.
         Converts any contained Value objects into their respective value.
+        A LazyRange or Stream is returned as is, as it only contains plain values.
         """
-        if isinstance(self.value, dict):
-            return {k: self.get_item_value(v) for k, v in self.value.items()}
-        return [self.get_item_value(x) for x in self.value]
+        value = self.value
+        if value is not self._source:
+            if isinstance(value, dict):
+                unwrapped = {k: self.get_item_value(v) for k, v in value.items()}
+            elif value.__class__ in LAZY_TYPES:
+                return value
+            else:
+                unwrapped = [self.get_item_value(x) for x in value]
+            self._source, self._unwrapped = value, unwrapped
+        return self._unwrapped.copy()
+
+    def invalidate(self) -> None:
+        """Clears the cached actual values, after the list was mutated in place"""
+        self._source = None
 
     @staticmethod
     def get_item_value(value: Value):
@@ -76,12 +311,13 @@ class NoneValue(Value):
 class Variable(Value):
     """Variable class for variables living in interpreter variable scopes"""
 
-    __slots__ = ("name", "inputs", "is_structure", "_qualifiers")
+    __slots__ = ("name", "inputs", "layout", "is_structure", "_qualifiers")
 
     def __init__(self, name: str):  # pylint: disable=super-init-not-called
         self.name = name
         self.value = None
         self.inputs = None
+        self.layout: Optional[Dict[str, int]] = None
         self.is_structure = False
         self._qualifiers: Optional[Dict[str, bool]] = None
 
@@ -109,6 +345,22 @@ class Variable(Value):
         """Returns the value of the specified qualifier"""
         return self._qualifiers and self._qualifiers.get(qualifier, False)
 
+    def copy(self) -> "Variable":
+        """Returns a new variable bound to the same value, inputs, layout and qualifiers,
+        which can be redefined without affecting this variable.
+        """
+        variable = self._create_copy()
+        variable.inputs = self.inputs
+        variable.layout = self.layout
+        variable.is_structure = self.is_structure
+        variable._qualifiers = None if self._qualifiers is None else dict(self._qualifiers)
+        return variable
+
+    def _create_copy(self) -> "Variable":
+        variable = Variable(self.name)
+        variable.value = self.value
+        return variable
+
 
 class Constant(Variable):
     """Variable with a value that cannot be changed once set"""
@@ -128,3 +380,8 @@ class Constant(Variable):
         if self._value is not None:
             raise exceptions.RunTimeException("Cannot assign new value to a constant!")
         self._value = value
+
+    def _create_copy(self) -> "Variable":
+        constant = Constant(Variable(self.name))
+        constant.value = self.value
+        return constant
@@ -7,20 +7,24 @@ Created on Tue Dec 14 21:51:28 2021
 import os
 import sys
 from dataclasses import dataclass, field
-from typing import List, Optional
+from typing import Callable, Dict, List, Optional, Type
 
 from natscript import VERSION
 from natscript.internal import exceptions, lexer, parsing, token_, tokenvalue
 from natscript.internal.interpreter import Interpreter
-from natscript.tokens_ import tokens
+from natscript.tokens_ import closures, compiler, linear, tokens, transpiler, vm
+
+
+LEXER_TYPE: Type[lexer.Lexer] = lexer.RegexLexer
+LIBRARY_DIRECTORY = os.path.abspath(
+    os.path.join(os.path.dirname(__file__), "..", "natscript_lib")
+)
+LIBRARY_BUNDLE = compiler.LibraryBundle(LIBRARY_DIRECTORY)
 
 
 def construct_tokens_from_string(code: str) -> List[token_.Token]:
     """Constructs a list of nested tokens from the specified code string"""
-    token_factory = token_.TokenFactory(
-        tokens.get_tokens(), tokens.get_regex_tokens()  # type: ignore
-    )
-    lex = lexer.Lexer(token_factory)
+    lex = create_lexer()
     parser = parsing.Parser()
     tokens_ = list(lex.lex(code))
     syntax_blocks = list(parser.parse(tokens_))
@@ -31,14 +35,12 @@ def construct_tokens(filepath: str) -> List[token_.Token]:
     """Reads in the source code at the filepath and returns a list of nested tokens
     constructed from the parsed code.
     """
-    token_factory = token_.TokenFactory(
-        tokens.get_tokens(), tokens.get_regex_tokens()  # type: ignore
-    )
-    lex = lexer.Lexer(token_factory)
+    lex = create_lexer()
     parser = parsing.Parser()
 
     code = read_file(filepath)
     tokens_ = list(lex.lex(code))
+    filepath = sys.intern(filepath)
     for token in tokens_:
         token.filepath = filepath
 
@@ -46,6 +48,14 @@ def construct_tokens(filepath: str) -> List[token_.Token]:
     return syntax_blocks  # type: ignore
 
 
+def create_lexer(lexer_type: Optional[Type[lexer.Lexer]] = None) -> lexer.Lexer:
+    """Returns a new lexer of the specified type (defaults to LEXER_TYPE)"""
+    token_factory = token_.TokenFactory(
+        tokens.get_tokens(), tokens.get_regex_tokens()  # type: ignore
+    )
+    return (lexer_type or LEXER_TYPE)(token_factory)
+
+
 def run_interactive_shell():
     """Opens an interactive natscript shell"""
     interpreter = Interpreter()
@@ -67,7 +77,7 @@ def interpret(
     """
     add_lib_to_path()
     inter = interpreter or Interpreter()
-    run_tokens(syntax_blocks, inter, iterations=iterations)
+    BACKEND(syntax_blocks, inter, iterations=iterations)
 
 
 def run_tokens(
@@ -81,8 +91,26 @@ def run_tokens(
 
     runnables = flatten_syntax_blocks(syntax_blocks)
     for _ in range(iterations):
-        for syntax_block in runnables:
-            interpreter.run(syntax_block)
+        try:
+            for syntax_block in runnables:
+                syntax_block.run(interpreter)
+                if interpreter.signal is not None:
+                    interpreter.signal_stack.append(syntax_block)
+                    break
+        except exceptions.RunTimeException as exc:
+            exc.token_stack.append(syntax_block)  # pylint: disable=undefined-loop-variable
+            raise
+        interpreter.raise_signal()
+
+
+BACKENDS: Dict[str, Callable[..., None]] = {
+    "tree": run_tokens,
+    "closure": closures.run_tokens,
+    "linear": linear.run_tokens,
+    "python": transpiler.run_tokens,
+    "vm": vm.run_tokens,
+}
+BACKEND: Callable[..., None] = run_tokens
 
 
 def add_lib_to_path():
@@ -103,7 +131,8 @@ def flatten_syntax_blocks(syntax_blocks: List[token_.Token]) -> List[token_.Toke
         for child in syntax_block.sorted_tokens:
             flatten(child)
         if syntax_block.runnable:
-            syntax_block.run = syntax_block._run  # pylint: disable=protected-access
+            # children are run from the flattened list, so the token only runs itself
+            syntax_block.sorted_tokens = ()
             flattened.append(syntax_block)
 
     flattened = []
@@ -114,14 +143,17 @@ def flatten_syntax_blocks(syntax_blocks: List[token_.Token]) -> List[token_.Toke
 
 def read_file(filepath: str) -> str:
     """Reads the specified file and returns its contents"""
+    with open(find_file(filepath), "r", encoding="utf-8") as file:
+        return file.read()
+
+
+def find_file(filepath: str) -> str:
+    """Returns the path of the specified file in the first search path containing it"""
     search_paths = get_search_paths()
     for path in search_paths:
         full_filepath = os.path.join(path, filepath)
-        if not os.path.isfile(full_filepath):
-            continue
-
-        with open(full_filepath, "r", encoding="utf-8") as file:
-            return file.read()
+        if os.path.isfile(full_filepath):
+            return full_filepath
     raise FileNotFoundError from None
 
 
@@ -130,10 +162,7 @@ def get_search_paths() -> List[str]:
 
     Note: additional search paths can be specified using the environment variable NATSCRIPT_PATH
     (semi-colon separated list of paths)."""
-    search_paths = [
-        "",
-        os.path.join(os.path.abspath(os.path.dirname(__file__)), "..", "natscript_lib"),
-    ]
+    search_paths = ["", LIBRARY_DIRECTORY]
     env_path = os.getenv("NATSCRIPT_PATH")
     if env_path is not None:
         search_paths.extend(env_path.split(";"))
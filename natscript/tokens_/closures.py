@@ -0,0 +1,542 @@
+# -*- coding: utf-8 -*-
+"""
+This module contains the closure compiler for the Natscript interpreter.
+
+The closure compiler turns initialised token trees into nested Python closures.
+Instead of passing values through the interpreter stack, the closure of a token
+calls the closures of its subtokens and uses their return values directly.
+Tokens without a closure implementation are run as tokens, so the compiled closures
+leave the same values on the interpreter stack as running the tokens would.
+
+Public interface:
+
+    ClosureCompiler:
+        compile_statement
+        compile_expression
+        compile_condition
+
+    run_tokens
+
+"""
+from typing import Any, Callable, Dict, List, Optional, Tuple, Type, TypeVar
+
+from natscript.internal import exceptions
+from natscript.internal.interfaces import Interpreter, Value
+from natscript.internal.token_ import Token
+from natscript.tokens_ import tokens
+
+# pylint: disable=protected-access
+
+Statement = Callable[[Interpreter], None]
+Expression = Callable[[Interpreter], Value]
+Condition = Callable[[Interpreter, Value], Value]
+Closure = TypeVar("Closure", Statement, Expression)
+
+# tokens consuming values pushed on the stack before them or not pushing a value
+STACK_DEPENDENT_TOKENS = (tokens.CONDITION, tokens.END, tokens.ROUND)
+
+LITERAL_TOKENS = (
+    tokens.INTEGER,
+    tokens.FLOAT,
+    tokens.STRING,
+    tokens.TRUE,
+    tokens.FALSE,
+    tokens.NOTHING,
+)
+
+
+class NotCompilable(Exception):
+    """Raised when a token cannot be compiled to the requested kind of closure"""
+
+
+class CompiledClause:
+    """The compiled statements of a clause"""
+
+    __slots__ = ("token", "statements")
+
+    def __init__(self, token: Token, statements: Tuple[Statement, ...]):
+        self.token = token
+        self.statements = statements
+
+    def __repr__(self):
+        return repr(self.token)
+
+    def run(self, interpreter: Interpreter) -> None:
+        """Runs the statements, until a token sets the interpreter signal"""
+        for statement in self.statements:
+            statement(interpreter)
+            if interpreter.signal is not None:
+                # the token is only looked up for signals, to keep the loop fast
+                index = self.statements.index(statement)
+                interpreter.signal_stack.append(self.token.sorted_tokens[index])
+                return
+
+
+class ClosureCompiler:
+    """Compiles initialised tokens to closures.
+
+    Statements run a token, leaving the same values on the interpreter stack
+    as Token.run. Expressions return the value a token would push on the stack.
+    Conditions compare a value to the value of their subtoken, like CONDITION tokens
+    do for the value pushed on the stack before them.
+
+    Traced closures add their token to the token stack of runtime exceptions,
+    like Interpreter.run does for the tokens it runs.
+    """
+
+    def __init__(self):
+        self._statements: Dict[Type[Token], Callable[[Token, bool], Statement]] = {
+            tokens.SET: self._compile_set,
+            tokens.ADD: self._compile_operation,
+            tokens.SUBTRACT: self._compile_operation,
+            tokens.MULTIPLY: self._compile_operation,
+            tokens.DIVIDE: self._compile_operation,
+            tokens.PRINT: self._compile_print,
+            tokens.APPEND: self._compile_append,
+            tokens.GET: self._compile_get,
+            tokens.CALL: self._compile_call,
+            tokens.IF: self._compile_if,
+            tokens.WHILE: self._compile_while,
+            tokens.FOR: self._compile_for,
+            tokens.ROUND: self._compile_round,
+        }
+        self._expressions: Dict[Type[Token], Callable[[Token, bool], Expression]] = {
+            tokens.VARNAME: self._compile_varname,
+            tokens.IT: self._compile_varname,
+            tokens.RESULT: self._compile_result,
+            tokens.CHECK: self._compile_check,
+            tokens.NOT: self._compile_not,
+            tokens.LENGTH: self._compile_length,
+            tokens.COLLECTION: self._compile_collection,
+            tokens.CLAUSE: self._compile_clause,
+            tokens.FUNCTION: self._compile_function,
+            tokens.AT: self._compile_subtoken,
+            tokens.WITH: self._compile_subtoken,
+            tokens.EXPECTING: self._compile_subtoken,
+        }
+        self._expressions.update({x: self._compile_literal for x in LITERAL_TOKENS})
+        self._conditions: Dict[Type[Token], Callable[[Token, bool], Condition]] = {
+            tokens.EQUAL: self._compile_comparison,
+            tokens.GREATER: self._compile_comparison,
+            tokens.LESS: self._compile_comparison,
+            tokens.CONTAINS: self._compile_comparison,
+            tokens.IDENTICAL: self._compile_comparison,
+            tokens.NOT: self._compile_negation,
+        }
+
+    def compile_statement(self, token: Token, traced: bool = True) -> Statement:
+        """Returns a closure running the token"""
+        compile_ = self._statements.get(type(token))
+        if compile_ is not None:
+            try:
+                return compile_(token, traced)
+            except NotCompilable:
+                pass
+        elif type(token) in self._expressions:
+            try:
+                expression = self._expressions[type(token)](token, traced)
+            except NotCompilable:
+                pass
+            else:
+                return lambda interpreter: interpreter.stack_append(expression(interpreter))
+        return self._compile_token(token, traced)
+
+    def compile_expression(self, token: Token, traced: bool = True) -> Expression:
+        """Returns a closure running the token and returning the value it pushes.
+
+        Raises NotCompilable if the token does not push exactly one value.
+        """
+        compile_ = self._expressions.get(type(token))
+        if compile_ is not None:
+            try:
+                return compile_(token, traced)
+            except NotCompilable:
+                pass
+
+        if not isinstance(token, tokens.VALUE) or isinstance(token, STACK_DEPENDENT_TOKENS):
+            raise NotCompilable(token)
+
+        statement = self._compile_token(token, traced)
+
+        def expression(interpreter: Interpreter) -> Value:
+            statement(interpreter)
+            return interpreter.stack_pop()
+
+        return expression
+
+    def compile_condition(self, token: Token, traced: bool = True) -> Condition:
+        """Returns a closure comparing a value to the value of the condition token.
+
+        Raises NotCompilable for unsupported conditions.
+        """
+        compile_ = self._conditions.get(type(token))
+        if compile_ is None:
+            raise NotCompilable(token)
+        return compile_(token, traced)
+
+    def _compile_token(self, token: Token, traced: bool) -> Statement:
+        """Returns a closure running the token as a token. Tokens using the default
+        Token.run method have their subtokens compiled to statements.
+        """
+        if token.run.__code__ is not Token.run.__code__:
+            if not traced:
+                return token.run
+            return lambda interpreter: interpreter.run(token)
+
+        statements = tuple(self.compile_statement(x) for x in token.sorted_tokens)
+        run = token._run if token.runnable else None
+
+        def statement(interpreter: Interpreter) -> None:
+            for statement_ in statements:
+                statement_(interpreter)
+            if run is not None:
+                run(interpreter)
+
+        return _trace(token, statement, traced)
+
+    def _compile_body(self, clause: Token) -> Statement:
+        """Returns a callable running the statements in the clause"""
+        statements = tuple(self.compile_statement(x) for x in clause.sorted_tokens)
+        return CompiledClause(clause, statements).run
+
+    def _compile_set(self, token: Token, traced: bool) -> Statement:
+        if token.has_all_optionals:
+            raise NotCompilable(token)  # qualifiers are run on the stack
+
+        value_token, variable_token = token.sorted_tokens
+        resolve = variable_token.resolve
+        assign = variable_token.assign
+        if isinstance(value_token, tokens.VARNAME) and not isinstance(
+            value_token, tokens.RESULT
+        ):
+            name = value_token.value
+
+            def set_variable(interpreter: Interpreter) -> None:
+                variable = resolve(interpreter)
+                value_variable = interpreter.get_variable(name)
+                variable.value = value_variable.get_value()
+                variable.inputs = value_variable.inputs
+                variable.layout = value_variable.layout
+                assign(interpreter, variable)
+                interpreter.stack_append(variable)
+
+            return _trace(token, set_variable, traced)
+
+        value = self.compile_expression(value_token, traced=False)
+
+        def set_value(interpreter: Interpreter) -> None:
+            variable = resolve(interpreter)
+            variable.value = value(interpreter).get_value()
+            assign(interpreter, variable)
+            interpreter.stack_append(variable)
+
+        return _trace(token, set_value, traced)
+
+    def _compile_operation(self, token: Token, traced: bool) -> Statement:
+        value_token, variable_token = token.sorted_tokens
+        value = self.compile_expression(value_token)
+        variable = self.compile_expression(variable_token)
+        operate = token.operate
+
+        def operation(interpreter: Interpreter) -> None:
+            value_ = value(interpreter)
+            operate(variable(interpreter), value_)
+
+        return _trace(token, operation, traced)
+
+    def _compile_print(self, token: Token, traced: bool) -> Statement:
+        value = self.compile_expression(token.sorted_tokens[0])
+
+        def print_(interpreter: Interpreter) -> None:
+            print(value(interpreter).convert_to_str())
+
+        return _trace(token, print_, traced)
+
+    def _compile_append(self, token: Token, traced: bool) -> Statement:
+        value_token, variable_token = token.sorted_tokens
+        value = self.compile_expression(value_token)
+        variable = self.compile_expression(variable_token)
+        append = token.append
+
+        def append_(interpreter: Interpreter) -> None:
+            value_ = value(interpreter)
+            append(variable(interpreter), value_)
+
+        return _trace(token, append_, traced)
+
+    def _compile_get(self, token: Token, traced: bool) -> Statement:
+        index_token, collection_token, variable_token = token.sorted_tokens
+        index = self.compile_expression(index_token)
+        collection = self.compile_expression(collection_token)
+        variable = self.compile_expression(variable_token)
+        get = token.get
+
+        def get_(interpreter: Interpreter) -> None:
+            index_ = index(interpreter)
+            collection_ = collection(interpreter)
+            variable_ = variable(interpreter)
+            get(interpreter, variable_, collection_.get_value(), index_.get_value())
+
+        return _trace(token, get_, traced)
+
+    def _compile_call(self, token: Token, traced: bool) -> Statement:
+        inputs: Optional[Expression] = None
+        if token.has_all_optionals:
+            inputs = self.compile_expression(token.sorted_tokens[0])
+        function = self.compile_expression(token.sorted_tokens[-1])
+        call = token.call
+
+        def call_(interpreter: Interpreter) -> None:
+            inputs_ = None if inputs is None else inputs(interpreter)
+            call(interpreter, function(interpreter), inputs_)
+
+        return _trace(token, call_, traced)
+
+    def _compile_if(self, token: Token, traced: bool) -> Statement:
+        else_body: Optional[Statement] = None
+        if token.has_all_optionals:
+            else_body = self._compile_body(token.sorted_tokens[0].sorted_tokens[0])
+        condition = self.compile_expression(token.sorted_tokens[-2])
+        body = self._compile_body(token.sorted_tokens[-1])
+
+        def if_(interpreter: Interpreter) -> None:
+            if condition(interpreter).get_value() == 1:
+                body(interpreter)
+            elif else_body is not None:
+                else_body(interpreter)
+
+        return _trace(token, if_, traced)
+
+    def _compile_while(self, token: Token, traced: bool) -> Statement:
+        condition = self.compile_expression(token.tokens[0], traced=False)
+        body = self._compile_body(token.tokens[-1])
+
+        def while_(interpreter: Interpreter) -> None:
+            while condition(interpreter).get_value():
+                body(interpreter)
+                signal = interpreter.signal
+                if signal is not None:
+                    if signal.__class__ is tokens.BREAK:
+                        interpreter.signal = None
+                    break
+
+        return _trace(token, while_, traced)
+
+    def _compile_for(self, token: Token, traced: bool) -> Statement:
+        each = token.tokens[0]
+        if len(each.tokens) != 3:
+            raise NotCompilable(token)
+
+        variable_token, in_token, collection_token = each.tokens
+        variable = self.compile_expression(variable_token)
+        collection = self.compile_expression(collection_token)
+        condition: Optional[Condition] = None
+        if token.has_all_optionals:
+            condition = self.compile_condition(token.tokens[1])
+        body = self._compile_body(token.tokens[-1])
+        iterate = each.iterate
+        bind_element = each.bind_element
+
+        def for_(interpreter: Interpreter) -> None:
+            # the iterator is local to the call, so the loop may run several times at once
+            try:
+                elements = iterate(collection(interpreter))
+            except exceptions.RunTimeException as exc:
+                exc.token_stack.append(each)
+                raise
+
+            for element in elements:
+                try:
+                    variable_ = variable(interpreter)
+                    try:
+                        bind_element(interpreter, variable_, element)
+                    except exceptions.RunTimeException as exc:
+                        exc.token_stack.append(in_token)
+                        raise
+                except exceptions.RunTimeException as exc:
+                    exc.token_stack.append(each)
+                    raise
+                if condition is not None and not condition(interpreter, variable_).get_value():
+                    continue
+
+                body(interpreter)
+                signal = interpreter.signal
+                if signal is not None:
+                    if signal.__class__ is tokens.RETURN:
+                        break
+                    interpreter.signal = None
+                    if signal.__class__ is tokens.BREAK:
+                        break
+
+        return _trace(token, for_, traced)
+
+    def _compile_round(self, token: Token, traced: bool) -> Statement:
+        value = self.compile_expression(token.sorted_tokens[0])
+        round_value = token.round_value
+
+        def round_(interpreter: Interpreter) -> None:
+            round_value(value(interpreter))
+
+        return _trace(token, round_, traced)
+
+    def _compile_literal(self, token: Token, _: bool) -> Expression:
+        value = token.token_value
+        return lambda interpreter: value
+
+    def _compile_varname(self, token: Token, traced: bool) -> Expression:
+        if token.has_all_optionals:
+            raise NotCompilable(token)  # default values are run on the stack
+        return _trace(token, token.lookup, traced and isinstance(token, tokens.IT))
+
+    def _compile_result(self, token: Token, traced: bool) -> Expression:
+        lookup = token.lookup
+        if not token.has_all_optionals:
+            return _trace(token, lookup, traced)
+
+        call = self.compile_statement(token.sorted_tokens[0])
+
+        def result(interpreter: Interpreter) -> Value:
+            call(interpreter)
+            return lookup(interpreter)
+
+        return _trace(token, result, traced)
+
+    def _compile_check(self, token: Token, traced: bool) -> Expression:
+        value_token, condition_token = token.sorted_tokens
+        value = self.compile_expression(value_token)
+        condition = self.compile_condition(condition_token)
+
+        def check(interpreter: Interpreter) -> Value:
+            return condition(interpreter, value(interpreter))
+
+        return _trace(token, check, traced)
+
+    def _compile_not(self, token: Token, traced: bool) -> Expression:
+        value = self.compile_expression(token.sorted_tokens[0])
+
+        def not_(interpreter: Interpreter) -> Value:
+            value_ = value(interpreter).unshare()
+            value_.negate_value()
+            return value_
+
+        return _trace(token, not_, traced)
+
+    def _compile_length(self, token: Token, traced: bool) -> Expression:
+        value = self.compile_expression(token.sorted_tokens[0])
+        get_length = token.get_length
+
+        def length(interpreter: Interpreter) -> Value:
+            return get_length(value(interpreter))
+
+        return _trace(token, length, traced)
+
+    def _compile_collection(self, token: Token, traced: bool) -> Expression:
+        values = tuple(self.compile_expression(x) for x in token.sorted_tokens)
+        create_iterable_value = token.TOKEN_FACTORY.create_iterable_value
+
+        def collection(interpreter: Interpreter) -> Value:
+            return create_iterable_value([x(interpreter) for x in values])
+
+        return _trace(token, collection, traced)
+
+    def _compile_clause(self, token: Token, _: bool) -> Expression:
+        value = token.TOKEN_FACTORY.create_value(self._compile_body(token))
+        return lambda interpreter: value
+
+    def _compile_function(self, token: Token, traced: bool) -> Expression:
+        inputs: Optional[Expression] = None
+        if token.has_all_optionals:
+            inputs = self.compile_expression(token.sorted_tokens[0])
+        code = self.compile_expression(token.sorted_tokens[-2])
+        variable = self.compile_expression(token.sorted_tokens[-1])
+        define = token.define
+
+        def function(interpreter: Interpreter) -> Value:
+            inputs_ = None if inputs is None else inputs(interpreter)
+            code_ = code(interpreter)
+            function_ = variable(interpreter)
+            define(interpreter, function_, code_, inputs_)
+            return function_
+
+        return _trace(token, function, traced)
+
+    def _compile_subtoken(self, token: Token, traced: bool) -> Expression:
+        """Compiles tokens that only push the value of their single subtoken"""
+        if token.runnable or len(token.sorted_tokens) != 1:
+            raise NotCompilable(token)
+        value = self.compile_expression(token.sorted_tokens[0])
+        return _trace(token, value, traced)
+
+    def _compile_comparison(self, token: Token, traced: bool) -> Condition:
+        if len(token.sorted_tokens) != 1:
+            raise NotCompilable(token)
+        value = self.compile_expression(token.sorted_tokens[0])
+        operator_ = token.OPERATOR
+        create_value = token.TOKEN_FACTORY.create_value
+
+        def comparison(interpreter: Interpreter, first: Value) -> Value:
+            second_value = value(interpreter).get_value()
+            return create_value(operator_(first.get_value(), second_value))
+
+        return _trace_condition(token, comparison, traced)
+
+    def _compile_negation(self, token: Token, traced: bool) -> Condition:
+        condition = self.compile_condition(token.sorted_tokens[0])
+
+        def negation(interpreter: Interpreter, first: Value) -> Value:
+            value = condition(interpreter, first).unshare()
+            value.negate_value()
+            return value
+
+        return _trace_condition(token, negation, traced)
+
+
+def _trace(token: Token, closure: Closure, traced: bool) -> Closure:
+    """Wraps the statement or expression closure to add the token to the stack of runtime
+    exceptions. The closure is returned as is if it is not traced.
+    """
+    if not traced:
+        return closure
+
+    def traced_closure(interpreter: Interpreter) -> Any:
+        try:
+            return closure(interpreter)
+        except exceptions.RunTimeException as exc:
+            exc.token_stack.append(token)
+            raise
+
+    return traced_closure  # type: ignore
+
+
+def _trace_condition(token: Token, condition: Condition, traced: bool) -> Condition:
+    """Like _trace, for condition closures"""
+    if not traced:
+        return condition
+
+    def traced_condition(interpreter: Interpreter, first: Value) -> Value:
+        try:
+            return condition(interpreter, first)
+        except exceptions.RunTimeException as exc:
+            exc.token_stack.append(token)
+            raise
+
+    return traced_condition
+
+
+def run_tokens(
+    syntax_blocks: List[Token], interpreter: Interpreter, iterations: int = 1
+) -> None:
+    """Runs all tokens in the specified syntax blocks by compiling them to closures.
+    Note: tokens need to be grouped first by parser.
+    """
+    for syntax_block in syntax_blocks:
+        interpreter.init(syntax_block)
+
+    compiler = ClosureCompiler()
+    statements = [compiler.compile_statement(x) for x in syntax_blocks]
+    for _ in range(iterations):
+        for syntax_block, statement in zip(syntax_blocks, statements):
+            statement(interpreter)
+            if interpreter.signal is not None:
+                interpreter.signal_stack.append(syntax_block)
+                interpreter.raise_signal()
@@ -4,25 +4,43 @@ This module contains the bytecode compiler for the Natscript interpreter.
 
 Public interface:
 
-    JsonCompiler/PickleCompiler:
+    BinaryCompiler/JsonCompiler/PickleCompiler:
         read_compiled_file
         write_compiled_file
         get_compiled_filename
 
+    COMPILERS
+
+    LibraryBundle:
+        get_tokens
+        get_exports
+        write
+
+    get_cache_directory
+    get_cached_filename
+
 """
 import abc
+import ast
+import gc
 import hashlib
+import itertools
 import json
 import os
 import pickle
 import re
-from typing import Any, Dict, List, Optional, Tuple, Type
+import struct
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple, Type
 
+from natscript import VERSION
 from natscript.internal.token_ import Token  # type: ignore
 from natscript.tokens_ import tokens
 
 TokenData = Tuple[int, str, Any, int, Optional[int], int]
 
+# the class, final grammar state and runnable flag of the tokens restored, by class name
+_TOKEN_CLASS_STATES: Dict[str, Tuple[Type[Token], int, bool]] = {}
+
 
 class CompilerError(Exception):
     """CompilerError exception, gets thrown when the compiled file
@@ -37,32 +55,64 @@ class BytecodeCompiler(abc.ABC):
 
     def write_compiled_file(self, tokens_: List[Token], filename: str) -> None:
         """Traverses all token trees to collect their data, then dumps token data
-        to pickle file, along with a current filehash of the source code file specified.
+        to pickle file, along with the modification time, size and current filehash
+        of the source code file specified.
         """
         saved_tokens: List[TokenData] = []
         for token in tokens_:
             _save_tokens(token, saved_tokens)
 
-        content = {"tokens": saved_tokens, "hash": _hash_file(filename)}
+        content = {"tokens": saved_tokens, **_get_source_header(filename)}
         compiled_filename = self.get_compiled_filename(filename)
+        if not os.access(os.path.dirname(compiled_filename) or ".", os.W_OK):
+            # e.g. a read-only installation, the compiled file is cached for the user instead
+            compiled_filename = get_cached_filename(compiled_filename)
+            os.makedirs(os.path.dirname(compiled_filename), exist_ok=True)
         self.write_content_to_file(content, compiled_filename)
 
     def read_compiled_file(self, filename: str) -> List[Token]:
         """Loads tokens from the corresponding compiled file to the filename specified.
-
-        If a compiled file cannot be found or the file hash of the source code file and
-        the hash in the compiled file do not match, a CompilerError exception is thrown.
+        The compiled file next to the source code file is tried first, then the one in the
+        user cache directory.
+
+        The compiled file is current if the modification time and size of the source code
+        file match those in the compiled file. Only if they do not, the source code file is
+        hashed: if the hashes match, the compiled file is updated with the new modification
+        time and size, else a CompilerError exception is thrown.
+        A CompilerError exception is also thrown if a compiled file cannot be found.
         """
         compiled_filename = self.get_compiled_filename(filename)
-        if not os.path.isfile(compiled_filename):
-            raise CompilerError("Compiled file does not exist!")
-
+        error = CompilerError("Compiled file does not exist!")
+        for candidate in (compiled_filename, get_cached_filename(compiled_filename)):
+            if not os.path.isfile(candidate):
+                continue
+            try:
+                token_data = self._read_token_data(filename, candidate)
+            except CompilerError as exc:
+                error = exc
+                continue
+            return self._build_token_trees(token_data)
+        raise error
+
+    def _build_token_trees(self, token_data: Iterable[TokenData]) -> List[Token]:
+        return _construct_token_trees(token_data)
+
+    def _read_token_data(self, filename: str, compiled_filename: str) -> Iterable[TokenData]:
         contents = self.read_content_from_file(compiled_filename)
-        if _hash_file(filename) != contents["hash"]:
-            raise CompilerError("Hash in compiled file did not match file hash!")
-
-        tokens_ = _construct_token_trees(token_data=contents["tokens"])
-        return tokens_
+        token_data = contents["tokens"]
+        stat = os.stat(filename)
+        if (contents.get("mtime"), contents.get("size")) != (stat.st_mtime_ns, stat.st_size):
+            header = _get_source_header(filename)
+            if header["hash"] != contents.get("hash"):
+                raise CompilerError("Hash in compiled file did not match file hash!")
+            token_data = list(token_data)  # may only be iterable once
+            try:
+                self.write_content_to_file(
+                    {**contents, **header, "tokens": token_data}, compiled_filename
+                )
+            except OSError:
+                pass  # the compiled file is still valid, it is just validated by hash again
+        return token_data
 
     @abc.abstractmethod
     def get_compiled_filename(self, filename: str) -> str:
@@ -91,11 +141,197 @@ class PickleCompiler(BytecodeCompiler):
             contents = pickle.load(file)
         return contents
 
+    def get_compiled_filename(self, filename: str) -> str:
+        """Returns the name of the compiled file corresponding to the specified filename"""
+        _, ext = os.path.splitext(filename)
+        return re.sub(rf"{ext}$", ".pickle", filename)
+
+
+class BinaryCompiler(BytecodeCompiler):
+    """Bytecode compiler using a compact binary format to write/read compiled files.
+
+    A compiled file starts with a header holding the format and interpreter versions and the
+    modification time, size and hash of the source code file. It is followed by the struct
+    format of its packed integers, its strings and its packed integers. The strings are the
+    token class names and the constant token values. The packed integers are the table of
+    token kinds (class and run order) and the token records, stored as columns that are each
+    packed as tightly as their values allow. The file is read by slicing a memoryview of it.
+
+    The tokens are restored from the token data without being constructed again
+    (see _restore_token_trees), so that the format is also the fastest to load.
+    """
+
+    MAGIC = b"NATC"
+    FORMAT_VERSION = 1
+
+    # magic, format version, interpreter version, source mtime, size and sha256 digest,
+    # string separator, text size, number of classes, number of token kinds, number of
+    # tokens, depth of the token trees and size of the struct format of the packed integers
+    HEADER = struct.Struct("<4sH16sqq32sIIIIIII")
+    UNSIGNED_FORMATS = "BHIQ"
+    SIGNED_FORMATS = "bhiq"
+
+    # constant token values are stored grouped by type, in this order
+    CONSTANT_TYPES: List[Type] = [type(None), bool, int, float, str]
+    CONSTANT_DECODERS: List[Callable[[str], Any]] = [
+        lambda _: None,
+        "1".__eq__,
+        int,
+        float,
+        str,
+    ]
+
+    def write_content_to_file(self, content: Any, compiled_filename: str) -> None:
+        """Writes the content to the compiled file"""
+        token_data: List[TokenData] = content["tokens"]
+        class_ids: Dict[str, int] = {}
+        kind_ids: Dict[Tuple[int, int], int] = {}
+        constants: Dict[Type, Dict[Any, None]] = {x: {} for x in self.CONSTANT_TYPES}
+        for _, class_name, value, run_order, _, _ in token_data:
+            class_id = class_ids.setdefault(class_name, len(class_ids))
+            kind_ids.setdefault((class_id, run_order), len(kind_ids))
+            try:
+                constants[value.__class__][value] = None
+            except KeyError:
+                type_ = type(value).__name__
+                raise CompilerError(f"Cannot compile value of type {type_}!") from None
+
+        constant_ids: Dict[Tuple[Type, Any], int] = {}
+        for type_, values in constants.items():
+            for value in values:
+                constant_ids[type_, value] = len(constant_ids)
+        strings = [*class_ids, *(_encode_constant(value) for _, value in constant_ids)]
+        separator = _find_separator(strings)
+        text = chr(separator).join(strings).encode("utf-8")
+
+        columns: List[List[int]] = [[], [], [], []]
+        previous_line = 0
+        for id_, class_name, value, run_order, _, line in token_data:
+            columns[0].append(id_)
+            columns[1].append(kind_ids[class_ids[class_name], run_order])
+            columns[2].append(constant_ids[value.__class__, value])
+            columns[3].append(line - previous_line)
+            previous_line = line
+
+        integers = [
+            [len(x) for x in constants.values()],
+            [x for x, _ in kind_ids],
+            [x for _, x in kind_ids],
+            *columns,
+        ]
+        formats = [_get_format(x, self.UNSIGNED_FORMATS) for x in integers[:-1]]
+        formats.append(_get_format(integers[-1], self.SIGNED_FORMATS))
+        integer_format = "<" + "".join(f"{len(x)}{y}" for x, y in zip(integers, formats))
+
+        header = self.HEADER.pack(
+            self.MAGIC,
+            self.FORMAT_VERSION,
+            VERSION.encode("utf-8"),
+            content["mtime"],
+            content["size"],
+            bytes.fromhex(content["hash"]),
+            separator,
+            len(text),
+            len(class_ids),
+            len(kind_ids),
+            len(token_data),
+            max(columns[0], default=0),
+            len(integer_format),
+        )
+        with open(compiled_filename, "wb") as file:
+            file.write(header)
+            file.write(integer_format.encode("ascii"))
+            file.write(text)
+            file.write(struct.pack(integer_format, *itertools.chain(*integers)))
+
+    def read_content_from_file(self, compiled_filename: str) -> Dict[str, Any]:
+        """Reads the content from the compiled file.
+        The token data is returned as an iterator, as it is only iterated once.
+        """
+        with open(compiled_filename, "rb") as file:
+            data = memoryview(file.read())
+        if data[: len(self.MAGIC)] != self.MAGIC:
+            raise CompilerError("Compiled file is not in the binary format!")
+
+        try:
+            return self._unpack_content(data)
+        except (struct.error, ValueError, IndexError):
+            raise CompilerError("Compiled file is corrupt or truncated!") from None
+
+    def _unpack_content(self, data: memoryview) -> Dict[str, Any]:
+        (
+            _,
+            format_version,
+            interpreter_version,
+            mtime,
+            size,
+            hash_,
+            separator,
+            text_size,
+            class_count,
+            kind_count,
+            token_count,
+            depth,
+            format_size,
+        ) = self.HEADER.unpack_from(data)
+        if (format_version, interpreter_version.rstrip(b"\0").decode()) != (
+            self.FORMAT_VERSION,
+            VERSION,
+        ):
+            raise CompilerError("Compiled file was written by another interpreter version!")
+
+        offset = self.HEADER.size + format_size
+        integer_format = str(data[self.HEADER.size : offset], "ascii")
+        strings = str(data[offset : offset + text_size], "utf-8").split(chr(separator))
+        offset += text_size
+        if offset + struct.calcsize(integer_format) != len(data):
+            raise struct.error("unexpected size")
+        integers = struct.unpack_from(integer_format, data, offset)
+
+        # the integers are the constant counts, the kind table and the record columns
+        offset = len(self.CONSTANT_TYPES)
+        position = class_count
+        constants: List[Any] = []
+        for decoder, count in zip(self.CONSTANT_DECODERS, integers[:offset]):
+            constants.extend(map(decoder, strings[position : position + count]))
+            position += count
+        kind_class_names = list(map(strings.__getitem__, integers[offset : offset + kind_count]))
+        offset += kind_count
+        kind_run_orders = integers[offset : offset + kind_count]
+        offset += kind_count
+        ids = integers[offset : offset + token_count]
+        offset += token_count
+        kind_ids = integers[offset : offset + token_count]
+        offset += token_count
+        constant_ids = integers[offset : offset + token_count]
+        line_deltas = integers[offset + token_count :]
+        # the token data is mapped lazily, so all indices are checked here
+        if (
+            max(kind_ids, default=-1) >= kind_count
+            or max(constant_ids, default=-1) >= len(constants)
+            or max(ids, default=0) > depth
+        ):
+            raise IndexError("index out of range")
+
+        parent_ids = [None, *range(depth)]  # the parent of each token id
+        token_data = zip(
+            ids,
+            map(kind_class_names.__getitem__, kind_ids),
+            map(constants.__getitem__, constant_ids),
+            map(kind_run_orders.__getitem__, kind_ids),
+            map(parent_ids.__getitem__, ids),
+            itertools.accumulate(line_deltas),
+        )
+        return {"tokens": token_data, "mtime": mtime, "size": size, "hash": hash_.hex()}
+
     def get_compiled_filename(self, filename: str) -> str:
         """Returns the name of the compiled file corresponding to the specified filename"""
         _, ext = os.path.splitext(filename)
         return re.sub(rf"{ext}$", ".natc", filename)
 
+    def _build_token_trees(self, token_data: Iterable[TokenData]) -> List[Token]:
+        return _restore_token_trees(token_data)
+
 
 class JsonCompiler(BytecodeCompiler):
     """Bytecode compiler using json to write/read compiled files"""
@@ -117,7 +353,173 @@ class JsonCompiler(BytecodeCompiler):
         return re.sub(rf"{ext}$", ".json", filename)
 
 
-def _hash_file(filename: str) -> str:
+COMPILERS: Dict[str, Type[BytecodeCompiler]] = {
+    "binary": BinaryCompiler,
+    "pickle": PickleCompiler,
+    "json": JsonCompiler,
+}
+
+
+class LibraryBundle:
+    """Precompiled bundle of the Natscript standard library in a single file, holding the
+    token data of the library modules and the names exported by their Python implementations.
+
+    The bundle is written next to the library, or to the user cache directory if the library
+    is read-only, and rewritten whenever the interpreter version or a library file changes.
+    """
+
+    FILENAME = "natscript_lib.natb"
+
+    def __init__(self, directory: str):
+        self.directory = os.path.abspath(directory)
+        self._modules: Optional[Dict[str, Dict[str, Any]]] = None
+
+    def get_tokens(self, filepath: str) -> Optional[List[Token]]:
+        """Returns new tokens of the library module at the filepath, or None if the file
+        is not part of the library.
+        """
+        module = self._get_module(filepath)
+        return None if module is None else _construct_token_trees(module["tokens"])
+
+    def get_exports(self, filepath: str) -> Optional[List[str]]:
+        """Returns the names exported by the Python module of the library at the filepath,
+        or None if the file is not part of the library.
+        """
+        module = self._get_module(filepath)
+        return None if module is None else module["exports"]
+
+    def write(self) -> Dict[str, Dict[str, Any]]:
+        """Compiles all library modules and writes them to the bundle, returning the modules"""
+        content = {"version": VERSION, "stats": self._get_stats(), "modules": {}}
+        for name in content["stats"]:
+            filepath = os.path.join(self.directory, name)
+            if name.endswith(".py"):
+                module = {"exports": _get_python_exports(filepath), "tokens": None}
+            else:
+                module = {"exports": None, "tokens": _compile_tokens(filepath)}
+            content["modules"][name] = module
+
+        for bundle_filename in self._get_bundle_filenames():
+            try:
+                os.makedirs(os.path.dirname(bundle_filename), exist_ok=True)
+                with open(bundle_filename, "wb") as file:
+                    pickle.dump(content, file)
+                break
+            except OSError:
+                continue
+        return content["modules"]
+
+    def _get_module(self, filepath: str) -> Optional[Dict[str, Any]]:
+        directory, name = os.path.split(os.path.abspath(filepath))
+        if directory != self.directory:
+            return None
+        if self._modules is None:
+            self._modules = self._read()
+        return self._modules.get(name)
+
+    def _read(self) -> Dict[str, Dict[str, Any]]:
+        stats = self._get_stats()
+        for bundle_filename in self._get_bundle_filenames():
+            try:
+                with open(bundle_filename, "rb") as file:
+                    content = pickle.load(file)
+            except (OSError, pickle.UnpicklingError, EOFError):
+                continue
+            if content.get("version") == VERSION and content.get("stats") == stats:
+                return content["modules"]
+        return self.write()
+
+    def _get_stats(self) -> Dict[str, Tuple[int, int]]:
+        """Returns the size and modification time of the library files, by filename"""
+        stats = {}
+        for entry in sorted(os.scandir(self.directory), key=lambda x: x.name):
+            if entry.name.endswith(".nat") or re.match(r"^_.*_nat\.py$", entry.name):
+                stat = entry.stat()
+                stats[entry.name] = (stat.st_size, stat.st_mtime_ns)
+        return stats
+
+    def _get_bundle_filenames(self) -> List[str]:
+        bundle_filename = os.path.join(self.directory, self.FILENAME)
+        return [bundle_filename, get_cached_filename(bundle_filename)]
+
+
+def get_cache_directory() -> str:
+    """Returns the user cache directory of the interpreter, $XDG_CACHE_HOME/natscript
+    (defaults to ~/.cache/natscript).
+    """
+    cache_home = os.getenv("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(cache_home, "natscript")
+
+
+def get_cached_filename(filename: str) -> str:
+    """Returns the path of the file in the user cache directory, which mirrors the
+    absolute path of the file.
+    """
+    drive, path_ = os.path.splitdrive(os.path.abspath(filename))
+    return os.path.join(get_cache_directory(), drive.strip(":\\/"), path_.lstrip("\\/"))
+
+
+def _compile_tokens(filepath: str) -> List[TokenData]:
+    from natscript import interpret  # pylint: disable=import-outside-toplevel
+
+    saved_tokens: List[TokenData] = []
+    for token in interpret.construct_tokens(filepath):
+        _save_tokens(token, saved_tokens)
+    return saved_tokens
+
+
+def _get_python_exports(filepath: str) -> List[str]:
+    """Returns the public names bound at the top level of the Python module"""
+    with open(filepath, "r", encoding="utf-8") as file:
+        module = ast.parse(file.read())
+
+    names = []
+    for node in module.body:
+        if isinstance(node, (ast.FunctionDef, ast.ClassDef)):
+            names.append(node.name)
+        elif isinstance(node, (ast.Assign, ast.AnnAssign)):
+            targets = node.targets if isinstance(node, ast.Assign) else [node.target]
+            names.extend(x.id for x in targets if isinstance(x, ast.Name))
+        elif isinstance(node, (ast.Import, ast.ImportFrom)):
+            names.extend((x.asname or x.name).split(".")[0] for x in node.names)
+    return [x for x in dict.fromkeys(names) if not x.startswith("_")]
+
+
+def _encode_constant(value: Any) -> str:
+    if value is None:
+        return ""
+    if value.__class__ is bool:
+        return "1" if value else "0"
+    if value.__class__ is float:
+        return repr(value)
+    return str(value)
+
+
+def _find_separator(payloads: List[str]) -> int:
+    """Returns the code of the first character not contained in any payload"""
+    characters = set().union(*payloads)
+    return next(x for x in itertools.count() if chr(x) not in characters)
+
+
+def _get_format(values: List[int], formats: str) -> str:
+    """Returns the first of the struct formats that can pack all values"""
+    minimum, maximum = min(values, default=0), max(values, default=0)
+    for format_ in formats:
+        bits = 8 * struct.calcsize(format_)
+        if format_.islower() and -(2 ** (bits - 1)) <= minimum and maximum < 2 ** (bits - 1):
+            return format_
+        if format_.isupper() and minimum >= 0 and maximum < 2**bits:
+            return format_
+    raise CompilerError("Cannot compile integer out of range!")
+
+
+def _get_source_header(filename: str) -> Dict[str, Any]:
+    """Returns the modification time, size and hash of the source code file"""
+    stat = os.stat(filename)
+    return {"mtime": stat.st_mtime_ns, "size": stat.st_size, "hash": hash_file(filename)}
+
+
+def hash_file(filename: str) -> str:
     """Returns the hash of the contents of the specified file."""
     hash_ = hashlib.sha256()
     bytes_ = bytearray(128 * 1024)
@@ -146,16 +548,15 @@ def _save_tokens(
         _save_tokens(token, list_, id_ + 1, parent_id=id_)
 
 
-def _construct_token_trees(token_data: List[TokenData]) -> List[Token]:
+def _construct_token_trees(token_data: Iterable[TokenData]) -> List[Token]:
     """Constructs a list of nested token trees from the passed token data."""
     parents: Dict[int, Token] = {}
     tokens_: List[Token] = []
-    expected_tokens = []  # type: ignore
     for id_, class_name, value, run_order, parent_id, line in token_data:
         class_: Type[Token] = tokens.__dict__[class_name]
         token_ = class_(value, line)
         token_.run_order = run_order
-        token_.expected_tokens = expected_tokens
+        token_.expected_state = token_.GRAMMAR.final_state
 
         parents[id_] = token_
         if parent_id is None:
@@ -163,3 +564,52 @@ def _construct_token_trees(token_data: List[TokenData]) -> List[Token]:
         else:
             parents[parent_id].tokens.append(token_)
     return tokens_
+
+
+def _restore_token_trees(token_data: Iterable[TokenData]) -> List[Token]:
+    """Constructs the same token trees as _construct_token_trees, but faster.
+    The tokens are created without Token.__init__ and get their attributes set directly,
+    taking the attributes that only depend on the class from the first token constructed
+    of that class. The garbage collector is paused meanwhile, as it would otherwise
+    repeatedly traverse all tokens created so far.
+    """
+    parents: Dict[int, Token] = {}
+    tokens_: List[Token] = []
+    new = object.__new__
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for id_, class_name, value, run_order, parent_id, line in token_data:
+            try:
+                class_, expected_state, runnable = _TOKEN_CLASS_STATES[class_name]
+            except KeyError:
+                class_ = tokens.__dict__[class_name]
+                token_ = class_(value, line)
+                token_.run_order = run_order
+                token_.expected_state = token_.GRAMMAR.final_state
+                _TOKEN_CLASS_STATES[class_name] = (class_, token_.expected_state, token_.runnable)
+            else:
+                # mirrors Token.__init__
+                # pylint: disable=protected-access
+                token_ = new(class_)
+                token_.value = class_._convert_value(token_, value)
+                token_.line = line
+                token_.column = 0
+                token_.tokens = []
+                token_.run_order = run_order
+                token_.parent = None
+                token_.expected_state = expected_state
+                token_.sorted_tokens = ()
+                token_.runnable = runnable
+                token_.filepath = None
+                token_.has_all_optionals = False
+
+            parents[id_] = token_
+            if parent_id is None:
+                tokens_.append(token_)
+            else:
+                parents[parent_id].tokens.append(token_)
+    finally:
+        if gc_enabled:
+            gc.enable()
+    return tokens_
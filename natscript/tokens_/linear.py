@@ -0,0 +1,397 @@
+# -*- coding: utf-8 -*-
+"""
+This module contains the lineariser for the Natscript interpreter.
+
+The lineariser lowers initialised token trees into flat instruction lists.
+Statements in clauses, conditionals and loops become instructions with jump targets,
+so a clause runs in a single dispatch loop instead of recursing through the
+run methods of the nested tokens. Each instruction still runs the tokens on the
+interpreter stack, so the values left on the stack are the same as running the tokens.
+
+Runtime exceptions get the same token stack as from the tree-walking interpreter:
+each instruction has the chain of tokens enclosing it, which is added to the token stack
+once an exception escapes the dispatch loop.
+
+Public interface:
+
+    Lineariser:
+        linearise
+
+    LinearCode:
+        run
+
+    run_tokens
+
+"""
+import contextlib
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from natscript.internal import exceptions
+from natscript.internal.interfaces import Interpreter
+from natscript.internal.token_ import Token
+from natscript.tokens_ import closures, tokens
+
+# pylint: disable=protected-access
+
+# (opcode, argument, second argument)
+Instruction = Tuple[int, Any, Any]
+
+# opcodes
+RUN = 0  # calls the argument with the interpreter
+PUSH = 1  # pushes the argument on the stack
+POP = 2  # discards the value on top of the stack
+JUMP = 3  # jumps to the argument
+JUMP_IF_FALSE = 4  # pops a value and jumps to the argument if the value is falsy
+JUMP_UNLESS_ONE = 5  # pops a value and jumps to the argument if the value is not 1
+GET_ITER = 6  # pops a collection value and starts iterating through it with the argument
+FOR_ITER = 7  # pushes the next element value twice, or jumps to the second argument
+POP_ITER = 8  # stops iterating through the current collection
+ASSIGN = 9  # pops a value and the variable below it, assigns it and pushes the variable
+SIGNAL = 10  # sets the argument as the interpreter signal and leaves the code
+CHECK_SIGNAL = 11  # handles a signal by jumping to the break or skip target, if any
+
+_EXHAUSTED = object()
+
+
+class LinearCode:
+    """The instructions of a clause or module, with the chains of tokens enclosing them"""
+
+    __slots__ = ("token", "instructions", "chains")
+
+    def __init__(
+        self,
+        token: Optional[Token],
+        instructions: List[Instruction],
+        chains: List[Tuple[Token, ...]],
+    ):
+        self.token = token
+        self.instructions = instructions
+        self.chains = chains
+
+    def __repr__(self):
+        return repr(self.token)
+
+    def run(self, interpreter: Interpreter) -> None:
+        """Runs the instructions in a dispatch loop, until the end of the code
+        or a signal which cannot be handled in the code.
+        """
+        # pylint: disable=too-many-branches
+        instructions = self.instructions
+        stack_append = interpreter.stack_append
+        stack_pop = interpreter.stack_pop
+        iterators: List[Iterator[Any]] = []
+        end = len(instructions)
+        pc = 0
+        try:
+            while pc < end:
+                opcode, argument, second_argument = instructions[pc]
+                pc += 1
+                if opcode == RUN:
+                    argument(interpreter)
+                elif opcode == PUSH:
+                    stack_append(argument)
+                elif opcode == JUMP:
+                    pc = argument
+                elif opcode == JUMP_IF_FALSE:
+                    if not stack_pop().get_value():
+                        pc = argument
+                elif opcode == JUMP_UNLESS_ONE:
+                    if stack_pop().get_value() != 1:
+                        pc = argument
+                elif opcode == FOR_ITER:
+                    element = next(iterators[-1], _EXHAUSTED)
+                    if element is _EXHAUSTED:
+                        pc = second_argument
+                    else:
+                        value = argument(element)
+                        stack_append(value)
+                        stack_append(value)
+                elif opcode == ASSIGN:
+                    value = stack_pop()
+                    variable = stack_pop()
+                    variable.value = value.get_value()
+                    argument(interpreter, variable)
+                    stack_append(variable)
+                elif opcode == POP:
+                    stack_pop()
+                elif opcode == GET_ITER:
+                    iterators.append(argument(stack_pop()))
+                elif opcode == POP_ITER:
+                    iterators.pop()
+                elif opcode == CHECK_SIGNAL:
+                    signal = interpreter.signal
+                    if signal is None:
+                        continue
+                    if signal.__class__ is tokens.BREAK and argument is not None:
+                        interpreter.signal = None
+                        pc = argument
+                    elif signal.__class__ is tokens.SKIP and second_argument is not None:
+                        interpreter.signal = None
+                        pc = second_argument
+                    else:
+                        interpreter.signal_stack.extend(self.chains[pc - 1])
+                        return
+                elif opcode == SIGNAL:
+                    interpreter.signal = argument
+                    interpreter.signal_stack = list(self.chains[pc - 1])
+                    return
+        except exceptions.RunTimeException as exc:
+            exc.token_stack.extend(self.chains[pc - 1])
+            raise
+
+
+class _Loop:
+    """Jump targets of a loop being linearised"""
+
+    __slots__ = ("type_", "start", "breaks")
+
+    def __init__(self, type_: type, start: int):
+        self.type_ = type_
+        self.start = start
+        self.breaks: List[int] = []  # jumps to be patched to the end of the loop
+
+
+class Lineariser:
+    """Lowers initialised tokens to the instructions of LinearCode objects.
+
+    Tokens with a dedicated lowering (clauses, conditionals, loops and signals)
+    are replaced by jumps, other tokens run their subtokens, then themselves.
+    Tokens overriding Token.run are run as tokens.
+    """
+
+    def __init__(self):
+        self._lowerings = {
+            tokens.CLAUSE: self._lower_clause,
+            tokens.IF: self._lower_if,
+            tokens.WHILE: self._lower_while,
+            tokens.FOR: self._lower_for,
+            tokens.SET: self._lower_set,
+            tokens.RETURN: self._lower_signal,
+            tokens.BREAK: self._lower_break,
+            tokens.SKIP: self._lower_skip,
+        }
+        self._clauses: Dict[int, Any] = {}
+        self._instructions: List[Instruction] = []
+        self._chains: List[Tuple[Token, ...]] = []
+        self._chain: List[Token] = []
+        self._loops: List[_Loop] = []
+
+    def linearise(self, syntax_blocks: List[Token]) -> LinearCode:
+        """Returns the code running the syntax blocks of a module.
+        Like the flattened syntax blocks run by the tree-walking interpreter, the top-level
+        tokens not overriding Token.run are not in the token stack of their subtokens.
+        """
+        with self._code():
+            for syntax_block in syntax_blocks:
+                self._lower(syntax_block, flatten=True)
+            return LinearCode(None, self._instructions, self._chains)
+
+    @contextlib.contextmanager
+    def _code(self) -> Iterator[None]:
+        state = (self._instructions, self._chains, self._chain, self._loops)
+        self._instructions, self._chains, self._chain, self._loops = [], [], [], []
+        try:
+            yield
+        finally:
+            self._instructions, self._chains, self._chain, self._loops = state
+
+    @contextlib.contextmanager
+    def _traced(self, token: Token, traced: bool = True) -> Iterator[None]:
+        """Adds the token to the token stack of exceptions raised in the instructions"""
+        if traced:
+            self._chain.append(token)
+        try:
+            yield
+        finally:
+            if traced:
+                self._chain.pop()
+
+    def _emit(self, opcode: int, argument: Any = None, second_argument: Any = None) -> int:
+        """Appends the instruction and returns its index"""
+        self._instructions.append((opcode, argument, second_argument))
+        self._chains.append(tuple(reversed(self._chain)))
+        return len(self._instructions) - 1
+
+    def _patch(self, index: int, argument: Any = None, second_argument: Any = None) -> None:
+        opcode, _, _ = self._instructions[index]
+        self._instructions[index] = (opcode, argument, second_argument)
+
+    def _emit_check_signal(self) -> None:
+        """Emits the handling of signals left by the instructions before,
+        jumping to the enclosing loops of the code like their tokens would.
+        """
+        break_target: Optional[int] = None
+        skip_target: Optional[int] = None
+        if self._loops:
+            break_target = -1  # patched once the end of the loop is known
+        for loop in reversed(self._loops):
+            if loop.type_ is tokens.FOR:
+                skip_target = loop.start
+                break
+        index = self._emit(CHECK_SIGNAL, break_target, skip_target)
+        if self._loops:
+            self._loops[-1].breaks.append(index)
+
+    def _lower(self, token: Token, traced: bool = True, flatten: bool = False) -> None:
+        """Emits the instructions running the token"""
+        lower = self._lowerings.get(type(token))
+        if lower is not None:
+            lower(token, traced, flatten)
+        elif isinstance(token, closures.LITERAL_TOKENS):
+            self._emit(PUSH, token.token_value)
+        elif token.run.__code__ is not Token.run.__code__:
+            with self._traced(token, traced):
+                self._emit(RUN, token.run)
+                self._emit_check_signal()
+        else:
+            with self._traced(token, traced and not flatten):
+                for child in token.sorted_tokens:
+                    self._lower(child, flatten=flatten)
+            if token.runnable:
+                with self._traced(token, traced):
+                    self._emit(RUN, token._run)
+                    if isinstance(token, (tokens.CALL, tokens.APPLY)):
+                        self._emit_check_signal()
+
+    def _lower_body(self, clause: Token) -> None:
+        for token in clause.sorted_tokens:
+            self._lower(token)
+
+    def _lower_clause(self, token: Token, *_: bool) -> None:
+        value = self._clauses.get(id(token))
+        if value is None:
+            with self._code():
+                self._lower_body(token)
+                code = LinearCode(token, self._instructions, self._chains)
+            value = self._clauses[id(token)] = token.TOKEN_FACTORY.create_value(code.run)
+        self._emit(PUSH, value)
+
+    def _lower_if(self, token: Token, traced: bool, flatten: bool) -> None:
+        with self._traced(token, traced and not flatten):
+            self._lower(token.sorted_tokens[-2], flatten=flatten)
+        with self._traced(token, traced):
+            jump_else = self._emit(JUMP_UNLESS_ONE)
+            self._lower_body(token.sorted_tokens[-1])
+            if not token.has_all_optionals:
+                self._patch(jump_else, len(self._instructions))
+                return
+
+            jump_end = self._emit(JUMP)
+            self._patch(jump_else, len(self._instructions))
+            self._lower_body(token.sorted_tokens[0].sorted_tokens[0])
+            self._patch(jump_end, len(self._instructions))
+
+    def _lower_while(self, token: Token, traced: bool, _: bool) -> None:
+        with self._traced(token, traced):
+            loop = _Loop(tokens.WHILE, len(self._instructions))
+            self._lower(token.tokens[0], traced=False)
+            loop.breaks.append(self._emit(JUMP_IF_FALSE))
+            self._loops.append(loop)
+            self._lower_body(token.tokens[-1])
+            self._loops.pop()
+            self._emit(JUMP, loop.start)
+            self._patch_breaks(loop, len(self._instructions))
+
+    def _lower_for(self, token: Token, traced: bool, _: bool) -> None:
+        each = token.tokens[0]
+        if len(each.tokens) != 3:
+            with self._traced(token, traced):
+                self._emit(RUN, token.run)
+                self._emit_check_signal()
+            return
+
+        variable_token, in_token, collection_token = each.tokens
+        with self._traced(token, traced):
+            with self._traced(each):
+                self._lower(collection_token)
+                self._emit(GET_ITER, each.iterate)
+                loop = _Loop(tokens.FOR, len(self._instructions))
+                for_iter = self._emit(FOR_ITER, each.create_element_value)
+                self._lower(variable_token)
+                self._lower(in_token)
+
+            if token.has_all_optionals:
+                self._lower(token.tokens[1])
+                self._emit(JUMP_IF_FALSE, loop.start)
+            else:
+                self._emit(POP)
+            self._loops.append(loop)
+            self._lower_body(token.tokens[-1])
+            self._loops.pop()
+            self._emit(JUMP, loop.start)
+            end = self._emit(POP_ITER)
+            self._patch(for_iter, each.create_element_value, end)
+            self._patch_breaks(loop, end)
+
+    def _patch_breaks(self, loop: _Loop, end: int) -> None:
+        for index in loop.breaks:
+            opcode, _, second_argument = self._instructions[index]
+            if opcode == CHECK_SIGNAL:
+                self._patch(index, end, second_argument)
+            else:
+                self._patch(index, end)
+
+    def _lower_set(self, token: Token, traced: bool, _: bool) -> None:
+        value_token, variable_token = token.sorted_tokens[:2]
+        if token.has_all_optionals or (
+            isinstance(value_token, tokens.VARNAME) and not isinstance(value_token, tokens.RESULT)
+        ):
+            # qualifiers and variable values are handled by the token
+            with self._traced(token, traced):
+                self._emit(RUN, token.run)
+            return
+
+        with self._traced(token, traced):
+            self._emit(RUN, _push_resolved(variable_token))
+            self._lower(value_token, traced=False)
+            self._emit(ASSIGN, variable_token.assign)
+
+    def _lower_signal(self, token: Token, traced: bool, flatten: bool) -> None:
+        with self._traced(token, traced and not flatten):
+            for child in token.sorted_tokens:
+                self._lower(child, flatten=flatten)
+        with self._traced(token, traced):
+            self._emit(SIGNAL, token)
+
+    def _lower_break(self, token: Token, traced: bool, flatten: bool) -> None:
+        if not self._loops:
+            self._lower_signal(token, traced, flatten)
+            return
+        with self._traced(token, traced):
+            self._loops[-1].breaks.append(self._emit(JUMP))
+
+    def _lower_skip(self, token: Token, traced: bool, flatten: bool) -> None:
+        loop = next((x for x in reversed(self._loops) if x.type_ is tokens.FOR), None)
+        if loop is None:
+            self._lower_signal(token, traced, flatten)
+            return
+        with self._traced(token, traced and not flatten):
+            for child in token.sorted_tokens:
+                self._lower(child, flatten=flatten)
+        with self._traced(token, traced):
+            self._emit(JUMP, loop.start)
+
+
+def _push_resolved(variable_token: Token):
+    """Returns a callable pushing the variable resolved by the VARNAME token"""
+    resolve = variable_token.resolve
+
+    def push_resolved(interpreter: Interpreter) -> None:
+        interpreter.stack_append(resolve(interpreter))
+
+    return push_resolved
+
+
+def run_tokens(
+    syntax_blocks: List[Token], interpreter: Interpreter, iterations: int = 1
+) -> None:
+    """Runs all tokens in the specified syntax blocks by linearising them.
+    Note: tokens need to be grouped first by parser.
+    """
+    for syntax_block in syntax_blocks:
+        interpreter.init(syntax_block)
+
+    code = Lineariser().linearise(syntax_blocks)
+    for _ in range(iterations):
+        code.run(interpreter)
+        interpreter.raise_signal()
@@ -7,12 +7,14 @@ Created on Fri Nov 20 13:54:34 2020
 # #pylint: disable=too-many-lines
 
 import codecs
+import functools
 import importlib
+import itertools
 import operator
 import os
-from typing import Any, List
+from typing import Any, Callable, Dict, Iterator, List, Optional, Type
 
-from natscript.internal import exceptions, tokenvalue
+from natscript.internal import exceptions, modules, tokenvalue
 from natscript.internal.interfaces import Interpreter, Value, Variable
 from natscript.internal.token_ import (
     ClauseToken,
@@ -29,6 +31,17 @@ from natscript.util import path
 # pylint: disable=missing-class-docstring
 # pylint: disable=missing-function-docstring
 
+# types of collection elements which are bound to variables as they are
+SCALAR_TYPES = (int, float, str, bool)
+
+# operators with swapped operands, so that a literal can be bound as their first argument
+REFLECTED_OPERATORS = {
+    operator.eq: operator.eq,
+    operator.gt: operator.lt,
+    operator.lt: operator.gt,
+    operator.is_: operator.is_,
+}
+
 
 class TO(Token):
     functional = False
@@ -95,7 +108,7 @@ class COMMENT(Token):
     def pop_tokens(self, tokens):
         popped_tokens = []
         while tokens:
-            token = tokens.pop(0)
+            token = tokens.popleft()
             popped_tokens.append(token)
             if isinstance(token, LINEBREAK):
                 break
@@ -103,6 +116,8 @@ class COMMENT(Token):
 
 
 class VALUE(Token):
+    __slots__ = ("token_value",)
+
     def _init(self, interpreter: Interpreter):
         # pylint: disable=attribute-defined-outside-init
         self.token_value = self.TOKEN_FACTORY.create_value(self.value)
@@ -152,22 +167,57 @@ class DEFAULTING(Token):
 
 
 class VARNAME(VALUE):
+    __slots__ = ("layout", "slot")
     EXPECTED_TOKENS = [ExpectedToken((DEFAULTING,), optional=True)]
 
-    def _run(self, interpreter: Interpreter):
-        variable = (
-            interpreter.get_variable(self.value)
-            if interpreter.check_variable(self.value)
-            else self.TOKEN_FACTORY.create_variable(self.value)
-        )
+    def _init(self, interpreter: Interpreter):
+        # pylint: disable=attribute-defined-outside-init
+        super()._init(interpreter)
+        self.layout = None  # frame layout and slot are resolved by FUNCTION._init
+        self.slot = 0
 
+    def _run(self, interpreter: Interpreter):
+        variable = self.lookup(interpreter)
         if self.has_all_optionals:
             default_value = interpreter.stack_pop()
             variable.value = default_value.get_value()
             interpreter.set_variable(variable.name, variable)
 
         interpreter.stack_append(variable)
-        interpreter.set_variable("it", variable)
+
+    def resolve(self, interpreter: Interpreter) -> Variable:
+        """Returns the variable named by the token, or a new variable if undefined"""
+        slots = interpreter.get_slots(self.layout)
+        variable = None if slots is None else slots[self.slot]
+        if variable is None:
+            variable = (
+                interpreter.get_variable(self.value)
+                if interpreter.check_variable(self.value)
+                else self.TOKEN_FACTORY.create_variable(self.value)
+            )
+        return variable
+
+    def lookup(self, interpreter: Interpreter) -> Variable:
+        """Returns the variable named by the token and binds it to it"""
+        slots = interpreter.get_slots(self.layout)
+        variable = None if slots is None else slots[self.slot]
+        if variable is None:
+            variable = self.resolve(interpreter)
+
+        if slots is None:
+            interpreter.set_variable("it", variable)
+        else:
+            slots[0] = variable
+        return variable
+
+    def assign(self, interpreter: Interpreter, variable: Variable) -> None:
+        """Binds the variable to its name and to it"""
+        slots = interpreter.get_slots(self.layout)
+        if slots is not None and variable.name == self.value:
+            slots[0] = slots[self.slot] = variable
+        else:
+            interpreter.set_variable("it", variable)
+            interpreter.set_variable(variable.name, variable)
 
 
 class QualifierToken(Token):
@@ -205,11 +255,7 @@ class SET(Token):
 
     def run(self, interpreter: Interpreter):
         variable_token = self.sorted_tokens[1]
-        variable = (
-            interpreter.get_variable(variable_token.value)
-            if interpreter.check_variable(variable_token.value)
-            else self.TOKEN_FACTORY.create_variable(variable_token.value)
-        )
+        variable = variable_token.resolve(interpreter)
         interpreter.stack_append(variable)
         if self.has_all_optionals:
             self.sorted_tokens[-1].run(interpreter)
@@ -218,12 +264,11 @@ class SET(Token):
             value_variable = interpreter.get_variable(value_token.value)
             variable.value = value_variable.get_value()
             variable.inputs = value_variable.inputs
+            variable.layout = value_variable.layout
         else:
             value_token.run(interpreter)
             variable.value = interpreter.stack_pop().get_value()
-
-        interpreter.set_variable("it", variable)
-        interpreter.set_variable(variable.name, variable)
+        variable_token.assign(interpreter, variable)
 
 
 class PRINT(Token):
@@ -238,6 +283,10 @@ class OperatorToken(Token):
     def _run(self, interpreter: Interpreter):
         variable = interpreter.stack_pop()
         value = interpreter.stack_pop()
+        self.operate(variable, value)
+
+    def operate(self, variable: Variable, value: Value) -> None:
+        """Applies the operation of the token to the variable"""
         try:
             self.do_operation(variable, value)  # pylint: disable=no-member
         except TypeError:
@@ -297,10 +346,17 @@ class DIVIDE(OperatorToken):
 class IT(VARNAME):
     def _init(self, interpreter: Interpreter):
         self.value = "it"
+        super()._init(interpreter)
 
     def _run(self, interpreter: Interpreter):
-        variable = interpreter.get_variable("it")
-        interpreter.stack_append(variable)
+        interpreter.stack_append(self.lookup(interpreter))
+
+    def lookup(self, interpreter: Interpreter) -> Variable:
+        slots = interpreter.get_slots(self.layout)
+        variable = None if slots is None else slots[self.slot]
+        if variable is None:
+            variable = interpreter.get_variable("it")
+        return variable
 
 
 class CLAUSE_END(Token):
@@ -308,6 +364,7 @@ class CLAUSE_END(Token):
 
 
 class CLAUSE(VALUE, ClauseToken):
+    __slots__ = ("_value",)
     CLOSE_TOKEN = CLAUSE_END
 
     def _init(self, interpreter: Interpreter):
@@ -318,8 +375,15 @@ class CLAUSE(VALUE, ClauseToken):
         interpreter.stack_append(self._value)
 
     def run_tokens(self, interpreter: Interpreter):
-        for token in self.sorted_tokens:
-            interpreter.run(token)
+        try:
+            for token in self.sorted_tokens:
+                token.run(interpreter)
+                if interpreter.signal is not None:
+                    interpreter.signal_stack.append(token)
+                    return
+        except exceptions.RunTimeException as exc:
+            exc.token_stack.append(token)  # pylint: disable=undefined-loop-variable
+            raise
 
 
 class COLLECTION_END(Token):
@@ -327,15 +391,17 @@ class COLLECTION_END(Token):
 
 
 class COLLECTION(VALUE, ClauseToken):
+    __slots__ = ("length",)
     CLOSE_TOKEN = COLLECTION_END
 
     def _init(self, interpreter: Interpreter):
-        pass
+        # pylint: disable=attribute-defined-outside-init
+        self.length = len(self.sorted_tokens)
 
     def _run(self, interpreter: Interpreter):
         interpreter.stack_append(
             self.TOKEN_FACTORY.create_iterable_value(
-                [interpreter.stack_pop() for _ in self.sorted_tokens][::-1]
+                [interpreter.stack_pop() for _ in range(self.length)][::-1]
             )
         )
 
@@ -349,8 +415,12 @@ class APPEND(Token):
 
     def _run(self, interpreter: Interpreter):
         collection_variable = interpreter.stack_pop()
+        self.append(collection_variable, interpreter.stack_pop())
+
+    def append(self, collection_variable: Variable, value_: Value) -> None:
+        """Appends the value to the collection held by the variable"""
         collection: List[Any] = collection_variable.get_value()
-        value = interpreter.stack_pop().get_value()
+        value = value_.get_value()
 
         try:
             collection.append(value)
@@ -415,8 +485,11 @@ class LENGTH(VALUE):
     EXPECTED_TOKENS = [ExpectedToken((OF,), 0), ExpectedToken((VALUE,), 1)]
 
     def _run(self, interpreter: Interpreter):
-        collection = interpreter.stack_pop().get_value()
+        interpreter.stack_append(self.get_length(interpreter.stack_pop()))
 
+    def get_length(self, value: Value) -> Value:
+        """Returns the length of the collection held by the value"""
+        collection = value.get_value()
         try:
             len_ = len(collection)
         except TypeError:
@@ -425,8 +498,7 @@ class LENGTH(VALUE):
                 token=self,
             ) from None
 
-        length = self.TOKEN_FACTORY.create_value(len_)
-        interpreter.stack_append(length)
+        return self.TOKEN_FACTORY.create_value(len_)
 
 
 class EXPECTING(Token):
@@ -440,6 +512,7 @@ class WITH(Token):
 
 
 class FUNCTION(Token):
+    __slots__ = ("layout",)
     must_be_subtoken = True
     EXPECTED_TOKENS = [
         ExpectedToken((VARNAME,), 3),
@@ -448,15 +521,29 @@ class FUNCTION(Token):
         ExpectedToken((CLAUSE,), 1),
     ]
 
+    def _init(self, interpreter: Interpreter):
+        # pylint: disable=attribute-defined-outside-init
+        self.layout = _resolve_variables(self.tokens[-1])
+
     def _run(self, interpreter: Interpreter):
         function = interpreter.stack_pop()
         code = interpreter.stack_pop()
+        inputs = interpreter.stack_pop() if self.has_all_optionals else None
+        self.define(interpreter, function, code, inputs)
+        interpreter.stack_append(function)
+
+    def define(
+        self,
+        interpreter: Interpreter,
+        function: Variable,
+        code: Value,
+        inputs: Optional[Value],
+    ) -> None:
+        """Binds the code and the input variables, if any, to the function variable"""
         function.value = code.get_value()
-        function.inputs = (
-            interpreter.stack_pop().value if self.has_all_optionals else []
-        )
+        function.inputs = inputs.value if inputs is not None else []
+        function.layout = self.layout
         interpreter.set_variable(function.name, function)
-        interpreter.stack_append(function)
 
 
 class STRUCTURE(Token):
@@ -499,6 +586,25 @@ class DEFINE(Token):
     ]
 
 
+def _resolve_variables(clause: Token) -> Dict[str, int]:
+    """Resolves the variables accessed in the scope of a function clause to slots of
+    a new frame layout, which is returned. The clauses of nested definitions are run
+    in scopes of their own and are skipped.
+    """
+    layout = {"it": 0}
+
+    def resolve(token: Token):
+        for child in token.tokens:
+            if isinstance(child, VARNAME) and not isinstance(child, RESULT):
+                child.layout = layout
+                child.slot = layout.setdefault(child.value, len(layout))
+            if not isinstance(token, (FUNCTION, STRUCTURE)) or child is not token.tokens[-1]:
+                resolve(child)
+
+    resolve(clause)
+    return layout
+
+
 class NEW(VALUE):
     EXPECTED_TOKENS = [
         ExpectedToken((VARNAME,), 1),
@@ -552,11 +658,30 @@ class NEW(VALUE):
         interpreter.stack_append(instance)
 
 
-class RETURN(Token):
-    EXPECTED_TOKENS = [ExpectedToken((VALUE,), 0)]
+class SignalToken(Token):
+    """Base class of tokens interrupting the clauses being run.
+    The token is set as the interpreter signal, which is handled by the enclosing
+    CALL or loop, instead of raising an exception through all running tokens.
+    """
+
+    EXCEPTION: Type[exceptions.RunTimeException] = exceptions.RunTimeException
 
     def _run(self, interpreter: Interpreter):
-        raise exceptions.ReturnException(self)
+        interpreter.signal = self
+        interpreter.signal_stack = []
+
+    def raise_exception(self, token_stack: List[Token]) -> None:
+        """Raises the exception for the signal, if it could not be handled.
+        The token stack holds the tokens the signal was passed up through.
+        """
+        exception = self.EXCEPTION(self)  # type: ignore
+        exception.token_stack.extend(token_stack)
+        raise exception
+
+
+class RETURN(SignalToken):
+    EXPECTED_TOKENS = [ExpectedToken((VALUE,), 0)]
+    EXCEPTION = exceptions.ReturnException
 
 
 class CALL(Token):
@@ -567,23 +692,34 @@ class CALL(Token):
 
     def _run(self, interpreter: Interpreter):
         function = interpreter.stack_pop()
-
+        inputs = interpreter.stack_pop() if self.has_all_optionals else None
+        self.call(interpreter, function, inputs)
+
+    def call(
+        self, interpreter: Interpreter, function: Variable, inputs: Optional[Value]
+    ) -> None:
+        """Calls the function with the values in the inputs collection, if any,
+        and binds its return value to result.
+        """
         input_values: List[Any]
-        if self.has_all_optionals:
-            inputs = interpreter.stack_pop()
+        if inputs is not None:
             inputs.get_value()  # check defined
             input_values = inputs.value
         else:
             input_values = []
 
-        interpreter.add_stack()
+        interpreter.add_stack(function.layout)
         # some functions dont have inputs
         if function.inputs:
+            # each call binds new argument variables, so recursive calls do not share them.
             # no explicit check for function inputs being matched in case of default args
-            for input_, variable in zip(input_values, function.inputs):
+            create_variable = self.TOKEN_FACTORY.create_variable
+            for input_, parameter in zip(input_values, function.inputs):
+                variable = create_variable(parameter.name)
                 variable.value = input_.get_value()
                 variable.inputs = input_.inputs  # for callable input args
-                interpreter.set_variable(variable.name, variable)
+                variable.layout = input_.layout
+                interpreter.set_variable(parameter.name, variable)
 
         try:
             function.get_value()(interpreter)
@@ -592,15 +728,17 @@ class CALL(Token):
                 f"Cannot call variable of type {function.get_value().__class__.__name__}!",
                 token=self,
             ) from None
-        except exceptions.ReturnException:
-            pass
+        # signals of loops are left for the loops around the call
+        if interpreter.signal.__class__ is RETURN:
+            interpreter.signal = None
 
         try:
             return_value: Variable = interpreter.stack_pop()  # type: ignore
         except exceptions.EmptyStackError:
             return_value: Variable = self.TOKEN_FACTORY.create_none_value()
         interpreter.remove_stack()
-        interpreter.set_variable("result", return_value)
+        # result may be modified in place, so it cannot be bound to a shared value
+        interpreter.set_variable("result", return_value.unshare())
 
 
 class RESULT(VARNAME):
@@ -611,10 +749,13 @@ class RESULT(VARNAME):
     ]
 
     def _run(self, interpreter: Interpreter):
+        interpreter.stack_append(self.lookup(interpreter))
+
+    def lookup(self, interpreter: Interpreter) -> Variable:
         variable = interpreter.get_variable("result")
         interpreter.remove_variable("result")
         interpreter.set_variable("it", variable)
-        interpreter.stack_append(variable)
+        return variable
 
 
 class ELSE(Token):
@@ -635,15 +776,39 @@ class CONDITION(VALUE, ClauseToken):
         value = self.TOKEN_FACTORY.create_value(condition_result)
         interpreter.stack_append(value)
 
+    def compile_predicate(self) -> Optional[Callable[[Any], Any]]:
+        """Returns a function evaluating the condition for a value if the value is compared
+        against a literal, else None.
+        """
+        literal = self.tokens[-1] if self.tokens else None
+        if literal.__class__ not in (INTEGER, FLOAT, STRING, TRUE, FALSE):
+            return None
+
+        constant = literal.value
+        operator_ = self.OPERATOR
+        reflected_operator = REFLECTED_OPERATORS.get(operator_)
+        if reflected_operator is not None:
+            return functools.partial(reflected_operator, constant)
+        return lambda value: operator_(value, constant)
+
 
 class NOT(CONDITION):
     EXPECTED_TOKENS = [ExpectedToken((VALUE,))]
 
     def _run(self, interpreter: Interpreter):
-        value = interpreter.stack_pop()
+        value = interpreter.stack_pop().unshare()
         value.negate_value()
         interpreter.stack_append(value)
 
+    def compile_predicate(self) -> Optional[Callable[[Any], Any]]:
+        condition = self.tokens[0] if self.tokens else None
+        if not isinstance(condition, CONDITION):
+            return None
+        predicate = condition.compile_predicate()
+        if predicate is None:
+            return None
+        return lambda value: not predicate(value)
+
 
 class CHECK(VALUE):
     EXPECTED_TOKENS = [
@@ -678,62 +843,59 @@ class IN(Token):
 
     def _run(self, interpreter: Interpreter):
         variable: Variable = interpreter.stack_pop()  # type: ignore
-        value = interpreter.stack_pop()
+        self.bind(interpreter, variable, interpreter.stack_pop())
+
+    def bind(self, interpreter: Interpreter, variable: Variable, value: Value) -> None:
+        """Binds the value to the variable"""
         variable.value = value.get_value()
         variable.inputs = value.inputs
+        variable.layout = value.layout
         interpreter.set_variable(variable.name, variable)
 
 
 class EACH(Token):
     must_be_subtoken = True
 
-    # run order is ignored by EACH.run method
+    # run order is ignored by FOR.run method
     EXPECTED_TOKENS = [
         ExpectedToken((VARNAME,), 1),
         ExpectedToken((IN,), 2),
         ExpectedToken((VALUE,), 0),
     ]
 
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self._index = 0
-        self.collection = None
-
-    def run(self, interpreter: Interpreter):
-        if self.collection is None:
-            interpreter.run(self.tokens[-1])
-            self.collection = iter(interpreter.stack_pop().value)
-
+    def iterate(self, collection: Value) -> Iterator[Any]:
+        """Returns a new iterator over the elements of the collection.
+        The iterator is kept by the running loop, so a loop may run several times at once.
+        """
         try:
-            collection_value = next(self.collection)
-        except StopIteration:
-            self.reset()
-            raise exceptions.BreakIterationException(self) from None
+            return iter(collection.value)
         except TypeError:
             raise exceptions.TypeException(
-                f"Cannot iterate through value of type {self.collection.__class__.__name__}!",
+                f"Cannot iterate through value of type {collection.value.__class__.__name__}!",
                 token=self,
             ) from None
 
-        value = (
+    def bind_element(self, interpreter: Interpreter, variable: Variable, element: Any) -> None:
+        """Binds the element of the collection to the variable.
+        Elements of scalar types are bound as they are, without creating an element value.
+        """
+        if element.__class__ in SCALAR_TYPES:
+            variable.value = element
+            variable.inputs = None
+            variable.layout = None
+            interpreter.set_variable(variable.name, variable)
+        else:
+            self.tokens[1].bind(interpreter, variable, self.create_element_value(element))
+
+    def create_element_value(self, collection_value: Any) -> Value:
+        """Returns the value bound to the variable for an element of the collection"""
+        return (
             collection_value
             if isinstance(collection_value, tokenvalue.Variable)
             else self.TOKEN_FACTORY.create_any_value(
                 tokenvalue.IterableValue.get_item_value(collection_value)
             )
         )
-        interpreter.stack_append(value)
-
-        # ignore collection (last token), as it was previously run
-        for token in self.tokens[:-1]:
-            interpreter.run(token)
-
-        # append it again, this value can be consumed by optional for-each
-        # condition, or needs to be thrown away by for-each loop if no condition
-        interpreter.stack_append(value)
-
-    def reset(self):
-        self.collection = None
 
 
 class FOR(Token):
@@ -744,22 +906,47 @@ class FOR(Token):
     ]
 
     def run(self, interpreter: Interpreter):
-        while True:
-            try:
-                for token in self.tokens:
-                    interpreter.run(token)
-            except exceptions.BreakIterationException:
-                break
-
-            clause = interpreter.stack_pop()
+        each = self.tokens[0]
+        variable_token, in_token, collection_token = each.tokens
+        condition = self.tokens[1] if self.has_all_optionals else None
+        interpreter.run(self.tokens[-1])
+        clause_function = interpreter.stack_pop().get_value()
+        try:
+            interpreter.run(collection_token)
+            elements = each.iterate(interpreter.stack_pop())
+        except exceptions.RunTimeException as exc:
+            exc.token_stack.append(each)
+            raise
+
+        for element in elements:
+            token = each
             try:
-                condition = interpreter.stack_pop()
-                if not self.has_all_optionals or condition.get_value():
-                    clause.get_value()(interpreter)
-            except exceptions.SkipElementException:
-                pass
-            except exceptions.BreakIterationException:
-                break
+                interpreter.run(variable_token)
+                variable = interpreter.stack_pop()
+                try:
+                    each.bind_element(interpreter, variable, element)
+                except exceptions.RunTimeException as exc:
+                    exc.token_stack.append(in_token)
+                    raise
+                if condition is not None:
+                    # the condition compares the element bound to the variable
+                    token = condition
+                    interpreter.stack_append(variable)
+                    condition.run(interpreter)
+                    if not interpreter.stack_pop().get_value():
+                        continue
+            except exceptions.RunTimeException as exc:
+                exc.token_stack.append(token)
+                raise
+
+            clause_function(interpreter)
+            signal = interpreter.signal
+            if signal is not None:
+                if signal.__class__ is RETURN:
+                    break
+                interpreter.signal = None
+                if signal.__class__ is BREAK:
+                    break
 
 
 class WHILE(Token):
@@ -777,9 +964,11 @@ class WHILE(Token):
             if not interpreter.stack_pop().get_value():
                 break
 
-            try:
-                clause_function(interpreter)
-            except exceptions.BreakIterationException:
+            clause_function(interpreter)
+            signal = interpreter.signal
+            if signal is not None:
+                if signal.__class__ is BREAK:
+                    interpreter.signal = None
                 break
 
 
@@ -861,7 +1050,11 @@ class ROUND(VALUE):
     EXPECTED_TOKENS = [ExpectedToken((VALUE,))]
 
     def _run(self, interpreter: Interpreter):
-        value = interpreter.stack_pop()
+        self.round_value(interpreter.stack_pop())
+
+    def round_value(self, value_: Value) -> None:
+        """Rounds the value in place"""
+        value = value_.unshare()
         try:
             value.value = round(value.value)
         except TypeError:
@@ -891,7 +1084,12 @@ class GET(Token):
         variable = interpreter.stack_pop()
         collection = interpreter.stack_pop().get_value()
         index = interpreter.stack_pop().get_value()
+        self.get(interpreter, variable, collection, index)
 
+    def get(
+        self, interpreter: Interpreter, variable: Variable, collection: Any, index: Any
+    ) -> None:
+        """Binds the element of the collection at the index to the variable"""
         try:
             value = (
                 getattr(collection, index)
@@ -914,6 +1112,7 @@ class GET(Token):
         if isinstance(value, tokenvalue.Value):
             variable.value = value.get_value()
             variable.inputs = value.inputs  # for callable args
+            variable.layout = value.layout
         else:
             variable.value = value
         interpreter.set_variable(variable.name, variable)
@@ -942,11 +1141,17 @@ class UPDATE(Token):
 
 
 class CollectionLogicToken(VALUE):
+    __slots__ = ("predicate",)
     EXPECTED_TOKENS = [
         ExpectedToken((VALUE,), 0),
         ExpectedToken((CONDITION,), 1, optional=True),
     ]
-    initial_condition_value = True
+
+    def _init(self, interpreter: Interpreter):
+        # pylint: disable=attribute-defined-outside-init
+        self.predicate = (
+            self.tokens[1].compile_predicate() if self.has_all_optionals else None
+        )
 
     def run(self, interpreter: Interpreter):
         interpreter.run(self.tokens[0])
@@ -959,135 +1164,175 @@ class CollectionLogicToken(VALUE):
                 f"Value {collection} is not iterable!", token=self
             ) from None
 
-        for value in collection:
-            result = self._get_condition_result(value, interpreter)
-            if self._check_if_should_break(result):  # pylint: disable=no-member
-                condition_value = not self.initial_condition_value
-                break
-        else:
-            condition_value = self.initial_condition_value
-
-        result = self.TOKEN_FACTORY.create_value(condition_value)
-        interpreter.stack_append(result)
-
-    def _get_condition_result(self, value: Any, interpreter: Interpreter) -> bool:
         if not self.has_all_optionals:
-            return bool(value)
+            results = collection
+        elif self.predicate is not None:
+            results = map(self.predicate, collection)
+        else:
+            results = self._get_condition_results(collection, interpreter)
+        condition_value = self.evaluate(results)  # pylint: disable=no-member
+        interpreter.stack_append(self.TOKEN_FACTORY.create_value(condition_value))
 
-        interpreter.stack_append(self.TOKEN_FACTORY.create_any_value(value))
-        interpreter.run(self.tokens[1])  # type: ignore
-        return interpreter.stack_pop().get_value()
+    def _get_condition_results(self, collection: Any, interpreter: Interpreter) -> Iterator[Any]:
+        for value in collection:
+            interpreter.stack_append(self.TOKEN_FACTORY.create_any_value(value))
+            interpreter.run(self.tokens[1])  # type: ignore
+            yield interpreter.stack_pop().get_value()
 
 
 class ALL(CollectionLogicToken):
-    initial_condition_value = True
-
-    def _check_if_should_break(self, result: bool):
-        return not result
+    @staticmethod
+    def evaluate(results: Iterator[Any]) -> bool:
+        return all(results)
 
 
 class ANY(CollectionLogicToken):
-    initial_condition_value = False
-
-    def _check_if_should_break(self, result: bool):
-        return result
+    @staticmethod
+    def evaluate(results: Iterator[Any]) -> bool:
+        return any(results)
 
 
 class SOME(CollectionLogicToken):
-    initial_condition_value = False
-
-    def run(self, interpreter: Interpreter):
-        self.counter = 0  # pylint: disable=attribute-defined-outside-init
-        super().run(interpreter)
-
-    def _check_if_should_break(self, result: bool):
-        if result:
-            self.counter += 1
-        return self.counter > 1
+    @staticmethod
+    def evaluate(results: Iterator[Any]) -> bool:
+        """Returns True if at least two of the results are true"""
+        true_results = filter(None, results)
+        return next(true_results, None) is not None and next(true_results, None) is not None
 
 
 class NONE(CollectionLogicToken):
-    initial_condition_value = True
-
-    def _check_if_should_break(self, result: bool):
-        return result
+    @staticmethod
+    def evaluate(results: Iterator[Any]) -> bool:
+        return not any(results)
 
 
 class IMPORT(Token):
+    __slots__ = ("module",)
     EXPECTED_TOKENS = [
         ExpectedToken((COLLECTION,), 2),
         ExpectedToken((FROM,), 1),
         ExpectedToken((STRING,), 0),
     ]
 
+    def _init(self, interpreter: Interpreter):
+        # pylint: disable=attribute-defined-outside-init
+        self.module: Optional[modules.Module] = None
+
     def run(self, interpreter: Interpreter):
         interpreter.run(self.tokens[0])
         import_variables = interpreter.stack_pop().value
         filename = self.tokens[-1].value
 
-        import_ = (
-            self._import_python_module
-            if filename.endswith(".py")
-            else self._import_tokens
-        )
-        try:
-            import_(interpreter, filename)
-        except (FileNotFoundError, ModuleNotFoundError):
-            raise exceptions.ImportException(
-                f"Failed to import because file could not be found: {filename}",
-                token=self,
-            ) from None
+        # the module imported by the last run is reused unless it has been reloaded
+        module = self.module
+        if module is None or self.MODULE_REGISTRY.get(module.path) is not module:
+            try:
+                module = self.module = self._import(interpreter, filename)
+            except (FileNotFoundError, ModuleNotFoundError):
+                raise exceptions.ImportException(
+                    f"Failed to import because file could not be found: {filename}",
+                    token=self,
+                ) from None
 
         variables: List[Variable] = []
         for import_variable in import_variables:
             try:
-                variable = interpreter.get_variable(import_variable.name)
+                name = import_variable.name
             except AttributeError:
                 type_ = import_variable.value.__class__.__name__
                 raise exceptions.ValueException(
                     f"Cannot import: value of type {type_} is not a variable!"
                 ) from None
 
+            variable = module.variables.get(name)
+            if variable is None:
+                raise exceptions.UndefinedVariableException(name)
             if variable.get_qualifier("private"):
                 raise exceptions.ImportException(
                     f"Could not import private variable {variable.name} from module {filename}!",
                     token=self,
                 ) from None
             variables.append(variable)
-        interpreter.remove_stack()
 
+        # the importer binds copies, so that redefining them does not change the module
         for variable in variables:
-            interpreter.set_variable(variable.name, variable)
+            interpreter.set_variable(variable.name, variable.copy())
 
-    def _import_tokens(self, interpreter: Interpreter, filename: str) -> None:
-        if self.TOKEN_COMPILER is not None:
-            try:
-                tokens = self.TOKEN_COMPILER.read_compiled_file(filename)
-            except self.TOKEN_COMPILER.exception:
-                tokens = self._construct_tokens(filename)
+    def _import(self, interpreter: Interpreter, filename: str) -> modules.Module:
+        """Returns the module imported from the file, which is only loaded and run if it
+        has not been imported before.
+        """
+        from natscript import interpret
+
+        if filename.endswith(".py"):
+            python_module = importlib.import_module(os.path.splitext(filename)[0])
+            module_path = getattr(python_module, "__file__", None) or python_module.__name__
+            module_path = os.path.abspath(module_path)
+            load = functools.partial(
+                self._import_python_module, module=python_module, module_path=module_path
+            )
         else:
-            tokens = self._construct_tokens(filename)
+            module_path = os.path.abspath(interpret.find_file(filename))
+            load = functools.partial(
+                self._import_tokens, filename=filename, module_path=module_path
+            )
+
+        module = self.MODULE_REGISTRY.get(module_path)
+        if module is not None:
+            return module
 
         interpreter.add_stack()
+        try:
+            load(interpreter)
+            module = modules.Module(module_path, interpreter.get_variables())
+        finally:
+            interpreter.remove_stack()
+        self.MODULE_REGISTRY.add(module)
+        return module
+
+    def _import_tokens(self, interpreter: Interpreter, filename: str, module_path: str) -> None:
+        tokens = None
+        if self.TOKEN_COMPILER is not None:
+            from natscript import interpret
+
+            tokens = interpret.LIBRARY_BUNDLE.get_tokens(module_path)
+        if tokens is None:
+            tokens = self._read_tokens(filename)
+
         for token in tokens:
             interpreter.init(token)
 
         with path.ChangeDir(os.path.dirname(filename)):
             for token in tokens:
                 interpreter.run(token)
+                if interpreter.signal is not None:
+                    interpreter.signal_stack.append(token)
+                    interpreter.raise_signal()
+
+    def _read_tokens(self, filename: str) -> List[Token]:
+        if self.TOKEN_COMPILER is None:
+            return self._construct_tokens(filename)
+        try:
+            return self.TOKEN_COMPILER.read_compiled_file(filename)
+        except self.TOKEN_COMPILER.exception:
+            return self._construct_tokens(filename)
 
     def _construct_tokens(self, filename):
         from natscript import interpret
 
         return interpret.construct_tokens(filename)
 
-    def _import_python_module(self, interpreter: Interpreter, filename: str) -> None:
-        module = importlib.import_module(os.path.splitext(filename)[0])
-        interpreter.add_stack()
-        for name, value in module.__dict__.items():
-            if name.startswith("_"):
+    def _import_python_module(self, interpreter: Interpreter, module: Any, module_path: str):
+        names = None
+        if self.TOKEN_COMPILER is not None:
+            from natscript import interpret
+
+            names = interpret.LIBRARY_BUNDLE.get_exports(module_path)
+        for name in module.__dict__ if names is None else names:
+            if name.startswith("_") or name not in module.__dict__:
                 continue
 
+            value = module.__dict__[name]
             try:
                 self._set_variable(interpreter, name, value)
             except Exception:  # pylint: disable=broad-except
@@ -1110,9 +1355,12 @@ class IMPORT(Token):
             args = []
             for x in range(function.__code__.co_argcount):
                 try:
-                    args.append(interpreter.get_variable(x).get_value())
+                    value = interpreter.get_variable(x).get_value()
                 except exceptions.UndefinedVariableException:
                     break
+                if value.__class__ is tokenvalue.LazyRange:
+                    value = value.materialise()  # Python code expects plain lists
+                args.append(value)
 
             try:
                 return_value = function(*args)
@@ -1123,18 +1371,14 @@ class IMPORT(Token):
         return inner
 
 
-class SKIP(Token):
+class SKIP(SignalToken):
     EXPECTED_TOKENS = [ExpectedToken((VARNAME,), optional=True)]
+    EXCEPTION = exceptions.SkipElementException
 
-    def _run(self, interpreter: Interpreter):
-        raise exceptions.SkipElementException(self)
 
-
-class BREAK(Token):
+class BREAK(SignalToken):
     EXPECTED_TOKENS = [ExpectedToken((OUT,))]
-
-    def _run(self, interpreter: Interpreter):
-        raise exceptions.BreakIterationException(self)
+    EXCEPTION = exceptions.BreakIterationException
 
 
 class RANGE(VALUE):
@@ -1149,7 +1393,9 @@ class RANGE(VALUE):
         end = interpreter.stack_pop().get_value()
         start = interpreter.stack_pop().get_value()
         interpreter.stack_append(
-            self.TOKEN_FACTORY.create_iterable_value(value=list(range(start, end)))
+            self.TOKEN_FACTORY.create_iterable_value(
+                value=tokenvalue.LazyRange(range(start, end))
+            )
         )
 
 
@@ -1226,20 +1472,29 @@ class APPLY(Token):
 
     def _run(self, interpreter: Interpreter):
         collection = interpreter.stack_pop()
-        try:
-            list_ = list(collection.get_value())
-        except TypeError:
-            raise exceptions.TypeException(
-                f"Value of type {collection.get_value().__class__.__name__} is not iterable!"
-            ) from None
+        value = collection.get_value()
+        if value.__class__ is tokenvalue.Stream:
+            list_ = None
+        else:
+            try:
+                list_ = list(value)
+            except TypeError:
+                raise exceptions.TypeException(
+                    f"Value of type {value.__class__.__name__} is not iterable!"
+                ) from None
 
         function = interpreter.stack_pop()
         # some functions dont have inputs
         if not function.inputs or not len(function.inputs) == 1:
             raise exceptions.TypeException("Apply function should expect one input!")
 
-        interpreter.add_stack()
-        variable = function.inputs[0]
+        if list_ is None:
+            collection.value = tokenvalue.Stream(self.stream(interpreter, function, value))
+            interpreter.set_variable("result", collection)
+            return
+
+        interpreter.add_stack(function.layout)
+        variable = self.TOKEN_FACTORY.create_variable(function.inputs[0].name)
         interpreter.set_variable(variable.name, variable)
         for i, value in enumerate(list_):
             variable.value = value
@@ -1249,12 +1504,38 @@ class APPLY(Token):
                 raise exceptions.TypeException(
                     f"Cannot call variable of type {function.get_value().__class__.__name__}!"
                 ) from None
-            except exceptions.ReturnException:
-                pass
+
+            if interpreter.signal is not None:
+                if interpreter.signal.__class__ is not RETURN:
+                    break  # signals of loops are left for the loops around the apply
+                interpreter.signal = None
             collection.value[i] = interpreter.stack_pop().get_value()  # return value
         interpreter.remove_stack()
+        if isinstance(collection, tokenvalue.IterableValue):
+            collection.invalidate()
         interpreter.set_variable("result", collection)
 
+    def stream(
+        self, interpreter: Interpreter, function: Variable, stream: Iterator[Any]
+    ) -> Iterator[Any]:
+        """Lazily applies the function to each value of the stream while it is iterated.
+        Each call runs in its own scope, as the stream may be iterated from any scope.
+        """
+        for value in stream:
+            interpreter.add_stack(function.layout)
+            variable = self.TOKEN_FACTORY.create_variable(function.inputs[0].name)
+            variable.value = value
+            interpreter.set_variable(variable.name, variable)
+            function.get_value()(interpreter)
+            if interpreter.signal is not None:
+                if interpreter.signal.__class__ is not RETURN:
+                    interpreter.remove_stack()
+                    return  # signals of loops end the stream and are left for the loops
+                interpreter.signal = None
+            return_value = interpreter.stack_pop().get_value()
+            interpreter.remove_stack()
+            yield return_value
+
 
 class REVERSE(Token):
     EXPECTED_TOKENS = [ExpectedToken((VALUE,))]
@@ -1270,6 +1551,7 @@ class REVERSE(Token):
 
 
 class EXCLUDE(Token):
+    __slots__ = ("predicate",)
     EXPECTED_TOKENS = [
         ExpectedToken((VARNAME,), 0),
         ExpectedToken((CONDITION,), 1),
@@ -1277,41 +1559,81 @@ class EXCLUDE(Token):
         ExpectedToken((VALUE,), 3),
     ]
 
+    def _init(self, interpreter: Interpreter):
+        # pylint: disable=attribute-defined-outside-init
+        self.predicate = self.tokens[1].compile_predicate()
+
     def run(self, interpreter: Interpreter):
-        try:
-            it = interpreter.get_variable("it")
-        except exceptions.UndefinedVariableException:
-            it = None
+        it = self._get_it(interpreter)
         self.tokens[3].run(interpreter)
         collection = interpreter.stack_pop()
         collection_list = collection.get_value()
         self.tokens[0].run(interpreter)
         variable = interpreter.stack_pop()
 
-        try:
-            collection_value = list(collection.get_value())
-        except TypeError:
-            raise exceptions.TypeException(
-                f"Value of type {collection.get_value().__class__.__name__} is not iterable!"
-            ) from None
-
-        indices = []
-        for i, value in enumerate(collection_value):
-            interpreter.stack_append(self.TOKEN_FACTORY.create_any_value(value))
-            interpreter.run(self.tokens[1])  # type: ignore
-            condition_value = interpreter.stack_pop().get_value()
-            if condition_value:
-                indices.append(i)
-
         values = []
-        for i, index in enumerate(indices):
-            values.append(collection_list.pop(index - i))
+        if collection_list.__class__ is tokenvalue.Stream:
+            collection.value = tokenvalue.Stream(
+                self.stream(interpreter, collection_list, values)
+            )
+        else:
+            try:
+                collection_value = list(collection.get_value())
+            except TypeError:
+                raise exceptions.TypeException(
+                    f"Value of type {collection.get_value().__class__.__name__} is not iterable!"
+                ) from None
+
+            if self.predicate is not None:
+                matches = list(map(self.predicate, collection_value))
+            else:
+                matches = [self._matches(interpreter, value) for value in collection_value]
+            values = list(itertools.compress(collection_value, matches))
+            if values:
+                kept_values = itertools.compress(collection_value, map(operator.not_, matches))
+                try:
+                    collection_list[:] = kept_values
+                except TypeError:
+                    raise exceptions.TypeException(
+                        f"Cannot exclude values from type {collection_list.__class__.__name__}!",
+                        token=self,
+                    ) from None
         variable.value = values
         interpreter.set_variable(variable.name, variable)
 
         if it is not None:
             interpreter.set_variable("it", it)
 
+    def stream(
+        self, interpreter: Interpreter, stream: Iterator[Any], excluded: List[Any]
+    ) -> Iterator[Any]:
+        """Lazily yields the values of the stream not matching the condition while it is
+        iterated. The matching values are appended to the excluded values when reached.
+        """
+        for value in stream:
+            it = self._get_it(interpreter)
+            matches = self._matches(interpreter, value)
+            if it is not None:
+                interpreter.set_variable("it", it)
+            if matches:
+                excluded.append(value)
+            else:
+                yield value
+
+    def _matches(self, interpreter: Interpreter, value: Any) -> bool:
+        if self.predicate is not None:
+            return self.predicate(value)
+        interpreter.stack_append(self.TOKEN_FACTORY.create_any_value(value))
+        interpreter.run(self.tokens[1])  # type: ignore
+        return interpreter.stack_pop().get_value()
+
+    @staticmethod
+    def _get_it(interpreter: Interpreter) -> Optional[Value]:
+        try:
+            return interpreter.get_variable("it")
+        except exceptions.UndefinedVariableException:
+            return None
+
 
 class SORT(Token):
     EXPECTED_TOKENS = [ExpectedToken((VALUE,), 0)]
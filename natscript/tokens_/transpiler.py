@@ -0,0 +1,733 @@
+# -*- coding: utf-8 -*-
+"""
+This module contains the Python transpiler for the Natscript interpreter.
+
+The transpiler turns the initialised token trees of a Natscript module into Python
+source code, which is compiled to a Python code object and run. Control flow maps
+to native Python constructs (if, while, break, continue, return) and the values of
+subtokens are held in Python local variables instead of the interpreter stack.
+Variables, values and function calls still use the interpreter and the token
+methods, so the semantics are the same as running the tokens.
+Tokens without a Python translation are compiled to closures instead.
+
+Runtime exceptions get the same token stack as from the closure compiler:
+each generated function adds the tokens enclosing the line an exception passed
+through, which are looked up in a line table only once an exception occurs.
+
+Public interface:
+
+    PythonTranspiler:
+        transpile
+        load
+        read_transpiled_file
+        write_transpiled_file
+        get_transpiled_filename
+
+    run_tokens
+
+"""
+import contextlib
+import os
+import re
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from natscript import VERSION
+from natscript.internal import exceptions
+from natscript.internal.interfaces import Interpreter
+from natscript.internal.token_ import Token
+from natscript.tokens_ import closures, compiler, tokens
+
+TRANSPILER_VERSION = 4
+
+# (indentation, code, enclosing token indices, innermost first)
+Line = Tuple[int, str, Tuple[int, ...]]
+
+COMPARISON_OPERATORS = {
+    tokens.EQUAL: "{first} == {second}",
+    tokens.GREATER: "{first} > {second}",
+    tokens.LESS: "{first} < {second}",
+    tokens.CONTAINS: "{second} in {first}",
+    tokens.IDENTICAL: "{first} is {second}",
+}
+
+INLINE_OPERATORS = {tokens.ADD: "+", tokens.SUBTRACT: "-", tokens.MULTIPLY: "*"}
+
+HEADER = """# -*- coding: utf-8 -*-
+# Natscript module transpiled to Python by natscript.tokens_.transpiler
+import types as _types
+
+from natscript.internal import exceptions as _exceptions
+from natscript.internal.token_ import Token as _Token
+from natscript.tokens_ import tokens as _token_types
+
+
+def load(_tokens, _compiler):
+    _RunTimeException = _exceptions.RunTimeException
+    _RETURN = _token_types.RETURN
+    _BREAK = _token_types.BREAK
+    _create_value = _Token.TOKEN_FACTORY.create_value
+    _create_iterable_value = _Token.TOKEN_FACTORY.create_iterable_value
+
+    def _trace(exc):
+        indices = _LINES.get(exc.__traceback__.tb_lineno, ())
+        exc.token_stack.extend([_tokens[i] for i in indices])
+
+"""
+
+
+class PythonTranspiler:
+    """Transpiles initialised token trees to Python source code"""
+
+    exception = compiler.CompilerError
+
+    def __init__(self):
+        self._reset()
+        self._statements = {
+            tokens.SET: self._transpile_set,
+            tokens.ADD: self._transpile_operation,
+            tokens.SUBTRACT: self._transpile_operation,
+            tokens.MULTIPLY: self._transpile_operation,
+            tokens.DIVIDE: self._transpile_operation,
+            tokens.PRINT: self._transpile_print,
+            tokens.APPEND: self._transpile_append,
+            tokens.GET: self._transpile_get,
+            tokens.CALL: self._transpile_call,
+            tokens.IF: self._transpile_if,
+            tokens.WHILE: self._transpile_while,
+            tokens.FOR: self._transpile_for,
+            tokens.RETURN: self._transpile_return,
+            tokens.BREAK: self._transpile_break,
+            tokens.SKIP: self._transpile_skip,
+            tokens.ROUND: self._transpile_round,
+            tokens.DEFINE: self._transpile_define,
+        }
+        self._expressions = {
+            tokens.VARNAME: self._transpile_varname,
+            tokens.IT: self._transpile_varname,
+            tokens.RESULT: self._transpile_result,
+            tokens.CHECK: self._transpile_check,
+            tokens.NOT: self._transpile_not,
+            tokens.LENGTH: self._transpile_length,
+            tokens.COLLECTION: self._transpile_collection,
+            tokens.CLAUSE: self._transpile_clause,
+            tokens.FUNCTION: self._transpile_function,
+            tokens.AT: self._transpile_subtoken,
+            tokens.WITH: self._transpile_subtoken,
+            tokens.EXPECTING: self._transpile_subtoken,
+        }
+        self._expressions.update(
+            {x: self._transpile_literal for x in closures.LITERAL_TOKENS}
+        )
+
+    def transpile(self, syntax_blocks: List[Token]) -> str:
+        """Returns the Python source code of the syntax blocks.
+        The source defines a load function, which takes all tokens in the syntax blocks
+        in depth-first order and a ClosureCompiler, and returns the module function.
+        """
+        self._reset()
+        self._indices = {id(x): i for i, x in enumerate(_walk(syntax_blocks))}
+        with self._function("_module(interpreter)"):
+            for syntax_block in syntax_blocks:
+                self._statement(syntax_block)
+
+        lines = HEADER.splitlines()
+        lines.extend(f"    {name} = {value}" for name, value in self._bindings.items())
+        table: Dict[int, Tuple[int, ...]] = {}
+        for function in self._functions:
+            lines.append("")
+            for indent, code, chain in function:
+                lines.append("    " * (indent + 1) + code)
+                if chain:
+                    table[len(lines)] = chain
+        lines.append("")
+        lines.extend(f"    {name} = {value}" for name, value in self._clause_values.items())
+        lines.append("    return _module")
+        lines.extend(["", "", f"_LINES = {table!r}", ""])
+        return "\n".join(lines)
+
+    def load(self, source: str, syntax_blocks: List[Token]) -> closures.Statement:
+        """Runs the transpiled source of the syntax blocks and returns the module function.
+        Raises a SyntaxError if the source cannot be compiled by Python.
+        """
+        code = compile(source, "<natscript>", "exec")
+        namespace: Dict[str, Any] = {}
+        exec(code, namespace)  # pylint: disable=exec-used
+        return namespace["load"](list(_walk(syntax_blocks)), closures.ClosureCompiler())
+
+    def read_transpiled_file(self, filename: str) -> str:
+        """Returns the transpiled source cached for the specified source code file.
+
+        The cached file next to the source code file is tried first, then the one in the
+        user cache directory. If no cached file can be found or the transpiler version,
+        lexer or file hash in the cached file do not match, a CompilerError exception
+        is thrown. The source code file is only hashed if its mtime or size changed.
+        """
+        transpiled_filename = self.get_transpiled_filename(filename)
+        error = compiler.CompilerError("Transpiled file does not exist!")
+        for candidate in (transpiled_filename, compiler.get_cached_filename(transpiled_filename)):
+            if not os.path.isfile(candidate):
+                continue
+            try:
+                return self._read_source(filename, candidate)
+            except compiler.CompilerError as exc:
+                error = exc
+        raise error
+
+    def write_transpiled_file(self, source: str, filename: str) -> None:
+        """Caches the transpiled source next to the compiled file of the source code file,
+        along with the stat and current filehash of the source code file.
+        If the directory is not writable, the user cache directory is used instead.
+        """
+        transpiled_filename = self.get_transpiled_filename(filename)
+        dirname = os.path.dirname(transpiled_filename)
+        if not os.access(dirname or ".", os.W_OK):
+            transpiled_filename = compiler.get_cached_filename(transpiled_filename)
+            os.makedirs(os.path.dirname(transpiled_filename), exist_ok=True)
+        self._write_source(source, filename, transpiled_filename, compiler.hash_file(filename))
+
+    @staticmethod
+    def get_transpiled_filename(filename: str) -> str:
+        """Returns the name of the transpiled file corresponding to the specified filename"""
+        _, ext = os.path.splitext(filename)
+        return re.sub(rf"{ext}$", ".natpy", filename)
+
+    def _read_source(self, filename: str, transpiled_filename: str) -> str:
+        with open(transpiled_filename, "r", encoding="utf-8") as file:
+            source = file.read()
+        source, _, footer = source.rstrip("\n").rpartition("\n")
+        source += "\n"
+        stat, _, hash_ = footer.rpartition(", hash ")
+        if stat == self._get_footer(filename):
+            return source
+        if not stat.startswith(self._get_prefix()):
+            raise compiler.CompilerError(
+                "Transpiled file is from another transpiler, interpreter or lexer!"
+            )
+        if hash_ != compiler.hash_file(filename):
+            raise compiler.CompilerError("Hash in transpiled file did not match file hash!")
+        try:
+            self._write_source(source, filename, transpiled_filename, hash_)
+        except OSError:
+            pass  # the transpiled file is still valid, it is just validated by hash again
+        return source
+
+    def _write_source(
+        self, source: str, filename: str, transpiled_filename: str, hash_: str
+    ) -> None:
+        with open(transpiled_filename, "w", encoding="utf-8") as file:
+            file.write(f"{source}{self._get_footer(filename)}, hash {hash_}\n")
+
+    @staticmethod
+    def _get_prefix() -> str:
+        from natscript import interpret  # pylint: disable=import-outside-toplevel
+
+        lexer_name = interpret.LEXER_TYPE.__name__
+        return f"# transpiler {TRANSPILER_VERSION}, natscript {VERSION}, lexer {lexer_name}"
+
+    def _get_footer(self, filename: str) -> str:
+        stat = os.stat(filename)
+        return f"{self._get_prefix()}, mtime {stat.st_mtime_ns}, size {stat.st_size}"
+
+    def _reset(self) -> None:
+        self._indices: Dict[int, int] = {}
+        self._bindings: Dict[str, str] = {}
+        self._clause_values: Dict[str, str] = {}
+        self._functions: List[List[Line]] = []
+        self._lines: List[Line] = []
+        self._indent = 0
+        self._chain: List[int] = []
+        self._loops: List[type] = []
+        self._loop_depths: List[int] = []
+        self._function_body = False
+        self._temps = 0
+
+    def _emit(self, code: str) -> None:
+        self._lines.append((self._indent, code, tuple(reversed(self._chain))))
+
+    def _temp(self) -> str:
+        self._temps += 1
+        return f"_{self._temps}"
+
+    def _bind(self, name: str, token: Token, attribute: str = "") -> str:
+        """Binds the token or its attribute to a name in the load function"""
+        index = self._indices[id(token)]
+        name = f"_{name}{index}"
+        self._bindings.setdefault(name, f"_tokens[{index}]{attribute}")
+        return name
+
+    @contextlib.contextmanager
+    def _traced(self, token: Token, traced: bool = True) -> Iterator[None]:
+        """Adds the token to the token stack of exceptions raised in the lines emitted"""
+        if traced:
+            self._chain.append(self._indices[id(token)])
+        try:
+            yield
+        finally:
+            if traced:
+                self._chain.pop()
+
+    @contextlib.contextmanager
+    def _block(self, code: str) -> Iterator[None]:
+        self._emit(code)
+        self._indent += 1
+        length = len(self._lines)
+        try:
+            yield
+        finally:
+            if len(self._lines) == length:
+                self._emit("pass")
+            self._indent -= 1
+
+    @contextlib.contextmanager
+    def _loop(self, type_: type) -> Iterator[None]:
+        self._loops.append(type_)
+        self._loop_depths.append(len(self._chain))
+        try:
+            yield
+        finally:
+            self._loops.pop()
+            self._loop_depths.pop()
+
+    @contextlib.contextmanager
+    def _function(self, signature: str, function_body: bool = False) -> Iterator[None]:
+        """Emits a function, which adds the enclosing tokens of the line an exception
+        passed through to the token stack of the exception.
+        """
+        state = (self._lines, self._indent, self._chain, self._loops, self._temps)
+        previous_state = (self._loop_depths, self._function_body)
+        self._lines, self._indent, self._chain, self._loops, self._temps = [], 0, [], [], 0
+        self._loop_depths = []
+        self._function_body = function_body
+        try:
+            with self._block(f"def {signature}:"):
+                with self._block("try:"):
+                    yield
+                with self._block("except _RunTimeException as exc:"):
+                    self._emit("_trace(exc)")
+                    self._emit("raise")
+            self._functions.append(self._lines)
+        finally:
+            self._lines, self._indent, self._chain, self._loops, self._temps = state
+            self._loop_depths, self._function_body = previous_state
+
+    def _statement(self, token: Token, traced: bool = True) -> None:
+        """Emits the code running the token"""
+        state = (len(self._lines), self._indent)
+        transpile = self._statements.get(type(token))
+        try:
+            if transpile is not None:
+                transpile(token, traced)
+                return
+            if type(token) in self._expressions:
+                value = self._expression(token, traced)
+                self._emit(f"interpreter.stack_append({value})")
+                return
+        except closures.NotCompilable:
+            del self._lines[state[0] :]
+            self._indent = state[1]
+
+        index = self._indices[id(token)]
+        statement = f"_statement{index}" if traced else f"_untraced_statement{index}"
+        self._bindings[statement] = f"_compiler.compile_statement(_tokens[{index}], {traced})"
+        self._emit(f"{statement}(interpreter)")
+        self._handle_signal(token, traced)
+
+    def _handle_signal(self, token: Token, traced: bool) -> None:
+        """Emits the code handling a signal set by the token run before,
+        like the enclosing loop or clause would.
+        """
+        with self._block("if interpreter.signal is not None:"):
+            if not self._loops:
+                self._emit(f"interpreter.signal_stack.extend({self._unwound(token, traced)})")
+                self._emit("return")
+            elif self._loops[-1] is tokens.FOR:
+                with self._block("if interpreter.signal.__class__ is _RETURN:"):
+                    unwound = self._unwound(token, traced)
+                    self._emit(f"interpreter.signal_stack.extend({unwound})")
+                    self._emit("return")
+                with self._block("if interpreter.signal.__class__ is _BREAK:"):
+                    self._emit("interpreter.signal = None")
+                    self._emit("break")
+                self._emit("interpreter.signal = None")
+                self._emit("continue")
+            else:
+                with self._block("if interpreter.signal.__class__ is _BREAK:"):
+                    self._emit("interpreter.signal = None")
+                    self._emit("break")
+                unwound = self._unwound(token, traced, self._loop_depths[-1])
+                self._emit(f"interpreter.signal_stack.extend({unwound})")
+                self._emit("break")
+
+    def _signal(self, token: Token) -> None:
+        """Emits the code setting the token as the signal and leaving the function"""
+        self._emit(f"interpreter.signal = {self._bind('token', token)}")
+        self._emit(f"interpreter.signal_stack = list({self._unwound()})")
+        self._emit("return")
+
+    def _unwound(self, token: Optional[Token] = None, traced: bool = True, depth: int = 0) -> str:
+        """Returns a tuple of the token, if traced, and the enclosing tokens up to the chain
+        depth, which a signal set by the token is passed up through, innermost first.
+        """
+        indices = self._chain[depth:][::-1]
+        if token is not None and traced:
+            indices.insert(0, self._indices[id(token)])
+        for index in indices:
+            self._bindings.setdefault(f"_token{index}", f"_tokens[{index}]")
+        return "".join(["(", *(f"_token{index}, " for index in indices), ")"])
+
+    def _expression(self, token: Token, traced: bool = True) -> str:
+        """Emits the code running the token and returns the name of its value.
+
+        Raises NotCompilable if the token does not push exactly one value.
+        """
+        state = (len(self._lines), self._indent)
+        transpile = self._expressions.get(type(token))
+        if transpile is not None:
+            try:
+                return transpile(token, traced)
+            except closures.NotCompilable:
+                del self._lines[state[0] :]
+                self._indent = state[1]
+
+        if not isinstance(token, tokens.VALUE) or isinstance(
+            token, closures.STACK_DEPENDENT_TOKENS
+        ):
+            raise closures.NotCompilable(token)
+
+        index = self._indices[id(token)]
+        expression = f"_expression{index}" if traced else f"_untraced_expression{index}"
+        self._bindings[expression] = f"_compiler.compile_expression(_tokens[{index}], {traced})"
+        value = self._temp()
+        self._emit(f"{value} = {expression}(interpreter)")
+        return value
+
+    def _condition(self, token: Token, first: str) -> str:
+        """Emits the code comparing the first value to the value of the condition token
+        and returns the name of the result.
+
+        Raises NotCompilable for unsupported conditions.
+        """
+        if isinstance(token, tokens.NOT) and isinstance(
+            token.sorted_tokens[0], tokens.CONDITION
+        ):
+            with self._traced(token):
+                condition = self._condition(token.sorted_tokens[0], first)
+                value = self._temp()
+                self._emit(f"{value} = {condition}.unshare()")
+                self._emit(f"{value}.negate_value()")
+            return value
+
+        operator_ = COMPARISON_OPERATORS.get(type(token))
+        if operator_ is None or len(token.sorted_tokens) != 1:
+            raise closures.NotCompilable(token)
+
+        with self._traced(token):
+            second = self._expression(token.sorted_tokens[0])
+            second_value, value = self._temp(), self._temp()
+            self._emit(f"{second_value} = {second}.get_value()")
+            comparison = operator_.format(first=f"{first}.get_value()", second=second_value)
+            self._emit(f"{value} = _create_value({comparison})")
+        return value
+
+    def _body(self, clause: Token) -> None:
+        for token in clause.sorted_tokens:
+            self._statement(token)
+
+    def _transpile_set(self, token: Token, traced: bool) -> None:
+        if token.has_all_optionals:
+            raise closures.NotCompilable(token)  # qualifiers are run on the stack
+
+        value_token, variable_token = token.sorted_tokens
+        resolve = self._bind("resolve", variable_token, ".resolve")
+        assign = self._bind("assign", variable_token, ".assign")
+        with self._traced(token, traced):
+            variable = self._temp()
+            self._emit(f"{variable} = {resolve}(interpreter)")
+            if isinstance(value_token, tokens.VARNAME) and not isinstance(
+                value_token, tokens.RESULT
+            ):
+                value = self._temp()
+                self._emit(f"{value} = interpreter.get_variable({value_token.value!r})")
+                self._emit(f"{variable}.value = {value}.get_value()")
+                self._emit(f"{variable}.inputs = {value}.inputs")
+                self._emit(f"{variable}.layout = {value}.layout")
+            else:
+                value = self._expression(value_token, traced=False)
+                self._emit(f"{variable}.value = {value}.get_value()")
+            self._emit(f"{assign}(interpreter, {variable})")
+            self._emit(f"interpreter.stack_append({variable})")
+
+    def _transpile_operation(self, token: Token, traced: bool) -> None:
+        value_token, variable_token = token.sorted_tokens
+        operate = self._bind("operate", token, ".operate")
+        with self._traced(token, traced):
+            value = self._expression(value_token)
+            variable = self._expression(variable_token)
+            operator_ = INLINE_OPERATORS.get(type(token))
+            if operator_ is None:
+                self._emit(f"{operate}({variable}, {value})")
+                return
+
+            # unsupported types are reported by the token
+            with self._block("try:"):
+                self._emit(
+                    f"{variable}.value = {variable}.get_value() {operator_} {value}.get_value()"
+                )
+            with self._block("except TypeError:"):
+                self._emit(f"{operate}({variable}, {value})")
+
+    def _transpile_print(self, token: Token, traced: bool) -> None:
+        with self._traced(token, traced):
+            value = self._expression(token.sorted_tokens[0])
+            self._emit(f"print({value}.convert_to_str())")
+
+    def _transpile_append(self, token: Token, traced: bool) -> None:
+        value_token, variable_token = token.sorted_tokens
+        append = self._bind("append", token, ".append")
+        with self._traced(token, traced):
+            value = self._expression(value_token)
+            variable = self._expression(variable_token)
+            self._emit(f"{append}({variable}, {value})")
+
+    def _transpile_get(self, token: Token, traced: bool) -> None:
+        index_token, collection_token, variable_token = token.sorted_tokens
+        get = self._bind("get", token, ".get")
+        with self._traced(token, traced):
+            index = self._expression(index_token)
+            collection = self._expression(collection_token)
+            variable = self._expression(variable_token)
+            self._emit(
+                f"{get}(interpreter, {variable}, {collection}.get_value(), {index}.get_value())"
+            )
+
+    def _transpile_call(self, token: Token, traced: bool) -> None:
+        call = self._bind("call", token, ".call")
+        with self._traced(token, traced):
+            inputs = "None"
+            if token.has_all_optionals:
+                inputs = self._expression(token.sorted_tokens[0])
+            function = self._expression(token.sorted_tokens[-1])
+            self._emit(f"{call}(interpreter, {function}, {inputs})")
+        self._handle_signal(token, traced)
+
+    def _transpile_if(self, token: Token, traced: bool) -> None:
+        with self._traced(token, traced):
+            condition = self._expression(token.sorted_tokens[-2])
+            with self._block(f"if {condition}.get_value() == 1:"):
+                self._body(token.sorted_tokens[-1])
+            if token.has_all_optionals:
+                with self._block("else:"):
+                    self._body(token.sorted_tokens[0].sorted_tokens[0])
+
+    def _transpile_while(self, token: Token, traced: bool) -> None:
+        with self._traced(token, traced), self._block("while True:"):
+            condition = self._expression(token.tokens[0], traced=False)
+            with self._block(f"if not {condition}.get_value():"):
+                self._emit("break")
+            with self._loop(tokens.WHILE):
+                self._body(token.tokens[-1])
+        # a signal breaking out of the loop may need to be handled by an enclosing loop
+        self._handle_signal(token, traced)
+
+    def _transpile_for(self, token: Token, traced: bool) -> None:
+        each = token.tokens[0]
+        if len(each.tokens) != 3:
+            raise closures.NotCompilable(token)
+
+        variable_token, in_token, collection_token = each.tokens
+        iterate = self._bind("iterate", each, ".iterate")
+        bind_element = self._bind("bind", each, ".bind_element")
+        with self._traced(token, traced):
+            with self._traced(each):
+                collection = self._expression(collection_token)
+                elements, element = self._temp(), self._temp()
+                self._emit(f"{elements} = {iterate}({collection})")
+            with self._block(f"for {element} in {elements}:"):
+                with self._traced(each):
+                    variable = self._expression(variable_token)
+                    with self._traced(in_token):
+                        self._emit(f"{bind_element}(interpreter, {variable}, {element})")
+
+                if token.has_all_optionals:
+                    condition = self._condition(token.tokens[1], variable)
+                    with self._block(f"if not {condition}.get_value():"):
+                        self._emit("continue")
+                with self._loop(tokens.FOR):
+                    self._body(token.tokens[-1])
+
+    def _transpile_return(self, token: Token, traced: bool) -> None:
+        with self._traced(token, traced):
+            value = self._expression(token.sorted_tokens[0])
+            self._emit(f"interpreter.stack_append({value})")
+            if self._function_body:
+                self._emit("return")
+            else:
+                self._signal(token)
+
+    def _transpile_break(self, token: Token, traced: bool) -> None:
+        with self._traced(token, traced):
+            if self._loops:
+                self._emit("break")
+            else:
+                self._signal(token)
+
+    def _transpile_skip(self, token: Token, traced: bool) -> None:
+        with self._traced(token, traced):
+            for child in token.sorted_tokens:
+                self._statement(child)
+            if not self._loops:
+                self._signal(token)
+            elif self._loops[-1] is tokens.FOR:
+                self._emit("continue")
+            else:
+                # leaves the WHILE loop, the signal is handled after it
+                unwound = self._unwound(depth=self._loop_depths[-1])
+                self._emit(f"interpreter.signal = {self._bind('token', token)}")
+                self._emit(f"interpreter.signal_stack = list({unwound})")
+                self._emit("break")
+
+    def _transpile_round(self, token: Token, traced: bool) -> None:
+        round_value = self._bind("round", token, ".round_value")
+        with self._traced(token, traced):
+            value = self._expression(token.sorted_tokens[0])
+            self._emit(f"{round_value}({value})")
+
+    def _transpile_define(self, token: Token, traced: bool) -> None:
+        if token.has_all_optionals:
+            raise closures.NotCompilable(token)  # qualifiers are run on the stack
+
+        with self._traced(token, traced):
+            function = self._expression(token.sorted_tokens[0])
+            self._emit(f"interpreter.stack_append({function})")
+
+    def _transpile_literal(self, token: Token, _: bool) -> str:
+        return self._bind("c", token, ".token_value")
+
+    def _transpile_varname(self, token: Token, traced: bool) -> str:
+        if token.has_all_optionals:
+            raise closures.NotCompilable(token)  # default values are run on the stack
+
+        lookup = self._bind("lookup", token, ".lookup")
+        value = self._temp()
+        with self._traced(token, traced):
+            self._emit(f"{value} = {lookup}(interpreter)")
+        return value
+
+    def _transpile_result(self, token: Token, traced: bool) -> str:
+        lookup = self._bind("lookup", token, ".lookup")
+        value = self._temp()
+        with self._traced(token, traced):
+            if token.has_all_optionals:
+                self._statement(token.sorted_tokens[0])
+            self._emit(f"{value} = {lookup}(interpreter)")
+        return value
+
+    def _transpile_check(self, token: Token, traced: bool) -> str:
+        value_token, condition_token = token.sorted_tokens
+        with self._traced(token, traced):
+            value = self._expression(value_token)
+            return self._condition(condition_token, value)
+
+    def _transpile_not(self, token: Token, traced: bool) -> str:
+        with self._traced(token, traced):
+            value = self._expression(token.sorted_tokens[0])
+            negated = self._temp()
+            self._emit(f"{negated} = {value}.unshare()")
+            self._emit(f"{negated}.negate_value()")
+        return negated
+
+    def _transpile_length(self, token: Token, traced: bool) -> str:
+        get_length = self._bind("length", token, ".get_length")
+        with self._traced(token, traced):
+            value = self._expression(token.sorted_tokens[0])
+            length = self._temp()
+            self._emit(f"{length} = {get_length}({value})")
+        return length
+
+    def _transpile_collection(self, token: Token, traced: bool) -> str:
+        with self._traced(token, traced):
+            values = [self._expression(x) for x in token.sorted_tokens]
+            collection = self._temp()
+            self._emit(f"{collection} = _create_iterable_value([{', '.join(values)}])")
+        return collection
+
+    def _transpile_clause(self, token: Token, _: bool, function_body: bool = False) -> str:
+        index = self._indices[id(token)]
+        name = f"_v{index}"
+        if name not in self._clause_values:
+            with self._function(f"_clause{index}(_clause, interpreter)", function_body):
+                self._body(token)
+            self._clause_values[name] = (
+                f"_create_value(_types.MethodType(_clause{index}, _tokens[{index}]))"
+            )
+        return name
+
+    def _transpile_function(self, token: Token, traced: bool) -> str:
+        define = self._bind("define", token, ".define")
+        with self._traced(token, traced):
+            inputs = "None"
+            if token.has_all_optionals:
+                inputs = self._expression(token.sorted_tokens[0])
+            code = self._transpile_clause(token.sorted_tokens[-2], True, function_body=True)
+            function = self._expression(token.sorted_tokens[-1])
+            self._emit(f"{define}(interpreter, {function}, {code}, {inputs})")
+        return function
+
+    def _transpile_subtoken(self, token: Token, traced: bool) -> str:
+        if token.runnable or len(token.sorted_tokens) != 1:
+            raise closures.NotCompilable(token)
+        with self._traced(token, traced):
+            return self._expression(token.sorted_tokens[0])
+
+
+def _walk(syntax_blocks: List[Token]) -> Iterator[Token]:
+    """Yields all tokens in the syntax blocks in depth-first order"""
+    for token in syntax_blocks:
+        yield token
+        yield from _walk(token.tokens)
+
+
+def run_tokens(
+    syntax_blocks: List[Token],
+    interpreter: Interpreter,
+    iterations: int = 1,
+    filename: Optional[str] = None,
+) -> None:
+    """Runs all tokens in the specified syntax blocks by transpiling them to Python.
+    If a filename is specified, the transpiled source is cached next to its compiled file.
+    Note: tokens need to be grouped first by parser.
+    """
+    for syntax_block in syntax_blocks:
+        interpreter.init(syntax_block)
+
+    transpiler = PythonTranspiler()
+    source: Optional[str] = None
+    if filename is not None:
+        try:
+            source = transpiler.read_transpiled_file(filename)
+        except transpiler.exception:
+            pass
+
+    if source is None:
+        source = transpiler.transpile(syntax_blocks)
+        if filename is not None:
+            transpiler.write_transpiled_file(source, filename)
+
+    try:
+        module = transpiler.load(source, syntax_blocks)
+    except SyntaxError:
+        # e.g. too many statically nested blocks, the closures are run instead
+        compiler_ = closures.ClosureCompiler()
+        statements = [compiler_.compile_statement(x) for x in syntax_blocks]
+        for _ in range(iterations):
+            for syntax_block, statement in zip(syntax_blocks, statements):
+                statement(interpreter)
+                if interpreter.signal is not None:
+                    interpreter.signal_stack.append(syntax_block)
+                    interpreter.raise_signal()
+        return
+
+    for _ in range(iterations):
+        module(interpreter)
+        if interpreter.signal is not None:
+            interpreter.raise_signal()
@@ -0,0 +1,847 @@
+# -*- coding: utf-8 -*-
+"""
+This module contains the register virtual machine for the Natscript interpreter.
+
+The register compiler turns initialised token trees into register code: a compact
+opcode array, the operands of each opcode and a set of registers. Instead of pushing
+the values of subtokens on the interpreter stack and popping them again, instructions
+read their operands from registers and write their results to registers. Literals and
+clauses are preloaded into registers, so they cost no instructions at all.
+Only the values left on the stack by the tokens (e.g. the variable of SET) are pushed,
+so the values on the stack are the same as running the tokens.
+Tokens without a register translation are run on the stack.
+
+Runtime exceptions get the same token stack as from the closure compiler:
+each instruction has the chain of tokens enclosing it, which is added to the token stack
+once an exception escapes the dispatch loop.
+
+Public interface:
+
+    RegisterCompiler:
+        compile
+
+    RegisterCode:
+        run
+
+    disassemble
+    run_tokens
+
+"""
+import contextlib
+import operator
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from natscript.internal import exceptions
+from natscript.internal.interfaces import Interpreter
+from natscript.internal.token_ import Token
+from natscript.tokens_ import closures, tokens
+
+# pylint: disable=protected-access
+
+# opcodes and their operands (r: register, t: jump target, o: other,
+# R: registers, L: the operands of LOAD instructions with the chains of tokens enclosing them)
+LOAD = 0  # r[dst] = function(interpreter)
+ARITHMETIC = 1  # applies the operator to the variable in r[variable] and r[value]
+COMPARE = 2  # r[dst] = value of operator(r[first], r[second])
+JUMP_UNLESS_ONE = 3  # jumps to the target if the value in r[condition] is not 1
+JUMP_IF_FALSE = 4  # jumps to the target if the value in r[condition] is falsy
+JUMP = 5  # jumps to the target
+ASSIGN = 6  # assigns r[value] to the variable in r[variable] and pushes the variable
+ASSIGN_VARIABLE = 7  # assigns the named variable to the variable in r[variable], pushes it
+CALL = 8  # calls the function in r[function] with the inputs in r[inputs]
+CHECK_SIGNAL = 9  # handles a signal by jumping to the break or skip target, if any
+FOR_ITER = 10  # r[dst] = the next element, or jumps to the target
+BIND = 11  # binds the element in r[element] to the variable in r[variable]
+PUSH = 12  # pushes r[source] on the stack
+POP = 13  # r[dst] = the value popped from the stack
+OPERATE = 14  # runs the operation of a token on the variable in r[variable] and r[value]
+PRINT = 15  # prints r[source]
+APPEND = 16  # appends r[value] to the collection in r[variable]
+GET = 17  # binds the element of r[collection] at r[index] to the variable in r[variable]
+NEGATE = 18  # r[dst] = negated copy of r[source]
+LENGTH = 19  # r[dst] = length of r[source]
+COLLECTION = 20  # r[dst] = collection of the registers
+DEFINE = 21  # defines the function in r[function] with the code and inputs in registers
+ROUND = 22  # rounds r[source]
+RUN = 23  # calls the function with the interpreter, on the stack
+GET_ITER = 24  # starts iterating through the collection in r[source]
+POP_ITER = 25  # stops iterating through the current collection
+RETURN = 26  # pushes r[source] and leaves the code, setting the token as signal if any
+SIGNAL = 27  # sets the token as the interpreter signal and leaves the code
+LOADS = 28  # runs a sequence of LOAD instructions, fused by the compiler
+
+OPCODES: Dict[int, Tuple[str, str]] = {
+    LOAD: ("LOAD", "ro"),
+    ARITHMETIC: ("ARITHMETIC", "rroo"),
+    COMPARE: ("COMPARE", "rrro"),
+    JUMP_UNLESS_ONE: ("JUMP_UNLESS_ONE", "rt"),
+    JUMP_IF_FALSE: ("JUMP_IF_FALSE", "rt"),
+    JUMP: ("JUMP", "t"),
+    ASSIGN: ("ASSIGN", "rro"),
+    ASSIGN_VARIABLE: ("ASSIGN_VARIABLE", "roo"),
+    CALL: ("CALL", "rro"),
+    CHECK_SIGNAL: ("CHECK_SIGNAL", "tt"),
+    FOR_ITER: ("FOR_ITER", "rt"),
+    BIND: ("BIND", "rro"),
+    PUSH: ("PUSH", "r"),
+    POP: ("POP", "r"),
+    OPERATE: ("OPERATE", "rro"),
+    PRINT: ("PRINT", "r"),
+    APPEND: ("APPEND", "rro"),
+    GET: ("GET", "rrro"),
+    NEGATE: ("NEGATE", "rr"),
+    LENGTH: ("LENGTH", "rro"),
+    COLLECTION: ("COLLECTION", "rR"),
+    DEFINE: ("DEFINE", "rrro"),
+    ROUND: ("ROUND", "ro"),
+    RUN: ("RUN", "o"),
+    GET_ITER: ("GET_ITER", "ro"),
+    POP_ITER: ("POP_ITER", ""),
+    RETURN: ("RETURN", "ro"),
+    SIGNAL: ("SIGNAL", "o"),
+    LOADS: ("LOADS", "L"),
+}
+
+COMPARISON_TOKENS = (
+    tokens.EQUAL,
+    tokens.GREATER,
+    tokens.LESS,
+    tokens.CONTAINS,
+    tokens.IDENTICAL,
+)
+
+INLINE_OPERATORS = {
+    tokens.ADD: operator.add,
+    tokens.SUBTRACT: operator.sub,
+    tokens.MULTIPLY: operator.mul,
+}
+
+_EXHAUSTED = object()
+
+
+class RegisterCode:
+    """The opcodes and operands of a clause or module, the initial values of its registers
+    and the chains of tokens enclosing its instructions.
+    """
+
+    __slots__ = ("token", "opcodes", "operands", "registers", "chains")
+
+    def __init__(
+        self,
+        token: Optional[Token],
+        opcodes: bytes,
+        operands: List[Tuple[Any, ...]],
+        registers: List[Any],
+        chains: List[Tuple[Token, ...]],
+    ):
+        self.token = token
+        self.opcodes = opcodes
+        self.operands = operands
+        self.registers = registers
+        self.chains = chains
+
+    def __repr__(self):
+        return repr(self.token)
+
+    def run(self, interpreter: Interpreter) -> None:
+        """Runs the opcodes in a dispatch loop on a fresh set of registers,
+        until the end of the code or a signal which cannot be handled in the code.
+        """
+        # pylint: disable=too-many-branches,too-many-statements,too-many-locals
+        opcodes = self.opcodes
+        operands = self.operands
+        r = self.registers.copy()
+        stack_append = interpreter.stack_append
+        create_value = Token.TOKEN_FACTORY.create_value
+        iterators: List[Iterator[Any]] = []
+        end = len(opcodes)
+        pc = 0
+        try:
+            while pc < end:
+                opcode = opcodes[pc]
+                args = operands[pc]
+                pc += 1
+                if opcode == LOADS:
+                    for load in args:
+                        r[load[0]] = load[1](interpreter)
+                elif opcode == LOAD:
+                    r[args[0]] = args[1](interpreter)
+                elif opcode == ARITHMETIC:
+                    variable = r[args[0]]
+                    value = r[args[1]]
+                    try:
+                        variable.value = args[2](variable.get_value(), value.get_value())
+                    except TypeError:
+                        # unsupported types are reported by the token
+                        args[3](variable, value)
+                elif opcode == COMPARE:
+                    second = r[args[2]].get_value()
+                    r[args[0]] = create_value(args[3](r[args[1]].get_value(), second))
+                elif opcode == JUMP_UNLESS_ONE:
+                    if r[args[0]].get_value() != 1:
+                        pc = args[1]
+                elif opcode == JUMP_IF_FALSE:
+                    if not r[args[0]].get_value():
+                        pc = args[1]
+                elif opcode == JUMP:
+                    pc = args[0]
+                elif opcode == ASSIGN:
+                    variable = r[args[0]]
+                    variable.value = r[args[1]].get_value()
+                    args[2](interpreter, variable)
+                    stack_append(variable)
+                elif opcode == CALL:
+                    args[2](interpreter, r[args[0]], r[args[1]])
+                elif opcode == CHECK_SIGNAL:
+                    signal = interpreter.signal
+                    if signal is None:
+                        continue
+                    if signal.__class__ is tokens.BREAK and args[0] is not None:
+                        interpreter.signal = None
+                        pc = args[0]
+                    elif signal.__class__ is tokens.SKIP and args[1] is not None:
+                        interpreter.signal = None
+                        pc = args[1]
+                    else:
+                        interpreter.signal_stack.extend(self.chains[pc - 1])
+                        return
+                elif opcode == FOR_ITER:
+                    element = next(iterators[-1], _EXHAUSTED)
+                    if element is _EXHAUSTED:
+                        pc = args[1]
+                    else:
+                        r[args[0]] = element
+                elif opcode == BIND:
+                    args[2](interpreter, r[args[0]], r[args[1]])
+                elif opcode == PUSH:
+                    stack_append(r[args[0]])
+                elif opcode == POP:
+                    r[args[0]] = interpreter.stack_pop()
+                elif opcode == ASSIGN_VARIABLE:
+                    variable = r[args[0]]
+                    value = interpreter.get_variable(args[1])
+                    variable.value = value.get_value()
+                    variable.inputs = value.inputs
+                    variable.layout = value.layout
+                    args[2](interpreter, variable)
+                    stack_append(variable)
+                elif opcode == OPERATE:
+                    args[2](r[args[0]], r[args[1]])
+                elif opcode == PRINT:
+                    print(r[args[0]].convert_to_str())
+                elif opcode == APPEND:
+                    args[2](r[args[1]], r[args[0]])
+                elif opcode == GET:
+                    index = r[args[0]].get_value()
+                    args[3](interpreter, r[args[2]], r[args[1]].get_value(), index)
+                elif opcode == NEGATE:
+                    value = r[args[1]].unshare()
+                    value.negate_value()
+                    r[args[0]] = value
+                elif opcode == LENGTH:
+                    r[args[0]] = args[2](r[args[1]])
+                elif opcode == COLLECTION:
+                    r[args[0]] = Token.TOKEN_FACTORY.create_iterable_value(
+                        [r[x] for x in args[1]]
+                    )
+                elif opcode == DEFINE:
+                    args[3](interpreter, r[args[0]], r[args[1]], r[args[2]])
+                elif opcode == ROUND:
+                    args[1](r[args[0]])
+                elif opcode == RUN:
+                    args[0](interpreter)
+                elif opcode == GET_ITER:
+                    iterators.append(args[1](r[args[0]]))
+                elif opcode == POP_ITER:
+                    iterators.pop()
+                elif opcode == RETURN:
+                    stack_append(r[args[0]])
+                    if args[1] is not None:
+                        interpreter.signal = args[1]
+                        interpreter.signal_stack = list(self.chains[pc - 1])
+                    return
+                elif opcode == SIGNAL:
+                    interpreter.signal = args[0]
+                    interpreter.signal_stack = list(self.chains[pc - 1])
+                    return
+        except exceptions.RunTimeException as exc:
+            chain = self.chains[pc - 1]
+            if opcodes[pc - 1] == LOADS:
+                chain = load[2]  # pylint: disable=undefined-loop-variable
+            exc.token_stack.extend(chain)
+            raise
+
+
+class _Loop:
+    """Jump targets of a loop being compiled"""
+
+    __slots__ = ("type_", "start", "breaks")
+
+    def __init__(self, type_: type, start: int):
+        self.type_ = type_
+        self.start = start
+        self.breaks: List[int] = []  # jumps to be patched to the end of the loop
+
+
+class RegisterCompiler:
+    """Compiles initialised tokens to RegisterCode objects.
+
+    Statements run a token, leaving the same values on the interpreter stack
+    as Token.run. Expressions write the value a token would push on the stack
+    to a register and return the register. Conditions compare the value in a register
+    to the value of their subtoken, like CONDITION tokens do for the value pushed
+    on the stack before them.
+    """
+
+    def __init__(self):
+        self._statements = {
+            tokens.SET: self._compile_set,
+            tokens.ADD: self._compile_operation,
+            tokens.SUBTRACT: self._compile_operation,
+            tokens.MULTIPLY: self._compile_operation,
+            tokens.DIVIDE: self._compile_operation,
+            tokens.PRINT: self._compile_print,
+            tokens.APPEND: self._compile_append,
+            tokens.GET: self._compile_get,
+            tokens.CALL: self._compile_call,
+            tokens.IF: self._compile_if,
+            tokens.WHILE: self._compile_while,
+            tokens.FOR: self._compile_for,
+            tokens.RETURN: self._compile_return,
+            tokens.BREAK: self._compile_break,
+            tokens.SKIP: self._compile_skip,
+            tokens.ROUND: self._compile_round,
+            tokens.DEFINE: self._compile_define,
+        }
+        self._expressions = {
+            tokens.VARNAME: self._compile_varname,
+            tokens.IT: self._compile_varname,
+            tokens.RESULT: self._compile_result,
+            tokens.CHECK: self._compile_check,
+            tokens.NOT: self._compile_not,
+            tokens.LENGTH: self._compile_length,
+            tokens.COLLECTION: self._compile_collection,
+            tokens.CLAUSE: self._compile_clause,
+            tokens.FUNCTION: self._compile_function,
+            tokens.AT: self._compile_subtoken,
+            tokens.WITH: self._compile_subtoken,
+            tokens.EXPECTING: self._compile_subtoken,
+        }
+        self._expressions.update({x: self._compile_literal for x in closures.LITERAL_TOKENS})
+        self._clauses: Dict[int, int] = {}
+        self._opcodes: List[int] = []
+        self._operands: List[Tuple[Any, ...]] = []
+        self._registers: List[Any] = []
+        self._chains: List[Tuple[Token, ...]] = []
+        self._chain: List[Token] = []
+        self._loops: List[_Loop] = []
+        self._function_body = False
+
+    def compile(self, syntax_blocks: List[Token]) -> RegisterCode:
+        """Returns the register code running the syntax blocks of a module"""
+        with self._code():
+            for syntax_block in syntax_blocks:
+                self._statement(syntax_block)
+            return self._create_code(None)
+
+    @contextlib.contextmanager
+    def _code(self, function_body: bool = False) -> Iterator[None]:
+        state = (
+            self._opcodes,
+            self._operands,
+            self._registers,
+            self._chains,
+            self._chain,
+            self._loops,
+            self._clauses,
+            self._function_body,
+        )
+        self._opcodes, self._operands, self._registers, self._chains = [], [], [None], []
+        self._chain, self._loops, self._clauses = [], [], {}
+        self._function_body = function_body
+        try:
+            yield
+        finally:
+            (
+                self._opcodes,
+                self._operands,
+                self._registers,
+                self._chains,
+                self._chain,
+                self._loops,
+                self._clauses,
+                self._function_body,
+            ) = state
+
+    def _create_code(self, token: Optional[Token]) -> RegisterCode:
+        self._fuse_loads()
+        return RegisterCode(
+            token, bytes(self._opcodes), self._operands, self._registers, self._chains
+        )
+
+    def _fuse_loads(self) -> None:
+        """Fuses runs of LOAD instructions not jumped into to LOADS instructions,
+        so e.g. the variables used by a token are looked up in a single dispatch.
+        """
+        targets = {
+            operand
+            for opcode, operands in zip(self._opcodes, self._operands)
+            for kind, operand in zip(OPCODES[opcode][1], operands)
+            if kind == "t" and operand is not None
+        }
+        opcodes: List[int] = []
+        operands_: List[Tuple[Any, ...]] = []
+        chains: List[Tuple[Token, ...]] = []
+        indices: List[int] = []  # new index of each instruction
+        for index, (opcode, operands, chain) in enumerate(
+            zip(self._opcodes, self._operands, self._chains)
+        ):
+            indices.append(len(opcodes))
+            if opcode == LOAD and opcodes and opcodes[-1] in (LOAD, LOADS) and index not in targets:
+                if opcodes[-1] == LOAD:
+                    opcodes[-1] = LOADS
+                    operands_[-1] = (operands_[-1] + (chains[-1],),)
+                    chains[-1] = ()
+                operands_[-1] += (operands + (chain,),)
+                continue
+            opcodes.append(opcode)
+            operands_.append(operands)
+            chains.append(chain)
+        indices.append(len(opcodes))
+
+        for index, (opcode, operands) in enumerate(zip(opcodes, operands_)):
+            kinds = OPCODES[opcode][1]
+            if "t" in kinds:
+                operands_[index] = tuple(
+                    indices[x] if kind == "t" and x is not None else x
+                    for kind, x in zip(kinds, operands)
+                )
+        self._opcodes, self._operands, self._chains = opcodes, operands_, chains
+
+    @contextlib.contextmanager
+    def _traced(self, token: Token, traced: bool = True) -> Iterator[None]:
+        """Adds the token to the token stack of exceptions raised in the instructions"""
+        if traced:
+            self._chain.append(token)
+        try:
+            yield
+        finally:
+            if traced:
+                self._chain.pop()
+
+    def _emit(self, opcode: int, *operands: Any) -> int:
+        """Appends the instruction and returns its index"""
+        self._opcodes.append(opcode)
+        self._operands.append(operands)
+        self._chains.append(tuple(reversed(self._chain)))
+        return len(self._opcodes) - 1
+
+    def _patch(self, index: int, *operands: Any) -> None:
+        self._operands[index] = operands
+
+    def _register(self, value: Any = None) -> int:
+        """Returns a new register, initially holding the value"""
+        self._registers.append(value)
+        return len(self._registers) - 1
+
+    def _rollback(self, length: int) -> None:
+        """Removes the instructions emitted after the specified length"""
+        del self._opcodes[length:]
+        del self._operands[length:]
+        del self._chains[length:]
+        for loop in self._loops:
+            loop.breaks = [x for x in loop.breaks if x < length]
+
+    def _emit_check_signal(self) -> None:
+        """Emits the handling of signals left by the instructions before,
+        jumping to the enclosing loops of the code like their tokens would.
+        """
+        break_target: Optional[int] = None
+        skip_target: Optional[int] = None
+        if self._loops:
+            break_target = -1  # patched once the end of the loop is known
+        for loop in reversed(self._loops):
+            if loop.type_ is tokens.FOR:
+                skip_target = loop.start
+                break
+        index = self._emit(CHECK_SIGNAL, break_target, skip_target)
+        if self._loops:
+            self._loops[-1].breaks.append(index)
+
+    def _statement(self, token: Token, traced: bool = True) -> None:
+        """Emits the instructions running the token"""
+        length = len(self._opcodes)
+        compile_ = self._statements.get(type(token))
+        try:
+            if compile_ is not None:
+                compile_(token, traced)
+                return
+            if type(token) in self._expressions:
+                self._emit(PUSH, self._expression(token, traced))
+                return
+        except closures.NotCompilable:
+            self._rollback(length)
+
+        self._run_on_stack(token, traced)
+        with self._traced(token, traced):
+            self._emit_check_signal()
+
+    def _run_on_stack(self, token: Token, traced: bool) -> None:
+        """Emits the instructions running the token as a token. Tokens using the default
+        Token.run method have their subtokens compiled to statements.
+        """
+        with self._traced(token, traced):
+            if token.run.__code__ is not Token.run.__code__:
+                self._emit(RUN, token.run)
+                return
+
+            for child in token.sorted_tokens:
+                self._statement(child)
+            if token.runnable:
+                self._emit(RUN, token._run)
+
+    def _expression(self, token: Token, traced: bool = True) -> int:
+        """Emits the instructions writing the value of the token to a register
+        and returns the register.
+
+        Raises NotCompilable if the token does not push exactly one value.
+        """
+        length = len(self._opcodes)
+        compile_ = self._expressions.get(type(token))
+        if compile_ is not None:
+            try:
+                return compile_(token, traced)
+            except closures.NotCompilable:
+                self._rollback(length)
+
+        if not isinstance(token, tokens.VALUE) or isinstance(
+            token, closures.STACK_DEPENDENT_TOKENS
+        ):
+            raise closures.NotCompilable(token)
+
+        self._run_on_stack(token, traced)
+        value = self._register()
+        self._emit(POP, value)
+        return value
+
+    def _condition(self, token: Token, first: int) -> int:
+        """Emits the instructions comparing the value in the first register to the value
+        of the condition token and returns the register of the result.
+
+        Raises NotCompilable for unsupported conditions.
+        """
+        if isinstance(token, tokens.NOT) and isinstance(token.sorted_tokens[0], tokens.CONDITION):
+            with self._traced(token):
+                condition = self._condition(token.sorted_tokens[0], first)
+                value = self._register()
+                self._emit(NEGATE, value, condition)
+            return value
+
+        if type(token) not in COMPARISON_TOKENS or len(token.sorted_tokens) != 1:
+            raise closures.NotCompilable(token)
+
+        with self._traced(token):
+            second = self._expression(token.sorted_tokens[0])
+            value = self._register()
+            self._emit(COMPARE, value, first, second, token.OPERATOR)
+        return value
+
+    def _body(self, clause: Token) -> None:
+        for token in clause.sorted_tokens:
+            self._statement(token)
+
+    def _compile_set(self, token: Token, traced: bool) -> None:
+        if token.has_all_optionals:
+            raise closures.NotCompilable(token)  # qualifiers are run on the stack
+
+        value_token, variable_token = token.sorted_tokens
+        with self._traced(token, traced):
+            variable = self._register()
+            self._emit(LOAD, variable, variable_token.resolve)
+            if isinstance(value_token, tokens.VARNAME) and not isinstance(
+                value_token, tokens.RESULT
+            ):
+                self._emit(ASSIGN_VARIABLE, variable, value_token.value, variable_token.assign)
+            else:
+                value = self._expression(value_token, traced=False)
+                self._emit(ASSIGN, variable, value, variable_token.assign)
+
+    def _compile_operation(self, token: Token, traced: bool) -> None:
+        value_token, variable_token = token.sorted_tokens
+        with self._traced(token, traced):
+            value = self._expression(value_token)
+            variable = self._expression(variable_token)
+            operator_ = INLINE_OPERATORS.get(type(token))
+            if operator_ is None:
+                self._emit(OPERATE, variable, value, token.operate)
+            else:
+                self._emit(ARITHMETIC, variable, value, operator_, token.operate)
+
+    def _compile_print(self, token: Token, traced: bool) -> None:
+        with self._traced(token, traced):
+            self._emit(PRINT, self._expression(token.sorted_tokens[0]))
+
+    def _compile_append(self, token: Token, traced: bool) -> None:
+        value_token, variable_token = token.sorted_tokens
+        with self._traced(token, traced):
+            value = self._expression(value_token)
+            variable = self._expression(variable_token)
+            self._emit(APPEND, value, variable, token.append)
+
+    def _compile_get(self, token: Token, traced: bool) -> None:
+        index_token, collection_token, variable_token = token.sorted_tokens
+        with self._traced(token, traced):
+            index = self._expression(index_token)
+            collection = self._expression(collection_token)
+            variable = self._expression(variable_token)
+            self._emit(GET, index, collection, variable, token.get)
+
+    def _compile_call(self, token: Token, traced: bool) -> None:
+        with self._traced(token, traced):
+            inputs = 0  # the register of nothing
+            if token.has_all_optionals:
+                inputs = self._expression(token.sorted_tokens[0])
+            function = self._expression(token.sorted_tokens[-1])
+            self._emit(CALL, function, inputs, token.call)
+            self._emit_check_signal()
+
+    def _compile_if(self, token: Token, traced: bool) -> None:
+        with self._traced(token, traced):
+            condition = self._expression(token.sorted_tokens[-2])
+            jump_else = self._emit(JUMP_UNLESS_ONE, condition, None)
+            self._body(token.sorted_tokens[-1])
+            if not token.has_all_optionals:
+                self._patch(jump_else, condition, len(self._opcodes))
+                return
+
+            jump_end = self._emit(JUMP, None)
+            self._patch(jump_else, condition, len(self._opcodes))
+            self._body(token.sorted_tokens[0].sorted_tokens[0])
+            self._patch(jump_end, len(self._opcodes))
+
+    def _compile_while(self, token: Token, traced: bool) -> None:
+        with self._traced(token, traced):
+            loop = _Loop(tokens.WHILE, len(self._opcodes))
+            condition = self._expression(token.tokens[0], traced=False)
+            loop.breaks.append(self._emit(JUMP_IF_FALSE, condition, None))
+            self._loops.append(loop)
+            self._body(token.tokens[-1])
+            self._loops.pop()
+            self._emit(JUMP, loop.start)
+            self._patch_breaks(loop, len(self._opcodes))
+
+    def _compile_for(self, token: Token, traced: bool) -> None:
+        each = token.tokens[0]
+        if len(each.tokens) != 3:
+            raise closures.NotCompilable(token)
+
+        variable_token, in_token, collection_token = each.tokens
+        with self._traced(token, traced):
+            with self._traced(each):
+                collection = self._expression(collection_token)
+                self._emit(GET_ITER, collection, each.iterate)
+                loop = _Loop(tokens.FOR, len(self._opcodes))
+                element = self._register()
+                for_iter = self._emit(FOR_ITER, element, None)
+                variable = self._expression(variable_token)
+                with self._traced(in_token):
+                    self._emit(BIND, variable, element, each.bind_element)
+
+            if token.has_all_optionals:
+                # the condition compares the element bound to the variable
+                condition = self._condition(token.tokens[1], variable)
+                self._emit(JUMP_IF_FALSE, condition, loop.start)
+            self._loops.append(loop)
+            self._body(token.tokens[-1])
+            self._loops.pop()
+            self._emit(JUMP, loop.start)
+            end = self._emit(POP_ITER)
+            self._patch(for_iter, element, end)
+            self._patch_breaks(loop, end)
+
+    def _patch_breaks(self, loop: _Loop, end: int) -> None:
+        for index in loop.breaks:
+            opcode = self._opcodes[index]
+            if opcode == CHECK_SIGNAL:
+                self._patch(index, end, self._operands[index][1])
+            elif opcode == JUMP_IF_FALSE:
+                self._patch(index, self._operands[index][0], end)
+            else:
+                self._patch(index, end)
+
+    def _compile_return(self, token: Token, traced: bool) -> None:
+        with self._traced(token, traced):
+            value = self._expression(token.sorted_tokens[0])
+            # the function body is left directly, without setting the signal
+            self._emit(RETURN, value, None if self._function_body else token)
+
+    def _compile_break(self, token: Token, traced: bool) -> None:
+        with self._traced(token, traced):
+            if self._loops:
+                self._loops[-1].breaks.append(self._emit(JUMP, None))
+            else:
+                self._emit(SIGNAL, token)
+
+    def _compile_skip(self, token: Token, traced: bool) -> None:
+        loop = next((x for x in reversed(self._loops) if x.type_ is tokens.FOR), None)
+        with self._traced(token, traced):
+            for child in token.sorted_tokens:
+                self._statement(child)
+            if loop is None:
+                self._emit(SIGNAL, token)
+            else:
+                self._emit(JUMP, loop.start)
+
+    def _compile_round(self, token: Token, traced: bool) -> None:
+        with self._traced(token, traced):
+            self._emit(ROUND, self._expression(token.sorted_tokens[0]), token.round_value)
+
+    def _compile_define(self, token: Token, traced: bool) -> None:
+        if token.has_all_optionals:
+            raise closures.NotCompilable(token)  # qualifiers are run on the stack
+
+        with self._traced(token, traced):
+            self._emit(PUSH, self._expression(token.sorted_tokens[0]))
+
+    def _compile_literal(self, token: Token, _: bool) -> int:
+        return self._register(token.token_value)
+
+    def _compile_varname(self, token: Token, traced: bool) -> int:
+        if token.has_all_optionals:
+            raise closures.NotCompilable(token)  # default values are run on the stack
+
+        value = self._register()
+        with self._traced(token, traced):
+            self._emit(LOAD, value, token.lookup)
+        return value
+
+    def _compile_result(self, token: Token, traced: bool) -> int:
+        value = self._register()
+        with self._traced(token, traced):
+            if token.has_all_optionals:
+                self._statement(token.sorted_tokens[0])
+            self._emit(LOAD, value, token.lookup)
+        return value
+
+    def _compile_check(self, token: Token, traced: bool) -> int:
+        value_token, condition_token = token.sorted_tokens
+        with self._traced(token, traced):
+            value = self._expression(value_token)
+            return self._condition(condition_token, value)
+
+    def _compile_not(self, token: Token, traced: bool) -> int:
+        with self._traced(token, traced):
+            value = self._expression(token.sorted_tokens[0])
+            negated = self._register()
+            self._emit(NEGATE, negated, value)
+        return negated
+
+    def _compile_length(self, token: Token, traced: bool) -> int:
+        with self._traced(token, traced):
+            value = self._expression(token.sorted_tokens[0])
+            length = self._register()
+            self._emit(LENGTH, length, value, token.get_length)
+        return length
+
+    def _compile_collection(self, token: Token, traced: bool) -> int:
+        with self._traced(token, traced):
+            values = tuple(self._expression(x) for x in token.sorted_tokens)
+            collection = self._register()
+            self._emit(COLLECTION, collection, values)
+        return collection
+
+    def _compile_clause(self, token: Token, _: bool, function_body: bool = False) -> int:
+        register = self._clauses.get(id(token))
+        if register is None:
+            with self._code(function_body):
+                self._body(token)
+                code = self._create_code(token)
+            value = token.TOKEN_FACTORY.create_value(code.run)
+            register = self._clauses[id(token)] = self._register(value)
+        return register
+
+    def _compile_function(self, token: Token, traced: bool) -> int:
+        with self._traced(token, traced):
+            inputs = 0  # the register of nothing
+            if token.has_all_optionals:
+                inputs = self._expression(token.sorted_tokens[0])
+            code = self._compile_clause(token.sorted_tokens[-2], True, function_body=True)
+            function = self._expression(token.sorted_tokens[-1])
+            self._emit(DEFINE, function, code, inputs, token.define)
+        return function
+
+    def _compile_subtoken(self, token: Token, traced: bool) -> int:
+        if token.runnable or len(token.sorted_tokens) != 1:
+            raise closures.NotCompilable(token)
+        with self._traced(token, traced):
+            return self._expression(token.sorted_tokens[0])
+
+
+def disassemble(code: RegisterCode) -> str:
+    """Returns a listing of the instructions of the code, followed by the listings
+    of the clauses it loads.
+    """
+    name = "module" if code.token is None else repr(code)
+    lines = [f"{name}: {len(code.opcodes)} instructions, {len(code.registers)} registers"]
+    nested: List[RegisterCode] = []
+    for register, value in enumerate(code.registers):
+        if value is None:
+            continue
+        clause_code = getattr(value.value, "__self__", None)
+        if isinstance(clause_code, RegisterCode):
+            nested.append(clause_code)
+            lines.append(f"    r{register} = {clause_code!r}")
+        else:
+            lines.append(f"    r{register} = {value!r}")
+
+    for index, (opcode, operands) in enumerate(zip(code.opcodes, code.operands)):
+        name, kinds = OPCODES[opcode]
+        if kinds == "L":
+            formatted = _format_operand(kinds, operands)
+        else:
+            formatted = ", ".join(_format_operand(x, y) for x, y in zip(kinds, operands))
+        lines.append(f"{index:>6} {name:<16} {formatted}".rstrip())
+
+    for clause_code in nested:
+        lines.extend(["", disassemble(clause_code)])
+    return "\n".join(lines)
+
+
+def _format_operand(kind: str, operand: Any) -> str:
+    if operand is None:
+        return "-"
+    if kind == "r":
+        return f"r{operand}"
+    if kind == "t":
+        return f"-> {operand}"
+    if kind == "R":
+        return "(" + ", ".join(f"r{x}" for x in operand) + ")"
+    if kind == "L":
+        return ", ".join(f"r{x} = {_format_operand('o', y)}" for x, y, _ in operand)
+    if isinstance(operand, Token):
+        return operand.__class__.__name__
+    owner = getattr(operand, "__self__", None)
+    if isinstance(owner, Token):
+        return f"{owner.__class__.__name__}.{operand.__name__}"
+    return getattr(operand, "__name__", repr(operand))
+
+
+def run_tokens(
+    syntax_blocks: List[Token],
+    interpreter: Interpreter,
+    iterations: int = 1,
+    debug: bool = False,
+) -> None:
+    """Runs all tokens in the specified syntax blocks by compiling them to register code.
+    In debug mode, the disassembled register code is printed before running it.
+    Note: tokens need to be grouped first by parser.
+    """
+    for syntax_block in syntax_blocks:
+        interpreter.init(syntax_block)
+
+    code = RegisterCompiler().compile(syntax_blocks)
+    if debug:
+        print(disassemble(code))
+    for _ in range(iterations):
+        code.run(interpreter)
+        interpreter.raise_signal()
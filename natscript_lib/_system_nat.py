@@ -69,6 +69,12 @@ def get_env(variable):
     return _os.getenv(variable)
 
 
+def read_lines(path):
+    with open(path, "r", encoding="utf-8") as file:
+        for line in file:
+            yield line.rstrip("\n")
+
+
 args = _sys.argv
 path = _sys.path
 
@@ -87,6 +93,7 @@ __all__ = [
     "move_folder",
     "system_call",
     "get_env",
+    "read_lines",
     "args",
     "path",
 ]
@@ -8,26 +8,34 @@ Created on Tue Dec 14 21:40:44 2021
 import glob
 import os
 
+import pytest
+
 from natscript import interpret
 from natscript.tokens_ import compiler
 
 
-def test_examples():
-    _delete_compiled_files()
-    _run_test_()  # without compiled files
-    _run_test_()  # with compiled files
+@pytest.mark.parametrize("compiler_type", compiler.COMPILERS.values())
+def test_examples(compiler_type):
+    compiler_ = compiler_type()
+    _delete_compiled_files(compiler_)
+    try:
+        _run_test_(compiler_)  # without compiled files
+        _run_test_(compiler_)  # with compiled files
+    finally:
+        _delete_compiled_files(compiler_)
 
 
-def _delete_compiled_files():
-    compiled_filepaths = glob.glob("../doc/examples/**/*.natc", recursive=True)
-    for filepath in compiled_filepaths:
-        os.unlink(filepath)
+def _delete_compiled_files(compiler_):
+    filepaths = glob.glob("../doc/examples/**/*.nat", recursive=True)
+    for filepath in filepaths:
+        compiled_filepath = compiler_.get_compiled_filename(filepath)
+        if os.path.isfile(compiled_filepath):
+            os.unlink(compiled_filepath)
 
 
-def _run_test_():
+def _run_test_(compiler_):
     filepaths = glob.glob("../doc/examples/**/*.nat", recursive=True)
     original_dir = os.getcwd()
-    compiler_ = compiler.PickleCompiler()
     for filepath in filepaths:
         print(f"Running {filepath}...")
 
@@ -39,8 +47,8 @@ def _run_test_():
                 tokens = compiler_.read_compiled_file(filename)
             except compiler.CompilerError:
                 tokens = interpret.construct_tokens(filename)
+                compiler_.write_compiled_file(tokens, filename)
 
-            compiler_.write_compiled_file(tokens, filename)
             interpret.interpret(tokens)
             passed = True
         except Exception as exc:
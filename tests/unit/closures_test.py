@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for the closure compiler"""
+
+import itertools
+
+import pytest
+
+from natscript import interpret
+from natscript.internal import exceptions, interpreter, tokenvalue
+from natscript.tokens_ import closures
+
+CODE = """
+define function square expecting [n] as {
+    if checked n less than 2 then { return n }
+    multiply n by n return n
+}
+set numbers to []
+for each i in range from 0 to 6 { call square with [i] and append result to numbers }
+get x from numbers at 3
+set total to 0
+while checked total less than 20 { add x to total }
+print [numbers, total, not checked total equal to 27, length of numbers]
+"""
+
+
+def _run(backend, code):
+    syntax_blocks = interpret.construct_tokens_from_string(code)
+    backend(syntax_blocks, interpreter.Interpreter())
+
+
+def test_closure_backend_matches_tree_backend(capsys):
+    _run(interpret.run_tokens, CODE)
+    expected = capsys.readouterr().out
+    _run(closures.run_tokens, CODE)
+    assert capsys.readouterr().out == expected
+    assert expected == "[[0, 1, 4, 9, 16, 25], 27, false, 6]\n"
+
+
+@pytest.mark.parametrize("backend", interpret.BACKENDS.values())
+def test_backends_trace_runtime_exceptions(backend):
+    code = 'define function f as {\nset s to "a" and add 1 to s\n}\ncall f'
+    with pytest.raises(exceptions.TypeException) as exc:
+        _run(backend, code)
+    trace = [type(x).__name__ for x in exc.value.token_stack]
+    assert trace == ["ADD", "ADD", "CALL"]
+
+
+CONTROL_FLOW_CODE = """
+define function find expecting [numbers] as {
+    for each n in numbers {
+        set i to 0
+        while true {
+            add 1 to i
+            if checked i greater than 2 then { break out }
+            if checked n equal to 2 then { skip it }
+        }
+        if checked n greater than 3 then { return n }
+    }
+    return 0
+}
+call find with [[1 2 3 4 5]]
+print result
+"""
+
+
+@pytest.mark.parametrize("backend", interpret.BACKENDS.values())
+def test_backends_handle_control_flow_signals(backend, capsys):
+    interpreter_ = interpreter.Interpreter()
+    backend(interpret.construct_tokens_from_string(CONTROL_FLOW_CODE), interpreter_)
+    assert capsys.readouterr().out == "4\n"
+    assert interpreter_.signal is None
+
+
+@pytest.mark.parametrize("backend", interpret.BACKENDS.values())
+def test_backends_raise_unhandled_signals(backend):
+    interpreter_ = interpreter.Interpreter()
+    with pytest.raises(exceptions.BreakIterationException):
+        backend(interpret.construct_tokens_from_string("break out"), interpreter_)
+    assert interpreter_.signal is None
+
+
+UNHANDLED_SIGNAL_CODE = """
+define function loop as {
+    set x to 0
+    while checked x less than 3 {
+        add 1 to x
+        if checked x equal to 2 then { call stray }
+    }
+}
+define function stray as {
+    for each n in [1 2] { if checked n equal to 1 then { skip it } }
+    skip it
+}
+call loop
+"""
+
+
+@pytest.mark.parametrize("backend", interpret.BACKENDS.values())
+def test_backends_trace_unhandled_signals_like_tree_backend(backend):
+    traces = []
+    for backend_ in (interpret.run_tokens, backend):
+        with pytest.raises(exceptions.SkipElementException) as exc:
+            _run(backend_, UNHANDLED_SIGNAL_CODE)
+        traces.append([(type(x).__name__, x.line) for x in exc.value.token_stack])
+    assert traces[1] == traces[0]
+    assert [name for name, _ in traces[0]] == ["SKIP", "CALL", "IF", "WHILE", "CALL"]
+
+
+RECURSION_CODE = """
+define function count_down expecting [n] as {
+    if checked n greater than 0 then {
+        set m to n and subtract 1 from m
+        call count_down with [m]
+    }
+    print n
+}
+call count_down with [2]
+"""
+
+
+@pytest.mark.parametrize("backend", interpret.BACKENDS.values())
+def test_backends_bind_arguments_per_call(backend, capsys):
+    backend(interpret.construct_tokens_from_string(RECURSION_CODE), interpreter.Interpreter())
+    assert capsys.readouterr().out == "0\n1\n2\n"
+
+
+REENTRANT_LOOP_CODE = """
+define function walk expecting [depth] as {
+    for each n in [1 2] {
+        if checked depth less than 1 then { call walk with [1] }
+        print n
+    }
+}
+call walk with [0]
+"""
+
+
+@pytest.mark.parametrize("backend", interpret.BACKENDS.values())
+def test_backends_keep_loop_state_per_run(backend, capsys):
+    backend(interpret.construct_tokens_from_string(REENTRANT_LOOP_CODE), interpreter.Interpreter())
+    assert capsys.readouterr().out == "1\n2\n1\n1\n2\n2\n"
+
+
+STREAM_CODE = """
+define function square expecting [n] as { multiply n by n return n }
+apply square to numbers
+exclude x greater than 10 from numbers
+for each n in slice of numbers from 1 to 3 { print n }
+"""
+
+
+@pytest.mark.parametrize("backend", interpret.BACKENDS.values())
+def test_backends_chain_streams_lazily(backend, capsys):
+    interpreter_ = interpreter.Interpreter()
+    numbers = tokenvalue.Variable("numbers")
+    numbers.value = tokenvalue.Stream(itertools.count())  # never ends, so must stay lazy
+    interpreter_.set_variable("numbers", numbers)
+    backend(interpret.construct_tokens_from_string(STREAM_CODE), interpreter_)
+    assert capsys.readouterr().out == "1\n4\n"
+
+
+EXCLUDE_CODE = """
+set numbers to [5 1 7 3 9 2] and set alias to numbers and set limit to 4
+exclude large greater than limit from numbers
+exclude small not equal to 2 from numbers
+print [alias, large, small]
+"""
+
+
+@pytest.mark.parametrize("backend", interpret.BACKENDS.values())
+def test_backends_exclude_values_in_place(backend, capsys):
+    _run(backend, EXCLUDE_CODE)
+    assert capsys.readouterr().out == "[[2], [5, 7, 9], [1, 3]]\n"
+
+
+COLLECTION_LOGIC_CODE = """
+set numbers to [1 5 2 8] and set limit to 4
+print [all numbers greater than 0, any numbers greater than 7, some numbers greater than 7]
+print [none numbers equal to 3, some numbers greater than limit, all numbers less than limit]
+print [all [1 1], some [0 1 0], none [0 0]]
+"""
+
+
+@pytest.mark.parametrize("backend", interpret.BACKENDS.values())
+def test_backends_evaluate_collection_logic(backend, capsys):
+    _run(backend, COLLECTION_LOGIC_CODE)
+    output = "[true, true, false]\n[true, true, false]\n[true, false, true]\n"
+    assert capsys.readouterr().out == output
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for the bytecode compiler"""
+
+import gc
+import os
+import pickle
+
+import pytest
+
+from natscript import interpret
+from natscript.internal import interpreter, modules
+from natscript.internal.token_ import Token
+from natscript.tokens_ import compiler
+
+
+def test_library_bundle_is_reused_until_library_changes(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    (tmp_path / "lib.nat").write_text("set answer to 42\n", encoding="utf-8")
+    (tmp_path / "_lib_nat.py").write_text("import os\nX = 1\n_Y = 2\n", encoding="utf-8")
+
+    bundle = compiler.LibraryBundle(str(tmp_path))
+    assert [type(x).__name__ for x in bundle.get_tokens(str(tmp_path / "lib.nat"))] == ["SET"]
+    assert bundle.get_exports(str(tmp_path / "_lib_nat.py")) == ["os", "X"]
+    assert bundle.get_tokens(str(tmp_path / "cache" / "lib.nat")) is None
+    assert os.path.isfile(tmp_path / compiler.LibraryBundle.FILENAME)
+
+    def fail():
+        raise AssertionError("bundle should not be rewritten")
+
+    bundle = compiler.LibraryBundle(str(tmp_path))
+    monkeypatch.setattr(bundle, "write", fail)
+    assert bundle.get_exports(str(tmp_path / "_lib_nat.py")) == ["os", "X"]
+
+    (tmp_path / "lib.nat").write_text("set answer to 42\nprint answer\n", encoding="utf-8")
+    bundle = compiler.LibraryBundle(str(tmp_path))
+    assert len(bundle.get_tokens(str(tmp_path / "lib.nat"))) == 2
+
+
+def test_compiled_file_is_cached_if_source_directory_is_read_only(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    monkeypatch.setattr(os, "access", lambda *_: False)
+    filename = str(tmp_path / "main.nat")
+    with open(filename, "w", encoding="utf-8") as file:
+        file.write("set answer to 42\n")
+
+    compiler_ = compiler.PickleCompiler()
+    compiler_.write_compiled_file(interpret.construct_tokens(filename), filename)
+    assert not os.path.isfile(compiler_.get_compiled_filename(filename))
+    assert os.path.isfile(compiler.get_cached_filename(compiler_.get_compiled_filename(filename)))
+    assert len(compiler_.read_compiled_file(filename)) == 1
+
+
+def test_cached_compiled_file_is_read_if_compiled_file_is_stale(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    filename = str(tmp_path / "main.nat")
+    with open(filename, "w", encoding="utf-8") as file:
+        file.write("set answer to 42\n")
+    compiler_ = compiler.PickleCompiler()
+    compiler_.write_compiled_file(interpret.construct_tokens(filename), filename)
+
+    monkeypatch.setattr(os, "access", lambda *_: False)
+    with open(filename, "w", encoding="utf-8") as file:
+        file.write("set answer to 42\nprint answer\n")
+    with pytest.raises(compiler.CompilerError):
+        compiler_.read_compiled_file(filename)
+    compiler_.write_compiled_file(interpret.construct_tokens(filename), filename)
+    assert len(compiler_.read_compiled_file(filename)) == 2
+
+
+def test_compiled_file_is_only_hashed_if_source_stat_changes(tmp_path, monkeypatch):
+    filename = str(tmp_path / "main.nat")
+    with open(filename, "w", encoding="utf-8") as file:
+        file.write("set answer to 42\n")
+    compiler_ = compiler.PickleCompiler()
+    compiler_.write_compiled_file(interpret.construct_tokens(filename), filename)
+
+    hashed = []
+    hash_file = compiler.hash_file
+    monkeypatch.setattr(compiler, "hash_file", lambda x: hashed.append(x) or hash_file(x))
+    assert len(compiler_.read_compiled_file(filename)) == 1
+    assert not hashed
+
+    stat = os.stat(filename)
+    os.utime(filename, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert len(compiler_.read_compiled_file(filename)) == 1
+    assert len(compiler_.read_compiled_file(filename)) == 1
+    assert hashed == [filename]
+
+
+def test_binary_compiler_round_trips_token_data(tmp_path):
+    token_data = [
+        (0, "SET", None, 0, None, 3),
+        (1, "VARNAME", "a\x00b\nc", 1, 0, 3),
+        (1, "INTEGER", 2**70, 2, 0, 4),
+        (0, "PRINT", None, 0, None, 1),
+        (1, "FLOAT", float("inf"), 1, 0, 1),
+        (1, "TRUE", True, 1, 0, 1),
+        (1, "INTEGER", 1, 1, 0, 400),
+        (1, "FLOAT", 1.0, 1, 0, 400),
+    ]
+    content = {"tokens": token_data, "mtime": 1, "size": 2, "hash": "ab" * 32}
+    compiled_filename = str(tmp_path / "main.natc")
+    compiler_ = compiler.BinaryCompiler()
+    compiler_.write_content_to_file(content, compiled_filename)
+
+    contents = compiler_.read_content_from_file(compiled_filename)
+    token_data_ = list(contents.pop("tokens"))
+    assert token_data_ == token_data
+    assert [type(x[2]) for x in token_data_] == [type(x[2]) for x in token_data]
+    assert contents == {"mtime": 1, "size": 2, "hash": "ab" * 32}
+
+    with open(compiled_filename, "r+b") as file:
+        file.truncate(os.path.getsize(compiled_filename) - 1)
+    with pytest.raises(compiler.CompilerError):
+        compiler_.read_content_from_file(compiled_filename)
+
+
+def test_restored_token_trees_match_constructed_token_trees():
+    syntax_blocks = interpret.construct_tokens_from_string(
+        'define function f expecting [a] as {return a}\n'
+        'set b to "x\\ty"\nprint 1.5 and true\nprint b'
+    )
+    token_data: list = []
+    for token in syntax_blocks:
+        compiler._save_tokens(token, token_data)
+
+    def get_attributes(token):
+        values = [getattr(token, x) for x in Token.__slots__ if x != "tokens"]
+        return [token.__class__, values, [get_attributes(x) for x in token.tokens]]
+
+    expected = [get_attributes(x) for x in compiler._construct_token_trees(token_data)]
+    for _ in range(2):  # with and without the state of the token classes cached
+        assert [get_attributes(x) for x in compiler._restore_token_trees(token_data)] == expected
+    assert gc.isenabled()
+
+
+def test_compiled_file_in_old_format_is_recompiled(tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(Token, "MODULE_REGISTRY", modules.ModuleRegistry())
+    monkeypatch.setattr(Token, "TOKEN_COMPILER", compiler.BinaryCompiler())
+    (tmp_path / "lib.nat").write_text("set answer to 42\n", encoding="utf-8")
+    with open(tmp_path / "lib.natc", "wb") as file:
+        pickle.dump({"tokens": [], "hash": compiler.hash_file("lib.nat")}, file)
+
+    with pytest.raises(compiler.CompilerError):
+        Token.TOKEN_COMPILER.read_compiled_file("lib.nat")
+    syntax_blocks = interpret.construct_tokens_from_string(
+        'import [answer] from "lib.nat"\nprint answer'
+    )
+    interpret.run_tokens(syntax_blocks, interpreter.Interpreter())
+    assert capsys.readouterr().out == "42\n"
@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+"""Fixtures constructing initialised token trees"""
+
+import pytest
+
+from natscript import interpret
+from natscript.internal import interpreter
+
+
+@pytest.fixture
+def construct_tokens():
+    """Returns a function constructing the syntax blocks of a code string, which are
+    initialised by the returned interpreter.
+    """
+
+    def construct(code):
+        syntax_blocks = interpret.construct_tokens_from_string(code)
+        interpreter_ = interpreter.Interpreter()
+        for syntax_block in syntax_blocks:
+            interpreter_.init(syntax_block)
+        return syntax_blocks, interpreter_
+
+    return construct
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for the interpreter"""
+
+import pytest
+
+from natscript.internal import exceptions, interpreter, tokenvalue
+
+
+def test_function_scope_falls_back_to_globals():
+    interpreter_ = interpreter.Interpreter()
+    global_ = tokenvalue.Variable("x")
+    interpreter_.set_variable("x", global_)
+    interpreter_.add_stack()
+    assert interpreter_.check_variable("x")
+    assert interpreter_.get_variable("x") is global_
+
+    local = tokenvalue.Variable("x")
+    interpreter_.set_variable("x", local)
+    interpreter_.set_variable("y", local)
+    assert interpreter_.get_variable("x") is local
+    interpreter_.remove_stack()
+    assert interpreter_.get_variable("x") is global_
+    assert not interpreter_.check_variable("y")
+
+
+def test_removing_global_variable_hides_it_in_function_scope():
+    interpreter_ = interpreter.Interpreter()
+    interpreter_.set_variable("result", tokenvalue.Variable("result"))
+    interpreter_.add_stack()
+    interpreter_.remove_variable("result")
+    assert not interpreter_.check_variable("result")
+    with pytest.raises(exceptions.UndefinedVariableException):
+        interpreter_.get_variable("result")
+    interpreter_.remove_stack()
+    assert interpreter_.check_variable("result")
+
+
+def test_slot_scope_stores_layout_variables_in_slots():
+    interpreter_ = interpreter.Interpreter()
+    global_ = tokenvalue.Variable("x")
+    interpreter_.set_variable("x", global_)
+    layout = {"it": 0, "x": 1}
+    interpreter_.add_stack(layout)
+    slots = interpreter_.get_slots(layout)
+    assert slots == [None, None]
+    assert interpreter_.get_slots({"it": 0}) is None
+    assert interpreter_.get_variable("x") is global_
+
+    local = tokenvalue.Variable("x")
+    interpreter_.set_variable("x", local)
+    interpreter_.set_variable("y", local)
+    assert slots[1] is local
+    assert interpreter_.get_variable("y") is local
+    interpreter_.remove_variable("x")
+    assert slots[1] is None
+    assert not interpreter_.check_variable("x")
+    interpreter_.remove_stack()
+    assert interpreter_.get_slots(layout) is None
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for the lexers"""
+
+import glob
+
+import pytest
+
+from natscript import interpret
+from natscript.internal import lexer, token_
+from natscript.tokens_ import tokens as tokens_
+
+
+def _lex(code, lexer_type):
+    lex = interpret.create_lexer(lexer_type)
+    return [(token.__class__.__name__, token.value) for token in lex.lex(code)]
+
+
+@pytest.mark.parametrize(
+    "filepath", glob.glob("../doc/examples/**/*.nat", recursive=True)
+)
+def test_regex_lexer_matches_split_lexer(filepath):
+    with open(filepath, "r", encoding="utf-8") as file:
+        code = file.read().strip()
+    assert _lex(code, lexer.RegexLexer) == _lex(code, lexer.Lexer)
+
+
+def test_regex_lexer_separators():
+    tokens = _lex('print ["a, b" 1,2]# comment "x"', lexer.RegexLexer)
+    assert tokens == [
+        ("PRINT", None),
+        ("COLLECTION", None),
+        ("STRING", "a, b"),
+        ("INTEGER", 1),
+        ("COMMA", None),
+        ("INTEGER", 2),
+        ("COLLECTION_END", None),
+        ("COMMENT", None),
+        ("VARNAME", "comment"),
+        ("STRING", "x"),
+    ]
+
+
+def test_regex_lexer_keeps_linebreaks_after_trailing_whitespace():
+    code = "# note   \nprint 1  \n# x\nprint 2"
+    assert _lex(code, lexer.RegexLexer) == _lex(code, lexer.Lexer)
+    tokens = _lex("print 1 \t\n# x\t \nprint 2", lexer.RegexLexer)
+    assert [name for name, _ in tokens] == [
+        "PRINT",
+        "INTEGER",
+        "LINEBREAK",
+        "COMMENT",
+        "VARNAME",
+        "LINEBREAK",
+        "PRINT",
+        "INTEGER",
+    ]
+
+
+def test_regex_lexer_positions():
+    lex = interpret.create_lexer(lexer.RegexLexer)
+    tokens = list(lex.lex('print "a\nb" x\n  set y'))
+    positions = [(token.line, token.column) for token in tokens]
+    assert positions == [(1, 1), (1, 7), (2, 4), (2, 5), (3, 3), (3, 7)]
+
+
+def test_regex_type_cache_is_bounded():
+    token_factory = token_.TokenFactory(
+        tokens_.get_tokens(), tokens_.get_regex_tokens(), regex_type_cache_size=8
+    )
+    for i in range(100):
+        assert type(token_factory.create_token(str(i))).__name__ == "INTEGER"
+    assert type(token_factory.create_token('"0"')).__name__ == "STRING"
+    assert token_factory._get_regex_type.cache_info().currsize == 8
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for the lineariser"""
+
+from natscript import interpret
+from natscript.internal import interpreter
+from natscript.tokens_ import linear
+
+
+def test_loops_and_conditionals_are_lowered_to_jumps(construct_tokens):
+    code = "set i to 0\nwhile checked i less than 3 { if checked i equal to 1 then { break out } }"
+    syntax_blocks, _ = construct_tokens(code)
+    code_ = linear.Lineariser().linearise(syntax_blocks)
+    opcodes = [opcode for opcode, _, _ in code_.instructions]
+    assert linear.JUMP_IF_FALSE in opcodes
+    assert linear.JUMP_UNLESS_ONE in opcodes
+    runs = [argument for opcode, argument, _ in code_.instructions if opcode == linear.RUN]
+    assert all(x.__name__ != "run" for x in runs)  # no token is run recursively
+
+
+def test_loop_state_is_kept_per_run(capsys):
+    code = """
+set results to []
+for each a in [1 2] {
+    for each b in [3 4 5] {
+        if checked b equal to 4 then { break out }
+        append b to results
+    }
+}
+print results
+"""
+    linear.run_tokens(interpret.construct_tokens_from_string(code), interpreter.Interpreter())
+    assert capsys.readouterr().out == "[3, 3]\n"
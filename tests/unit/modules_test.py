@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for the module registry"""
+
+from natscript import interpret
+from natscript.internal import interpreter, modules
+from natscript.internal.token_ import Token
+
+
+def test_modules_are_run_once_until_reloaded(tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(Token, "MODULE_REGISTRY", modules.ModuleRegistry())
+    (tmp_path / "lib.nat").write_text('print "loading"\nset answer to 42\n', encoding="utf-8")
+    code = 'import [answer] from "lib.nat"\nset answer to 0\nimport [answer] from "lib.nat"'
+
+    interpreter_ = interpreter.Interpreter()
+    syntax_blocks = interpret.construct_tokens_from_string(code)
+    interpret.run_tokens(syntax_blocks, interpreter_)
+    interpret.run_tokens(syntax_blocks, interpreter_)
+    assert capsys.readouterr().out == "loading\n"
+    assert interpreter_.get_variable("answer").get_value() == 42
+    assert len(Token.MODULE_REGISTRY) == 1
+
+    Token.MODULE_REGISTRY.reload()
+    interpret.run_tokens(syntax_blocks, interpreter_)
+    assert capsys.readouterr().out == "loading\n"
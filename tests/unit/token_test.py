@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for the token representation"""
+
+import pickle
+
+from natscript.tokens_ import tokens
+
+
+def _walk(syntax_blocks):
+    for token in syntax_blocks:
+        yield token
+        yield from _walk(token.tokens)
+
+
+def test_tokens_have_no_instance_dict(construct_tokens):
+    syntax_blocks, _ = construct_tokens("for each x in [1, 2] { print x }")
+    assert not hasattr(syntax_blocks[0], "__dict__")
+    assert all("__slots__" in vars(type_) for type_ in tokens.get_tokens().values())
+
+
+def test_initialised_tokens_are_picklable(construct_tokens):
+    syntax_blocks, _ = construct_tokens('set x to [1, "a"] and print x')
+    copied = pickle.loads(pickle.dumps(syntax_blocks))
+    assert repr(copied) == repr(syntax_blocks)
+    assert copied[0].parent is None
+    assert [x.length for x in _walk(copied) if isinstance(x, tokens.COLLECTION)] == [2]
+
+
+def test_function_variables_are_resolved_to_slots(construct_tokens):
+    syntax_blocks, _ = construct_tokens(
+        "define function f expecting [a] as {\n"
+        "set b to a and define function g as { print b }\n}"
+    )
+    varnames = [x for x in _walk(syntax_blocks) if isinstance(x, tokens.VARNAME)]
+    layouts = {x.value: x.layout for x in varnames}
+    assert layouts["f"] is None and layouts["a"] is not layouts["b"]
+    assert layouts["a"] == {"it": 0, "b": 1, "a": 2, "g": 3}
+    assert [(x.value, x.slot) for x in varnames if x.layout is layouts["a"]] == [
+        ("b", 1),
+        ("a", 2),
+        ("g", 3),
+    ]
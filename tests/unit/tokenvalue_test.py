@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for the token values"""
+
+import pytest
+
+from natscript.internal import tokenvalue
+
+
+def test_value_cache_interns_small_immutable_values():
+    cache = tokenvalue.ValueCache()
+    assert cache.get(1) is cache.get(1)
+    assert cache.get("a") is cache.get("a")
+    assert cache.get(True) is not cache.get(1)
+    assert cache.get(10**6) is not cache.get(10**6)
+    assert cache.get(1.5) is not cache.get(1.5)
+    assert (cache.hits, cache.misses) == (3, 3)
+
+
+def test_value_cache_is_bounded():
+    cache = tokenvalue.ValueCache(maxsize=2)
+    first = cache.get(1)
+    cache.get(2)
+    cache.get(1)
+    cache.get(3)
+    assert len(cache) == 2
+    assert cache.get(1) is first
+    assert cache.misses == 3
+
+
+def test_value_cache_rejects_unhashable_values():
+    with pytest.raises(TypeError):
+        tokenvalue.ValueCache().get([1, 2])
+
+
+def test_shared_value_copy_on_write():
+    shared = tokenvalue.ValueCache().get(True)
+    value = shared.unshare()
+    value.negate_value()
+    assert (shared.value, value.value) == (True, False)
+    variable = tokenvalue.Variable("x")
+    assert variable.unshare() is variable
+
+
+def test_lazy_range_is_only_materialised_when_mutated():
+    sequence = tokenvalue.LazyRange(range(10**12))
+    assert len(sequence) == 10**12 and 10**11 in sequence
+    assert (sequence[0], sequence[-1]) == (0, 10**12 - 1)
+    assert sequence[2:5] == [2, 3, 4] and isinstance(sequence[2:5], tokenvalue.LazyRange)
+
+    small = tokenvalue.LazyRange(range(3))
+    alias = small
+    alias.append(1)
+    assert repr(small) == "[0, 1, 2, 1]"
+    small.sort()
+    assert small == [0, 1, 1, 2] and small.materialise() is small.materialise()
+
+
+def test_iterable_value_returns_copies_of_cached_values():
+    item = tokenvalue.Value(1)
+    iterable = tokenvalue.IterableValue([item, 2])
+    value = iterable.get_value()
+    value.append(3)
+    assert iterable.get_value() == [1, 2] and iterable.get_value() is not value
+
+    item.value = 5  # the contained values are only unwrapped once
+    assert iterable.get_value() == [1, 2]
+    iterable.value[1] = 4
+    iterable.invalidate()
+    assert iterable.get_value() == [5, 4]
+    iterable.value = [6]
+    assert iterable.get_value() == [6]
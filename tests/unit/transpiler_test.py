@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for the Python transpiler"""
+
+import os
+
+import pytest
+
+from natscript import interpret
+from natscript.internal import exceptions, interpreter, lexer
+from natscript.tokens_ import compiler, transpiler
+
+CODE = """
+define function first_even expecting [numbers] as {
+    for each n in numbers {
+        if checked n greater than 6 then { break out }
+        set half to n and divide half by 2 round half
+        multiply half by 2
+        if checked half equal to n then { return n }
+    }
+    return 0
+}
+set total to 0
+set i to 0
+while true {
+    add 1 to i
+    if checked i greater than 5 then { break out }
+    call first_even with [[1 3 i]] and add result to total
+}
+print [total, i, not checked total equal to 6]
+"""
+
+
+def test_transpiled_code_matches_tree_backend(capsys):
+    interpret.run_tokens(interpret.construct_tokens_from_string(CODE), interpreter.Interpreter())
+    expected = capsys.readouterr().out
+    transpiler.run_tokens(interpret.construct_tokens_from_string(CODE), interpreter.Interpreter())
+    assert capsys.readouterr().out == expected
+    assert expected == "[6, 6, false]\n"
+
+
+def test_transpiled_code_traces_runtime_exceptions(construct_tokens):
+    syntax_blocks, interpreter_ = construct_tokens(
+        'define function f as {\nset s to "a" and add 1 to s\n}\ncall f'
+    )
+    transpiler_ = transpiler.PythonTranspiler()
+    module = transpiler_.load(transpiler_.transpile(syntax_blocks), syntax_blocks)
+    with pytest.raises(exceptions.TypeException) as exc:
+        module(interpreter_)
+    trace = [type(x).__name__ for x in exc.value.token_stack]
+    assert trace == ["ADD", "ADD", "CALL"]
+
+
+def test_transpiled_file_is_invalidated_by_source_hash(construct_tokens, tmp_path):
+    filename = str(tmp_path / "module.nat")
+    with open(filename, "w", encoding="utf-8") as file:
+        file.write("print 1")
+    transpiler_ = transpiler.PythonTranspiler()
+    source = transpiler_.transpile(construct_tokens("print 1")[0])
+    transpiler_.write_transpiled_file(source, filename)
+    assert transpiler_.read_transpiled_file(filename) == source
+
+    with open(filename, "w", encoding="utf-8") as file:
+        file.write("print 2")
+    with pytest.raises(compiler.CompilerError):
+        transpiler_.read_transpiled_file(filename)
+
+
+def test_transpiled_file_is_keyed_by_version_and_lexer_and_cached_if_directory_is_read_only(
+    construct_tokens, tmp_path, monkeypatch
+):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    monkeypatch.setattr(os, "access", lambda *_: False)
+    filename = str(tmp_path / "module.nat")
+    with open(filename, "w", encoding="utf-8") as file:
+        file.write("print 1")
+    transpiler_ = transpiler.PythonTranspiler()
+    source = transpiler_.transpile(construct_tokens("print 1")[0])
+    transpiler_.write_transpiled_file(source, filename)
+    transpiled_filename = transpiler_.get_transpiled_filename(filename)
+    assert not os.path.isfile(transpiled_filename)
+    assert os.path.isfile(compiler.get_cached_filename(transpiled_filename))
+
+    monkeypatch.setattr(compiler, "hash_file", lambda _: pytest.fail("source was hashed"))
+    assert transpiler_.read_transpiled_file(filename) == source
+    with monkeypatch.context() as patch:
+        patch.setattr(transpiler, "VERSION", "0.0.0")
+        with pytest.raises(compiler.CompilerError):
+            transpiler_.read_transpiled_file(filename)
+    monkeypatch.setattr(interpret, "LEXER_TYPE", lexer.LEXERS["split"])
+    with pytest.raises(compiler.CompilerError):
+        transpiler_.read_transpiled_file(filename)
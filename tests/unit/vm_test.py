@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for the register virtual machine"""
+
+from natscript.tokens_ import vm
+
+
+def test_values_are_passed_in_registers(construct_tokens, capsys):
+    syntax_blocks, interpreter_ = construct_tokens(
+        "set x to 1\nwhile checked x less than 5 { add 2 to x }\nprint x"
+    )
+    code = vm.RegisterCompiler().compile(syntax_blocks)
+    code.run(interpreter_)
+    assert capsys.readouterr().out == "5\n"
+    assert vm.PUSH not in code.opcodes and vm.POP not in code.opcodes
+    assert interpreter_.stack_pop().get_value() == 5  # SET leaves its variable on the stack
+
+
+def test_variable_lookups_are_fused(construct_tokens):
+    syntax_blocks, _ = construct_tokens("set x to 1 and set y to 2\nadd x to y")
+    code = vm.RegisterCompiler().compile(syntax_blocks)
+    assert vm.LOADS in code.opcodes
+    assert vm.LOAD not in code.opcodes[code.opcodes.index(vm.LOADS) :]
+
+
+def test_disassemble_lists_instructions_of_clauses(construct_tokens):
+    syntax_blocks, _ = construct_tokens("define function f as { return 1 }\ncall f")
+    code = vm.RegisterCompiler().compile(syntax_blocks)
+    listing = vm.disassemble(code)
+    assert listing.startswith("module: ")
+    assert "CALL             r" in listing
+    assert "SyntaxTree(CLAUSE): 1 instructions" in listing
+    assert "RETURN           r1, -" in listing
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+"""Measures the cost of function calls depending on the number of global variables.
+Run from root directory using e.g. python tools/benchmarking/call_frames.py
+"""
+# pylint: skip-file
+
+import timeit
+
+from natscript import interpret
+from natscript.internal import interpreter
+
+CALLS = 5000
+code = f"""
+define function increment expecting [x] as {{ add 1 to x and return x }}
+set n to 0
+while checked n less than {CALLS} {{ call increment with [n] and set n to result }}
+"""
+
+for globals_ in (0, 100, 1000):
+    definitions = "".join(f"set global{i} to {i}\n" for i in range(globals_))
+    syntax_blocks = interpret.construct_tokens_from_string(definitions + code)
+    seconds = min(
+        timeit.repeat(
+            lambda: interpret.run_tokens(syntax_blocks, interpreter.Interpreter()),
+            number=1,
+            repeat=5,
+        )
+    )
+    per_call = seconds / CALLS * 1e6
+    print(f"{globals_:>5} globals: {seconds:.3f}s ({per_call:.1f}us per call)")
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""Measures the cost of leaving loops and functions early using break out and return,
+for all interpreter backends.
+Run from root directory using e.g. python tools/benchmarking/control_flow.py
+"""
+# pylint: skip-file
+
+import timeit
+
+from natscript import interpret
+from natscript.internal import interpreter
+
+ITERATIONS = 2000
+programs = {
+    "early break": f"""
+set numbers to range from 0 to 10
+set i to 0
+while checked i less than {ITERATIONS} {{
+    add 1 to i
+    for each n in numbers {{ if checked n equal to 2 then {{ break out }} }}
+}}
+""",
+    "nested return": f"""
+define function find expecting [n] as {{
+    while true {{
+        if checked n greater than 0 then {{
+            if checked n less than {ITERATIONS + 1} then {{ return n }}
+        }}
+    }}
+}}
+set i to 0
+while checked i less than {ITERATIONS} {{ add 1 to i and call find with [i] }}
+""",
+    "skip": f"""
+set i to 0
+while checked i less than {ITERATIONS} {{
+    add 1 to i
+    for each n in [1 2 3] {{ skip it }}
+}}
+""",
+}
+
+for name, code in programs.items():
+    times = []
+    for backend_name, backend in interpret.BACKENDS.items():
+        seconds = min(
+            timeit.repeat(
+                lambda: backend(
+                    interpret.construct_tokens_from_string(code), interpreter.Interpreter()
+                ),
+                number=1,
+                repeat=5,
+            )
+        )
+        times.append(f"{backend_name} {seconds * 1000:.1f}ms")
+    print(f"{name:>13}: {', '.join(times)}")
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""Microbenchmark lexing a generated file of 100k tokens, comparing
+TokenFactory.create_token against probing each regex token pattern in turn.
+Run from root directory using e.g. python tools/benchmarking/create_token.py
+"""
+# pylint: skip-file
+
+import os
+import re
+import tempfile
+import timeit
+
+from natscript import interpret
+from natscript.tokens_ import tokens
+
+TOKENS = 100_000
+line = 'set value{0} to "text {0}" and add 1.5 to count{0} print -{0}\n'
+tokens_per_line = 12
+code = "".join(line.format(i % 500) for i in range(TOKENS // tokens_per_line))
+
+with tempfile.TemporaryDirectory() as directory:
+    filepath = os.path.join(directory, "tokens.nat")
+    with open(filepath, "w", encoding="utf-8") as file:
+        file.write(code)
+    with open(filepath, "r", encoding="utf-8") as file:
+        code = file.read()
+
+lexemes = interpret.create_lexer().PATTERN.findall(code)
+lexemes = [next(group for group in groups if group) for groups in lexemes]
+lexemes = [lexeme for lexeme in lexemes if not lexeme.isspace() or lexeme == "\n"]
+print(f"{len(lexemes)} tokens")
+
+lex = interpret.create_lexer()
+seconds = timeit.timeit(lambda: list(lex.lex(code)), number=1)
+print(f"lex:                {seconds:.3f}s")
+
+token_factory = lex.token_factory
+seconds = timeit.timeit(
+    lambda: [token_factory.create_token(x) for x in lexemes], number=1
+)
+print(f"create_token:       {seconds:.3f}s")
+
+keywords = tokens.get_tokens()
+patterns = [(re.compile(k), v) for k, v in tokens.get_regex_tokens().items()]
+
+
+def probe(lexeme):
+    if lexeme in keywords:
+        return keywords[lexeme](value=None)
+    for pattern, token_type in patterns:
+        if pattern.search(lexeme):
+            return token_type(value=lexeme)
+
+
+seconds = timeit.timeit(lambda: [probe(x) for x in lexemes], number=1)
+print(f"sequential probing: {seconds:.3f}s")
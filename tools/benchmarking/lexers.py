@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+"""Compares the lexers on a generated script containing many string literals.
+Run from root directory using e.g. python tools/benchmarking/lexers.py
+"""
+# pylint: skip-file
+
+import timeit
+
+from natscript import interpret
+from natscript.internal import lexer
+
+LINES = 2000
+code = "\n".join(
+    f'set s{i} to "string literal {i}" and print [s{i}, "{i}", {i}]'
+    for i in range(LINES)
+)
+
+for name, lexer_type in lexer.LEXERS.items():
+    lex = interpret.create_lexer(lexer_type)
+    seconds = timeit.timeit(lambda: list(lex.lex(code)), number=1)
+    print(f"{name:6s} lexer: {seconds:.3f}s for {LINES} lines")
@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+"""Measures how parse time scales with the number of tokens in a file.
+Run from root directory using e.g. python tools/benchmarking/parser_scaling.py
+"""
+# pylint: skip-file
+
+import timeit
+
+from natscript import interpret
+from natscript.internal import parsing
+
+# 20 tokens per line, including a comment and skip tokens
+line = "set the value to 1 and add 2 to it # comment\nprint [1, 2]\n"
+tokens_per_line = 20
+
+for tokens in (1_000, 10_000, 100_000, 1_000_000):
+    code = line * (tokens // tokens_per_line)
+    tokens_ = list(interpret.create_lexer().lex(code))
+    seconds = timeit.timeit(
+        lambda: list(parsing.Parser().parse(list(tokens_))), number=1
+    )
+    per_token = seconds / len(tokens_) * 1e6
+    print(f"{len(tokens_):>9} tokens: {seconds:8.3f}s ({per_token:.2f}us per token)")
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+"""Measures the memory held by parsed and initialised token trees.
+Run from root directory using e.g. python tools/benchmarking/token_memory.py
+"""
+# pylint: skip-file
+
+import gc
+import tracemalloc
+
+from natscript import interpret
+from natscript.internal import interpreter
+
+LINES = 1000
+line = "set value to 1 and add 2 to it\nif checked value is equal to 3 then { print [1, value] }\n"
+code = line * LINES
+
+gc.collect()
+tracemalloc.start()
+interpreter_ = interpreter.Interpreter()
+syntax_blocks = interpret.construct_tokens_from_string(code)
+parsed, _ = tracemalloc.get_traced_memory()
+for syntax_block in syntax_blocks:
+    interpreter_.init(syntax_block)
+gc.collect()
+initialised, _ = tracemalloc.get_traced_memory()
+tracemalloc.stop()
+
+
+def count_tokens(token):
+    return 1 + sum(count_tokens(x) for x in token.tokens)
+
+
+count = sum(count_tokens(x) for x in syntax_blocks)
+print(f"{count} tokens")
+print(f"parsed:      {parsed / count:6.1f} bytes per token")
+print(f"initialised: {initialised / count:6.1f} bytes per token")
+print(f"{initialised / count * 10_000 / 1024:.0f} KiB per 10k tokens")